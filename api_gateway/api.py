@@ -1,7 +1,9 @@
 """API module."""
 import logging
+import math
 
 import flask.scaffold
+from flask import make_response
 
 # monkeypatching this because it flask_restx has a bug
 # pylint:disable=E1101
@@ -10,7 +12,10 @@ flask.helpers._endpoint_from_view_func = flask.scaffold._endpoint_from_view_func
 from flask_restx import Api
 
 from api_gateway import __version__
+from api_gateway.helpers import codec
+from api_gateway.helpers.server_timing import server_timing
 from api_gateway.namespaces import (
+    batch_namespace,
     course_namespace,
     payment_namespace,
     status_namespace,
@@ -25,6 +30,17 @@ api.add_namespace(course_namespace, path='/courses')
 api.add_namespace(user_namespace, path='/auth-server')
 api.add_namespace(status_namespace, path='/status')
 api.add_namespace(payment_namespace, path='/payments')
+api.add_namespace(batch_namespace, path='/batch')
+
+
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """Encodes the responses with the gateway JSON codec."""
+    with server_timing.phase('encode'):
+        body = codec.dumps_bytes(data) + b'\n'
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    return response
 
 
 @api.errorhandler
@@ -33,4 +49,7 @@ def handle_exception(error: Exception):
     logger.error('Unhandled Exception: %s - %s', str(type(error)), str(error))
 
     message = "Error: " + getattr(error, 'message', str(error))
-    return {'message': message}, getattr(error, 'code', 500)
+    headers = {}
+    if getattr(error, 'retry_after', None) is not None:
+        headers['Retry-After'] = str(max(int(math.ceil(error.retry_after)), 1))
+    return {'message': message}, getattr(error, 'code', 500), headers
@@ -1,19 +1,41 @@
 """Flask api."""
 import logging
 
-from flask import Flask
+from flask import Flask, Request
 from flask_cors import CORS
 
+from api_gateway import proxy
 from api_gateway.api import api
+from api_gateway.helpers import codec
+from api_gateway.helpers.compression import compression
+from api_gateway.helpers.metrics import metrics
+from api_gateway.helpers.profiling import profiler
+from api_gateway.helpers.rate_limit import rate_limiter
+from api_gateway.helpers.server_timing import server_timing
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+class JsonRequest(Request):
+    """Request whose JSON body is parsed by the gateway codec."""
+
+    json_module = codec
+
+
 def create_app():
     """creates a new app instance"""
     new_app = Flask(__name__)
+    new_app.request_class = JsonRequest
     new_app.config["ERROR_404_HELP"] = False
+    # first, so their hooks time the proxy fast path too
+    metrics.init_app(new_app)
+    # before anything calls an upstream, the token check included
+    rate_limiter.init_app(new_app)
+    server_timing.init_app(new_app)
+    profiler.init_app(new_app)
     api.init_app(new_app)
+    proxy.init_app(new_app)
     CORS(new_app)
+    compression.init_app(new_app)
     return new_app
@@ -0,0 +1,412 @@
+"""Asyncio (ASGI) serving mode.
+
+Serves the same `/api/courses`, `/api/auth-server`, `/api/payments`,
+`/api/status`, `/api/batch` and `/metrics` surface as the Flask app, with
+the same rate limit and request metrics, but a single process can keep
+thousands of proxied calls in flight instead of blocking a worker on each.
+
+Run it with `uvicorn api_gateway.asgi:app` or, behind gunicorn,
+`gunicorn -k uvicorn.workers.UvicornWorker "api_gateway.asgi:app"`.
+"""
+import asyncio
+import math
+
+from api_gateway.clients.async_client import (
+    async_auth_server_client,
+    async_course_client,
+    async_payment_client,
+    httpx,
+)
+from api_gateway.helpers import batch, codec
+from api_gateway.helpers.identity_cache import identity_cache, update_identity_cache
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics, route_group
+from api_gateway.helpers.rate_limit import RateLimited, rate_limiter
+from api_gateway.helpers.router import proxy_router
+from api_gateway.helpers.status import (
+    GATEWAY_STATUS,
+    PROBE_TIMEOUTS,
+    service_status,
+    timeout_status,
+)
+from api_gateway.helpers.tokens import InvalidToken, token_verifier
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+PREFLIGHT_HEADERS = [
+    (b'access-control-allow-methods', b'GET, POST, PUT, PATCH, DELETE, OPTIONS'),
+    (b'access-control-allow-headers', b'Authorization, Content-Type'),
+]
+
+
+class InvalidBody(Exception):
+    """The body of the request is not valid JSON."""
+
+    code = 400
+    message = (
+        'The browser (or proxy) sent a request that this server could not '
+        'understand.'
+    )
+
+
+class Request:
+    """The bits of an ASGI http request the gateway needs."""
+
+    def __init__(self, scope, body):
+        self.method = scope['method'].lower()
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('utf-8')
+        self.headers = {
+            name.decode('latin-1').lower(): value.decode('latin-1')
+            for name, value in scope.get('headers', [])
+        }
+        self.body = body
+        self.payload = None
+
+    @property
+    def token(self):
+        return self.headers.get('authorization')
+
+    @property
+    def upstream_path(self):
+        return self.path.split('/api', 1)[1]
+
+    def decode(self):
+        """Parse the JSON body into `payload`, raising InvalidBody if invalid."""
+        if not self.body:
+            return
+        try:
+            self.payload = codec.loads(self.body)
+        except ValueError:
+            raise InvalidBody() from None
+
+
+class Response:
+    """Status, headers and raw body to be sent back to the client."""
+
+    def __init__(self, status_code, body, content_type=b'application/json', headers=()):
+        self.status_code = status_code
+        self.body = body
+        self.content_type = content_type
+        self.headers = list(headers)
+
+    @classmethod
+    def json(cls, data, status_code=200):
+        return cls(status_code, codec.dumps_bytes(data) + b'\n')
+
+    @classmethod
+    def upstream(cls, status_code, headers, body):
+        content_type = headers.get('content-type', 'application/json')
+        return cls(status_code, body, content_type.encode('latin-1'))
+
+    async def send(self, send):
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': self.status_code,
+                'headers': [
+                    (b'content-type', self.content_type),
+                    (b'content-length', str(len(self.body)).encode()),
+                ]
+                + CORS_HEADERS
+                + self.headers,
+            }
+        )
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+def error_response(error):
+    """Mirror of the Flask app `handle_exception` error handler."""
+    logger.error('Unhandled Exception: %s - %s', str(type(error)), str(error))
+    message = 'Error: ' + getattr(error, 'message', str(error))
+    response = Response.json({'message': message}, getattr(error, 'code', 500))
+    if getattr(error, 'retry_after', None) is not None:
+        response.headers.append(retry_after_header(error))
+    return response
+
+
+def retry_after_header(error):
+    retry_after = max(int(math.ceil(error.retry_after)), 1)
+    return (b'retry-after', str(retry_after).encode())
+
+
+def rate_limited(request):
+    """Mirror of the Flask app rate limit hook, a 429 over the limit."""
+    if not request.token:
+        return None
+    try:
+        rate_limiter.check(route_group(request.path), request.token)
+    except RateLimited as e:
+        response = Response.json({'message': 'Error: ' + e.message}, e.code)
+        response.headers.append(retry_after_header(e))
+        return response
+    return None
+
+
+def unauthorized():
+    logger.error('Authorization token is required.')
+    return Response.json({'message': 'Authorization token is required.'}, 401)
+
+
+async def authenticate(token):
+    """Async counterpart of `AuthServerClient.authenticate`."""
+    if token_verifier.enabled:
+        try:
+            claims = token_verifier.verify(token)
+        except InvalidToken as e:
+            logger.info('Token rejected locally: %s', e.message)
+            return {'message': e.message}, e.code
+        return {'_id': claims['_id']}, 200
+
+    identity = identity_cache.get(token)
+    if identity is not None:
+        return {'_id': identity.user_id}, identity.status
+
+    res_body, status_code = await async_auth_server_client.call(
+        'get', '/auth-server/v1/users/me', None, {'x-auth-token': token}
+    )
+    if status_code == 200 and isinstance(res_body, dict):
+        identity_cache.put(token, res_body.get('_id'), status_code)
+    return res_body, status_code
+
+
+async def proxy_courses(request):
+    logger.info('Courses Call')
+    if not request.token:
+        return unauthorized()
+    auth_body, auth_status_code = await authenticate(request.token)
+    if auth_status_code != 200:
+        return Response.json(auth_body, auth_status_code)
+
+    path = request.upstream_path
+    if request.query_string:
+        path = f'{path}?{request.query_string}'
+    headers = {'x-auth-token': request.token, 'x-user-id': auth_body['_id']}
+    return Response.upstream(
+        *await async_course_client.request(
+            request.method, path, request.payload, headers
+        )
+    )
+
+
+async def proxy_payments(request):
+    logger.info('Payments Call')
+    if not request.token:
+        return unauthorized()
+    auth_body, auth_status_code = await authenticate(request.token)
+    if auth_status_code != 200:
+        return Response.json(auth_body, auth_status_code)
+
+    headers = {'x-auth-token': request.token}
+    return Response.upstream(
+        *await async_payment_client.request(
+            request.method, request.upstream_path, request.payload, headers
+        )
+    )
+
+
+async def proxy_users(request):
+    logger.info('Users Call')
+    if not request.token:
+        return unauthorized()
+
+    path = request.upstream_path
+    status_code, headers, body = await async_auth_server_client.request(
+        request.method, path, request.payload, {'x-auth-token': request.token}
+    )
+    if path.rstrip('/').rsplit('/', 1)[-1].lower().startswith('sign'):
+        try:
+            res_body = codec.loads(body)
+        except ValueError:
+            res_body = None
+        update_identity_cache(path, request.token, res_body, status_code)
+    return Response.upstream(status_code, headers, body)
+
+
+async def _service_status(name, client, path, headers):
+    timeout = PROBE_TIMEOUTS[name]
+    try:
+        return (
+            await asyncio.wait_for(client.call('get', path, None, headers), timeout)
+        )[0]
+    except asyncio.TimeoutError:
+        logger.warning('Status probe of %s timed out after %ss', name, timeout)
+        return timeout_status(timeout)
+    except httpx.TransportError:
+        return service_status('Offline')
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning('Status probe of %s failed: %s', name, e)
+        return service_status('Degraded', str(e))
+
+
+async def server_status(request):
+    logger.info('Status Call')
+    if not request.token:
+        return unauthorized()
+    headers = {'x-auth-token': request.token}
+
+    auth_body, auth_status_code = await async_auth_server_client.call(
+        'get', '/auth-server/v1/admin/users', None, headers
+    )
+    if auth_status_code != 200:
+        return Response.json(auth_body, auth_status_code)
+
+    auth_server, courses, payments = await asyncio.gather(
+        _service_status(
+            'auth-server', async_auth_server_client, '/auth-server/v1/status', headers
+        ),
+        _service_status('courses', async_course_client, '/courses/v1/status', headers),
+        _service_status('payments', async_payment_client, '/payments/status', headers),
+    )
+    status = {
+        'api-gateway': dict(GATEWAY_STATUS),
+        'auth-server': auth_server,
+        'courses': courses,
+        'payments': payments,
+    }
+    return Response.json(status)
+
+
+async def _batch_call(call, token, user_id, semaphore):
+    upstream, method, path, body = call
+    headers = {'x-auth-token': token}
+    if upstream == 'courses':
+        headers['x-user-id'] = user_id
+    client = {
+        'courses': async_course_client,
+        'payments': async_payment_client,
+        'users': async_auth_server_client,
+    }[upstream]
+    async with semaphore:
+        try:
+            res_body, status_code = await client.call(method, path, body, headers)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.error('Unhandled Exception: %s - %s', str(type(e)), str(e))
+            return batch.error_result(e)
+    if upstream == 'users':
+        update_identity_cache(path, token, res_body, status_code)
+    return batch.result(status_code, res_body)
+
+
+async def _answered(result):
+    return result
+
+
+async def proxy_batch(request):
+    logger.info('Batch Call')
+    if not request.token:
+        return unauthorized()
+    try:
+        items = batch.parse(request.payload)
+    except batch.InvalidBatch as e:
+        return Response.json({'message': e.message}, e.code)
+    auth_body, auth_status_code = await authenticate(request.token)
+    if auth_status_code != 200:
+        return Response.json(auth_body, auth_status_code)
+
+    semaphore = asyncio.Semaphore(batch.max_concurrency)
+    responses = await asyncio.gather(
+        *(
+            _answered(call)
+            if isinstance(call, dict)
+            else _batch_call(call, request.token, auth_body['_id'], semaphore)
+            for call in batch.rate_limit(items, batch.plan(items), request.token)
+        )
+    )
+    return Response.json({'responses': list(responses)})
+
+
+async def metrics_view(request):
+    """`/metrics`, like the Flask app serves it."""
+    if not metrics.enabled or not metrics.token:
+        return Response.json({'message': 'Not Found'}, 404)
+    if not metrics.authorized(request.headers.get('authorization')):
+        return Response.json({'message': 'Unauthorized'}, 401)
+    return Response(200, metrics.render().encode(), b'text/plain; version=0.0.4')
+
+
+router = proxy_router(
+    {'courses': proxy_courses, 'users': proxy_users, 'payments': proxy_payments}
+)
+ROUTES = (
+    ('/api/status/', server_status, ('GET',)),
+    ('/api/batch', proxy_batch, ('POST',)),
+    ('/metrics', metrics_view, ('GET',)),
+)
+
+
+def resolve(path):
+    """Return the handler and allowed methods for a path, if it is served."""
+    route = router.match(path)
+    if route is not None:
+        return route.handler, route.methods
+    if path == '/api/status':
+        path = '/api/status/'
+    for prefix, handler, methods in ROUTES:
+        if path.startswith(prefix):
+            return handler, methods
+    return None, ()
+
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def lifespan(receive, send):
+    clients = (async_auth_server_client, async_course_client, async_payment_client)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.gather(*(client.aclose() for client in clients))
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def respond(scope, receive):
+    """The response to an http request."""
+    handler, methods = resolve(scope['path'])
+    method = scope['method'].upper()
+    if handler is None:
+        return Response.json({'message': 'Not Found'}, 404)
+    if method == 'OPTIONS':
+        return Response(200, b'', headers=PREFLIGHT_HEADERS)
+    if method not in methods:
+        return Response.json({'message': 'Method Not Allowed'}, 405)
+    request = Request(scope, await read_body(receive))
+    try:
+        limited = rate_limited(request)
+        if limited is not None:
+            return limited
+        # like the Flask app, before the token check or any upstream call
+        request.decode()
+        return await handler(request)
+    except InvalidBody as e:
+        return Response.json({'message': e.message}, e.code)
+    except Exception as error:  # pylint: disable=broad-except
+        return error_response(error)
+
+
+async def app(scope, receive, send):
+    """ASGI entrypoint."""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    route = route_group(scope['path'])
+    started = metrics.request_started(route)
+    status = 500
+    try:
+        response = await respond(scope, receive)
+        status = response.status_code
+        await response.send(send)
+    finally:
+        metrics.request_finished(route, scope['method'], status, started)
@@ -3,3 +3,10 @@
 from youconfigme import AutoConfig
 
 config = AutoConfig()
+
+
+def to_bool(value):
+    """Cast a config value such as '1', 'true' or 'no' to a bool."""
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
@@ -0,0 +1,145 @@
+"""Non-blocking pooled upstream client used by the asyncio serving mode."""
+import logging
+import time
+
+try:
+    import httpx
+except ModuleNotFoundError:  # pragma: no cover
+    httpx = None  # type: ignore
+
+from api_gateway.cfg import config
+from api_gateway.clients.auth_server_client import auth_server_client
+from api_gateway.clients.circuit_breaker import CircuitOpenError
+from api_gateway.clients.course_client import course_client
+from api_gateway.clients.payment_client import payment_client
+from api_gateway.constants import (
+    DEFAULT_ASYNC_KEEPALIVE_EXPIRY,
+    DEFAULT_ASYNC_MAX_CONNECTIONS,
+    DEFAULT_ASYNC_MAX_KEEPALIVE,
+)
+from api_gateway.helpers import codec
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics
+
+# the root logger is at DEBUG, and httpcore logs every step of every request
+logging.getLogger('httpcore').setLevel(logging.INFO)
+logging.getLogger('httpx').setLevel(logging.WARNING)
+
+
+class AsyncClient:
+    """Async counterpart of `BaseClient`, backed by an `httpx.AsyncClient` pool.
+
+    It mirrors the settings of the sync client of the same upstream, and
+    shares its circuit breaker, concurrency limiter and metrics. The
+    underlying pool is created lazily so that it is bound to the event loop
+    of the worker that serves the requests.
+    """
+
+    def __init__(self, upstream):
+        self.name = upstream.name
+        self.section = upstream.section
+        self.url = upstream.url
+        self.timeout = (upstream.connect_timeout, upstream.read_timeout)
+        self.breaker = upstream.breaker
+        self.limiter = upstream.limiter
+        self.max_connections = self._setting(
+            'async_max_connections', DEFAULT_ASYNC_MAX_CONNECTIONS, int
+        )
+        self.max_keepalive = self._setting(
+            'async_max_keepalive', DEFAULT_ASYNC_MAX_KEEPALIVE, int
+        )
+        self.keepalive_expiry = self._setting(
+            'async_keepalive_expiry', DEFAULT_ASYNC_KEEPALIVE_EXPIRY, float
+        )
+        self._client = None
+
+    def _setting(self, key, default, cast):
+        fallback = getattr(config.upstream, key)(default=default, cast=cast)
+        return getattr(getattr(config, self.section), key)(default=fallback, cast=cast)
+
+    @property
+    def client(self):
+        if self._client is None:
+            if httpx is None:
+                raise RuntimeError(
+                    'The asyncio serving mode requires httpx, '
+                    'install the "asgi" extra.'
+                )
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            )
+        return self._client
+
+    async def request(self, method, path, body, headers):
+        """Send a request and return the upstream status, headers and raw body."""
+        await self.limiter.acquire_async()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.limiter.cancel()
+            raise
+        labels = (('upstream', self.section),)
+        metrics.inc('gateway_upstream_requests_in_flight', labels)
+        started = time.monotonic()
+        try:
+            r = await self.client.request(
+                method.upper(),
+                path,
+                content=codec.dumps_bytes(body or {}),
+                headers={'content-type': 'application/json', **headers},
+            )
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            metrics.inc('gateway_upstream_requests_in_flight', labels, -1)
+            self._record(labels, 'error', elapsed)
+            self.limiter.release(elapsed, failed=True)
+            self.breaker.record(True, elapsed)
+            logger.error(
+                'Error when making request path: "%s", token: "%s" to %s. Error: %s',
+                path,
+                headers.get('x-auth-token'),
+                self.name,
+                e,
+            )
+            raise e
+        elapsed = time.monotonic() - started
+        metrics.inc('gateway_upstream_requests_in_flight', labels, -1)
+        self._record(labels, r.status_code, elapsed)
+        self.limiter.release(elapsed)
+        self.breaker.record(r.status_code >= 500, elapsed)
+
+        logger.info(
+            '%s async client method: %s, path: %s, status_code: %s',
+            self.name,
+            method,
+            path,
+            r.status_code,
+            extra={'status_code': r.status_code},
+        )
+        return r.status_code, r.headers, r.content
+
+    @staticmethod
+    def _record(labels, status, elapsed):
+        metrics.observe('gateway_upstream_request_duration_seconds', labels, elapsed)
+        metrics.inc('gateway_upstream_requests_total', labels + (('status', status),))
+
+    async def call(self, method, path, body, headers):
+        """Send a request and decode its JSON response."""
+        status_code, _, content = await self.request(method, path, body, headers)
+        return codec.loads(content), status_code
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+async_auth_server_client = AsyncClient(auth_server_client)
+async_course_client = AsyncClient(course_client)
+async_payment_client = AsyncClient(payment_client)
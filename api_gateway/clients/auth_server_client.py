@@ -1,48 +1,60 @@
-import json
 import os
 
-import requests
-
+from api_gateway.clients.base_client import BaseClient
+from api_gateway.helpers.identity_cache import identity_cache
 from api_gateway.helpers.logger import logger
+from api_gateway.helpers.tokens import InvalidToken, token_verifier
+
 
+class AuthServerClient(BaseClient):
+    name = 'Auth Server'
+    section = 'auth_server'
 
-class AuthServerClient:
     def __init__(self):
-        self.url = os.environ.get(
-            'FRUX_SC_URL', 'https://ubademy-g2-auth-server.herokuapp.com'
+        super().__init__(
+            os.environ.get(
+                'AUTH_SERVER_URL',
+                os.environ.get(
+                    'FRUX_SC_URL', 'https://ubademy-g2-auth-server.herokuapp.com'
+                ),
+            )
         )
 
-    def _request(
-        self, method, path, body, token,
-    ):
-        if not body:
-            body = {}
-        func = getattr(requests, method)
-        try:
-            r = func(f'{self.url}{path}', json=body, headers={'x-auth-token': token})
-        except Exception as e:
-            logger.error(
-                'Error when making request path: "%s", token: "%s" to Auth Server. Error: %s',
-                path,
-                token,
-                e,
-            )
-            raise e
+    def _request(self, method, path, body, token, timeout=None):
+        return self._send(method, path, body, {'x-auth-token': token}, timeout)
 
-        res_body = json.loads(r.content.decode())
+    def call(self, method, path, body, token, timeout=None):
+        return self._request(method, path, body, token, timeout)
 
-        logger.info(
-            'AuthServerClient method: %s, path: %s, status_code: %s, body: %s',
-            method,
-            path,
-            r.status_code,
-            res_body,
+    def forward(self, method, path, body, token, headers=None):
+        return self._forward(
+            method, path, body, {'x-auth-token': token, **(headers or {})}
         )
 
-        return res_body, r.status_code
-
-    def call(self, method, path, body, token):
-        return self._request(method, path, body, token)
+    def authenticate(self, token):
+        """Resolve the user behind a token.
+
+        Tokens are verified locally when a shared secret is configured,
+        otherwise the identity cache is checked before asking the auth server.
+        """
+        if token_verifier.enabled:
+            try:
+                claims = token_verifier.verify(token)
+            except InvalidToken as e:
+                logger.info('Token rejected locally: %s', e.message)
+                return {'message': e.message}, e.code
+            return {'_id': claims['_id']}, 200
+
+        identity = identity_cache.get(token)
+        if identity is not None:
+            return {'_id': identity.user_id}, identity.status
+
+        res_body, status_code = self.call(
+            'get', '/auth-server/v1/users/me', None, token
+        )
+        if status_code == 200 and isinstance(res_body, dict):
+            identity_cache.put(token, res_body.get('_id'), status_code)
+        return res_body, status_code
 
 
 auth_server_client = AuthServerClient()
@@ -0,0 +1,430 @@
+"""Base upstream client sharing a keep-alive connection pool per upstream."""
+import copy
+import functools
+from http.cookiejar import DefaultCookiePolicy
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.clients.circuit_breaker import CircuitBreaker, CircuitOpenError
+from api_gateway.clients.concurrency_limit import ConcurrencyLimiter
+from api_gateway.clients.hedging import Hedger
+from api_gateway.clients.singleflight import SingleFlight
+from api_gateway.constants import (
+    DEFAULT_BREAKER_ENABLED,
+    DEFAULT_BREAKER_FAILURE_RATE,
+    DEFAULT_BREAKER_HALF_OPEN_CALLS,
+    DEFAULT_BREAKER_MINIMUM_CALLS,
+    DEFAULT_BREAKER_OPEN_DURATION,
+    DEFAULT_BREAKER_SLOW_CALL_DURATION,
+    DEFAULT_BREAKER_SLOW_CALL_RATE,
+    DEFAULT_BREAKER_WINDOW_SIZE,
+    DEFAULT_COALESCE_ENABLED,
+    DEFAULT_COALESCE_MAX_BYTES,
+    DEFAULT_CONCURRENCY_ENABLED,
+    DEFAULT_CONCURRENCY_INITIAL_LIMIT,
+    DEFAULT_CONCURRENCY_MAX_LIMIT,
+    DEFAULT_CONCURRENCY_MAX_WAIT,
+    DEFAULT_CONCURRENCY_MIN_LIMIT,
+    DEFAULT_CONCURRENCY_TOLERANCE,
+    DEFAULT_CONCURRENCY_WORKER_SLOTS,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_HEDGE_BUDGET,
+    DEFAULT_HEDGE_ENABLED,
+    DEFAULT_HEDGE_MAX_DELAY,
+    DEFAULT_HEDGE_MIN_DELAY,
+    DEFAULT_HEDGE_PERCENTILE,
+    DEFAULT_HEDGE_WORKERS,
+    DEFAULT_KEEP_ALIVE,
+    DEFAULT_POOL_BLOCK,
+    DEFAULT_POOL_CONNECTIONS,
+    DEFAULT_POOL_MAX_RETRIES,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+)
+from api_gateway.helpers import codec
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics
+from api_gateway.helpers.server_timing import server_timing
+
+# Sessions are shared by every user going through the gateway, so upstream
+# cookies must never be stored and replayed on somebody else's request.
+_NO_COOKIES = DefaultCookiePolicy(allowed_domains=[])
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default (connect, read) timeout to every request."""
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class JsonSession(requests.Session):
+    """Session encoding `json=` bodies with the gateway codec."""
+
+    def request(self, method, url, **kwargs):  # pylint: disable=arguments-differ
+        body = kwargs.pop('json', None)
+        if body is not None and kwargs.get('data') is None:
+            kwargs['data'] = codec.dumps_bytes(body)
+            headers = dict(kwargs.get('headers') or {})
+            headers.setdefault('Content-Type', 'application/json')
+            kwargs['headers'] = headers
+        return super().request(method, url, **kwargs)
+
+
+class BaseClient:
+    """Upstream client that reuses pooled keep-alive connections.
+
+    Every client owns a single `HTTPAdapter` (and therefore a single urllib3
+    connection pool) for its upstream. `requests.Session` objects are not
+    thread-safe, so each thread gets its own session mounted on that shared
+    adapter: the sockets, and the TLS sessions negotiated on them, are reused
+    across threads and requests.
+
+    Requests that take longer than the connect/read timeouts fail, and a
+    circuit breaker fails fast with a 503 while the upstream keeps failing
+    or answering too slowly, and an adaptive concurrency limit shared by the
+    workers sheds calls with a 503 once the upstream slows down under load.
+    Idempotent GETs can optionally be hedged, and identical concurrent GETs
+    share a single upstream request.
+
+    Settings are read from the environment using the client `section`
+    as prefix (e.g. `COURSES_POOL_MAXSIZE`), falling back to the `UPSTREAM_*`
+    variables and then to the defaults in `api_gateway.constants`.
+    """
+
+    name = 'Upstream'
+    section = 'upstream'
+
+    def __init__(self, url):
+        self.url = url
+        self.pool_connections = self._setting(
+            'pool_connections', DEFAULT_POOL_CONNECTIONS, int
+        )
+        self.pool_maxsize = self._setting('pool_maxsize', DEFAULT_POOL_MAXSIZE, int)
+        self.pool_block = self._setting('pool_block', DEFAULT_POOL_BLOCK, to_bool)
+        self.keep_alive = self._setting('keep_alive', DEFAULT_KEEP_ALIVE, to_bool)
+        self.connect_timeout = self._setting(
+            'connect_timeout', DEFAULT_CONNECT_TIMEOUT, float
+        )
+        self.read_timeout = self._setting('read_timeout', DEFAULT_READ_TIMEOUT, float)
+        self.adapter = TimeoutHTTPAdapter(
+            timeout=(self.connect_timeout, self.read_timeout),
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            max_retries=self._setting('max_retries', DEFAULT_POOL_MAX_RETRIES, int),
+        )
+        self.breaker = CircuitBreaker(
+            self.name,
+            self.section,
+            failure_rate=self._setting(
+                'breaker_failure_rate', DEFAULT_BREAKER_FAILURE_RATE, float
+            ),
+            slow_call_rate=self._setting(
+                'breaker_slow_call_rate', DEFAULT_BREAKER_SLOW_CALL_RATE, float
+            ),
+            slow_call_duration=self._setting(
+                'breaker_slow_call_duration', DEFAULT_BREAKER_SLOW_CALL_DURATION, float
+            ),
+            window_size=self._setting(
+                'breaker_window_size', DEFAULT_BREAKER_WINDOW_SIZE, int
+            ),
+            minimum_calls=self._setting(
+                'breaker_minimum_calls', DEFAULT_BREAKER_MINIMUM_CALLS, int
+            ),
+            open_duration=self._setting(
+                'breaker_open_duration', DEFAULT_BREAKER_OPEN_DURATION, float
+            ),
+            half_open_calls=self._setting(
+                'breaker_half_open_calls', DEFAULT_BREAKER_HALF_OPEN_CALLS, int
+            ),
+            enabled=self._setting('breaker_enabled', DEFAULT_BREAKER_ENABLED, to_bool),
+        )
+        self.limiter = ConcurrencyLimiter(
+            self.name,
+            self.section,
+            os.path.join(
+                self._setting('concurrency_dir', '', str)
+                or os.path.join(
+                    tempfile.gettempdir(), f'api-gateway-concurrency-{os.getppid()}'
+                ),
+                f'{self.section}.bin',
+            ),
+            initial_limit=self._setting(
+                'concurrency_initial_limit', DEFAULT_CONCURRENCY_INITIAL_LIMIT, int
+            ),
+            min_limit=self._setting(
+                'concurrency_min_limit', DEFAULT_CONCURRENCY_MIN_LIMIT, int
+            ),
+            max_limit=self._setting(
+                'concurrency_max_limit', DEFAULT_CONCURRENCY_MAX_LIMIT, int
+            ),
+            max_wait=self._setting(
+                'concurrency_max_wait', DEFAULT_CONCURRENCY_MAX_WAIT, float
+            ),
+            tolerance=self._setting(
+                'concurrency_tolerance', DEFAULT_CONCURRENCY_TOLERANCE, float
+            ),
+            worker_slots=self._setting(
+                'concurrency_worker_slots', DEFAULT_CONCURRENCY_WORKER_SLOTS, int
+            ),
+            enabled=self._setting(
+                'concurrency_enabled', DEFAULT_CONCURRENCY_ENABLED, to_bool
+            ),
+        )
+        self.hedger = Hedger(
+            self.name,
+            percentile=self._setting(
+                'hedge_percentile', DEFAULT_HEDGE_PERCENTILE, float
+            ),
+            min_delay=self._setting('hedge_min_delay', DEFAULT_HEDGE_MIN_DELAY, float),
+            max_delay=self._setting('hedge_max_delay', DEFAULT_HEDGE_MAX_DELAY, float),
+            budget=self._setting('hedge_budget', DEFAULT_HEDGE_BUDGET, float),
+            workers=self._setting('hedge_workers', DEFAULT_HEDGE_WORKERS, int),
+            enabled=self._setting('hedge_enabled', DEFAULT_HEDGE_ENABLED, to_bool),
+            section=self.section,
+        )
+        self.singleflight = SingleFlight(
+            self.name,
+            self.section,
+            enabled=self._setting(
+                'coalesce_enabled', DEFAULT_COALESCE_ENABLED, to_bool
+            ),
+        )
+        self.coalesce_max_bytes = self._setting(
+            'coalesce_max_bytes', DEFAULT_COALESCE_MAX_BYTES, int
+        )
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._sessions = 0
+        metrics.add_collector(self.collect, per_process=True)
+
+    def _setting(self, key, default, cast):
+        """Read a client setting, preferring the client specific variable."""
+        fallback = getattr(config.upstream, key)(default=default, cast=cast)
+        return getattr(getattr(config, self.section), key)(default=fallback, cast=cast)
+
+    @property
+    def session(self):
+        """Session for the current thread, mounted on the shared pool."""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = JsonSession()
+            session.cookies.set_policy(_NO_COOKIES)
+            session.stream = True
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            if not self.keep_alive:
+                session.headers['Connection'] = 'close'
+            self._local.session = session
+            metrics.set(
+                'gateway_upstream_pool_maxsize',
+                (('upstream', self.section),),
+                self.pool_maxsize,
+            )
+            with self._stats_lock:
+                self._sessions += 1
+        return session
+
+    def pool_stats(self):
+        """Return a snapshot of the connection pool usage for this upstream."""
+        connections = 0
+        pooled_requests = 0
+        idle = 0
+        pools = self.adapter.poolmanager.pools
+        with pools.lock:
+            conn_pools = list(pools._container.values())  # pylint:disable=W0212
+        for pool in conn_pools:
+            connections += pool.num_connections
+            pooled_requests += pool.num_requests
+            if pool.pool is not None:
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            'upstream': self.name,
+            'url': self.url,
+            'poolMaxsize': self.pool_maxsize,
+            'poolBlock': self.pool_block,
+            'keepAlive': self.keep_alive,
+            'sessions': self._sessions,
+            'requests': self._requests,
+            'hostPools': len(conn_pools),
+            'connectionsOpened': connections,
+            'connectionsReused': max(pooled_requests - connections, 0),
+            'idleConnections': idle,
+            'connectTimeout': self.connect_timeout,
+            'readTimeout': self.read_timeout,
+        }
+
+    def collect(self):
+        """Series of the connection pool of this worker, for `/metrics`."""
+        stats = self.pool_stats()
+        labels = (('upstream', self.section),)
+        return [
+            (
+                'gateway_upstream_connections_opened_total',
+                labels,
+                stats['connectionsOpened'],
+            ),
+            (
+                'gateway_upstream_connections_reused_total',
+                labels,
+                stats['connectionsReused'],
+            ),
+            ('gateway_upstream_idle_connections', labels, stats['idleConnections']),
+        ]
+
+    def _exchange(self, method, path, body, headers, timeout=None):
+        """Send a request to the upstream and return the raw response.
+
+        Sessions are created with `stream=True`, so the body is only read
+        when the caller asks for it and can be relayed in chunks. `timeout`
+        overrides the (connect, read) timeouts of the client.
+        """
+        if not body:
+            body = {}
+        url = f'{self.url}{path}'
+        # the slot first, so a shed call never takes a half-open trial call
+        self.limiter.acquire()
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self.limiter.cancel()
+            raise
+        started = time.monotonic()
+        try:
+            if method == 'get' and self.hedger.enabled:
+                r = self.hedger.call(
+                    functools.partial(
+                        self._attempt, method, url, body, headers, timeout
+                    )
+                )
+            else:
+                r = self._attempt(method, url, body, headers, timeout)
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            self.limiter.release(elapsed, failed=True)
+            self.breaker.record(True, elapsed)
+            logger.error(
+                'Error when making request path: "%s", token: "%s" to %s. Error: %s',
+                path,
+                headers.get('x-auth-token'),
+                self.name,
+                e,
+            )
+            raise e
+        elapsed = time.monotonic() - started
+        self.limiter.release(elapsed)
+        # one outcome per call, however many hedged copies were sent
+        self.breaker.record(r.status_code >= 500, elapsed)
+        return r
+
+    def _attempt(self, method, url, body, headers, timeout=None):
+        """Make a single request, feeding its outcome to the metrics."""
+        func = getattr(self.session, method)
+        kwargs = {} if timeout is None else {'timeout': timeout}
+        with self._stats_lock:
+            self._requests += 1
+        labels = (('upstream', self.section),)
+        metrics.inc('gateway_upstream_requests_in_flight', labels)
+        started = time.monotonic()
+        try:
+            r = func(url, json=body, headers=headers, **kwargs)
+        except Exception:
+            self._record(labels, 'error', time.monotonic() - started)
+            raise
+        finally:
+            metrics.inc('gateway_upstream_requests_in_flight', labels, -1)
+        self._record(labels, r.status_code, time.monotonic() - started)
+        return r
+
+    @staticmethod
+    def _record(labels, status, elapsed):
+        metrics.observe('gateway_upstream_request_duration_seconds', labels, elapsed)
+        metrics.inc('gateway_upstream_requests_total', labels + (('status', status),))
+
+    def _fetch(self, method, path, body, headers, timeout=None):
+        """`_exchange`, coalescing identical concurrent GETs.
+
+        GETs with the same path and headers (and so the same auth scope) that
+        are in flight at the same time share one upstream request. Only
+        bodies of a known length up to `coalesce_max_bytes` are shared, they
+        are read before handing a copy of the response to every caller.
+        Calls with their own `timeout` are never coalesced, they could end
+        up waiting for a call allowed to take longer.
+        """
+        if method != 'get' or not self.singleflight.enabled or timeout is not None:
+            return self._exchange(method, path, body, headers, timeout)
+        return self.singleflight.do(
+            (path, tuple(sorted(headers.items()))),
+            lambda: self._buffer(self._exchange(method, path, body, headers)),
+            share=self._share,
+        )
+
+    def _bufferable(self, r):
+        length = r.headers.get('Content-Length')
+        return (
+            length is not None
+            and length.isdigit()
+            and int(length) <= self.coalesce_max_bytes
+        )
+
+    def _buffer(self, r):
+        """Read the body of a response that can be shared."""
+        if self._bufferable(r):
+            r.content  # pylint: disable=pointless-statement
+        return r
+
+    def _share(self, r):
+        """Copy of a buffered response for another caller, None if unbuffered."""
+        if not self._bufferable(r):
+            return None
+        return copy.copy(r)
+
+    def _send(self, method, path, body, headers, timeout=None):
+        """Send a request to the upstream and decode its JSON response."""
+        r = self._fetch(method, path, body, headers, timeout)
+
+        content = r.content
+        with server_timing.phase('decode'):
+            res_body = codec.loads(content)
+
+        logger.info(
+            '%s method: %s, path: %s, status_code: %s, body: %s',
+            type(self).__name__,
+            method,
+            path,
+            r.status_code,
+            res_body,
+            extra={'status_code': r.status_code},
+        )
+
+        return res_body, r.status_code
+
+    def _forward(self, method, path, body, headers):
+        """Send a request to the upstream and return it without decoding it."""
+        r = self._fetch(method, path, body, headers)
+
+        logger.info(
+            '%s method: %s, path: %s, status_code: %s, content_length: %s',
+            type(self).__name__,
+            method,
+            path,
+            r.status_code,
+            r.headers.get('Content-Length'),
+            extra={'status_code': r.status_code},
+        )
+
+        return r
@@ -0,0 +1,169 @@
+"""Circuit breaker guarding the calls to an upstream."""
+from collections import deque
+import os
+import threading
+import time
+
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """The upstream is failing, calls are rejected without reaching it."""
+
+    code = 503
+
+    def __init__(self, upstream, retry_after):
+        self.message = f'{upstream} is unavailable, try again in {retry_after:.0f}s'
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class CircuitBreaker:
+    """Count based circuit breaker.
+
+    The outcome of the last `window_size` calls is kept while closed. Once at
+    least `minimum_calls` were made, the breaker opens if the share of failed
+    calls reaches `failure_rate` or the share of calls slower than
+    `slow_call_duration` seconds reaches `slow_call_rate`.
+
+    While open every call is rejected. After `open_duration` seconds the
+    breaker lets `half_open_calls` trial calls through: it closes again if
+    they all succeed and reopens on the first failure.
+
+    Each worker exports which state its breaker is in and counts the
+    transitions, labelled by `section` (the upstream).
+    """
+
+    def __init__(
+        self,
+        name,
+        section=None,
+        failure_rate=0.5,
+        slow_call_rate=1.0,
+        slow_call_duration=5.0,
+        window_size=20,
+        minimum_calls=10,
+        open_duration=30.0,
+        half_open_calls=3,
+        enabled=True,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.labels = (('upstream', section or name.lower()),)
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_duration = slow_call_duration
+        self.minimum_calls = min(minimum_calls, window_size)
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.enabled = enabled
+        self.clock = clock
+        self.state = CLOSED
+        self._window = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._trial_successes = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.transitions = {}
+        self._exported_pid = None
+
+    def _export(self):
+        """Set the state gauge, 1 for the current state and 0 for the others."""
+        self._exported_pid = os.getpid()
+        for state in (CLOSED, OPEN, HALF_OPEN):
+            metrics.set(
+                'gateway_upstream_breaker_state',
+                self.labels + (('state', state),),
+                1 if state == self.state else 0,
+            )
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go through right now."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._exported_pid != os.getpid():
+                # first call of this process, e.g. a freshly forked worker
+                self._export()
+            if self.state == OPEN:
+                waited = self.clock() - self._opened_at
+                if waited < self.open_duration:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.open_duration - waited)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._trial_calls >= self.half_open_calls:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0)
+                self._trial_calls += 1
+
+    def record(self, failed, duration):
+        """Record the outcome of a call that went through."""
+        if not self.enabled:
+            return
+        slow = duration >= self.slow_call_duration
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed or slow:
+                    self._transition(OPEN)
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                return
+            self._window.append((failed, slow))
+            if len(self._window) < self.minimum_calls:
+                return
+            calls = len(self._window)
+            failures = sum(1 for failed_call, _ in self._window if failed_call)
+            slow_calls = sum(1 for _, slow_call in self._window if slow_call)
+            if (
+                failures / calls >= self.failure_rate
+                or slow_calls / calls >= self.slow_call_rate
+            ):
+                self._transition(OPEN)
+
+    def _transition(self, state):
+        transition = f'{self.state}->{state}'
+        self.transitions[transition] = self.transitions.get(transition, 0) + 1
+        log = logger.warning if state == OPEN else logger.info
+        log('Circuit breaker of %s went %s', self.name, transition)
+        metrics.inc(
+            'gateway_upstream_breaker_transitions_total',
+            self.labels + (('from', self.state), ('to', state)),
+        )
+        self.state = state
+        self._export()
+        self._window.clear()
+        self._trial_calls = 0
+        self._trial_successes = 0
+        if state == OPEN:
+            self._opened_at = self.clock()
+
+    def reset(self):
+        """Close the breaker and forget every recorded call."""
+        with self._lock:
+            self.state = CLOSED
+            self._window.clear()
+            self._trial_calls = 0
+            self._trial_successes = 0
+            self.rejected = 0
+            self.transitions = {}
+            self._export()
+
+    def stats(self):
+        return {
+            'upstream': self.name,
+            'enabled': self.enabled,
+            'state': self.state,
+            'rejected': self.rejected,
+            'transitions': dict(self.transitions),
+        }
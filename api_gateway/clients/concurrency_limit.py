@@ -0,0 +1,294 @@
+"""Adaptive limit of the concurrent calls to an upstream.
+
+The limit covers every gunicorn worker of the host: a sync worker only has
+one call in flight, so a limit per process would never shed anything. The
+limit, the latency it follows and the calls in flight of each worker live
+in a memory mapped file per upstream, guarded by a file lock like the
+shared rate limit buckets. Each worker counts its calls in a slot of its
+own, and the slots of workers that exited are freed when the limit is hit.
+"""
+import asyncio
+import contextlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics, pid_alive
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# limit (0 for a new file), long term latency (0 before the first call) and
+# calls in flight on the host
+_HEADER = struct.Struct('<ddq')
+# pid (0 for a free slot) and calls in flight of a worker
+_WORKER = struct.Struct('<Qq')
+
+
+class ConcurrencyLimitError(Exception):
+    """Too many calls to the upstream are in flight, the call is shed."""
+
+    code = 503
+
+    def __init__(self, upstream, retry_after=1.0):
+        self.message = f'{upstream} is overloaded, try again in {retry_after:.0f}s'
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+class ConcurrencyLimiter:
+    """Gradient concurrency limiter shared by the processes of a host.
+
+    At most `limit` calls are in flight at once; a call over the limit
+    waits up to `max_wait` seconds for a free slot and is rejected after
+    that. The limit follows the latency of the calls: a long term average
+    of it is compared with each new one, and the limit shrinks by that
+    ratio (down to half) when a call takes more than `tolerance` times the
+    average, and grows by its square root otherwise. Changes are smoothed
+    by `smoothing`, calls failing without a response cut the limit by
+    `backoff`, and the limit only grows while at least half of it is used.
+    """
+
+    def __init__(
+        self,
+        name,
+        section,
+        path,
+        initial_limit=20,
+        min_limit=1,
+        max_limit=400,
+        max_wait=0.05,
+        tolerance=2.0,
+        smoothing=0.2,
+        backoff=0.9,
+        long_window=100,
+        worker_slots=64,
+        interval=0.005,
+        enabled=True,
+        clock=time.monotonic,
+    ):
+        self.name = name
+        self.labels = (('upstream', section),)
+        self.path = path
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.max_wait = max_wait
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self.long_window = long_window
+        self.worker_slots = worker_slots
+        self.interval = interval
+        self.enabled = enabled
+        self.clock = clock
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._pid = None
+        self._slot = None
+        metrics.add_collector(self.collect)
+
+    def _current(self):
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # pylint: disable=consider-using-with
+            self._file = open(self.path, 'a+b')
+            size = _HEADER.size + self.worker_slots * _WORKER.size
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+            self._slot = None
+        return self._map
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """The mapped file, locked against the other threads and processes."""
+        with self._lock:
+            data = self._current()
+            if fcntl is not None:
+                fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                limit, _, _ = _HEADER.unpack_from(data, 0)
+                if not limit:
+                    _HEADER.pack_into(data, 0, self.initial_limit, 0.0, 0)
+                if self._slot is None:
+                    self._slot = self._claim(data)
+                yield data
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._file, fcntl.LOCK_UN)
+
+    def _offsets(self):
+        return range(
+            _HEADER.size, _HEADER.size + self.worker_slots * _WORKER.size, _WORKER.size
+        )
+
+    def _claim(self, data):
+        """Offset of the slot of this process, taking a free one."""
+        pid = os.getpid()
+        free = None
+        for offset in self._offsets():
+            slot_pid, _ = _WORKER.unpack_from(data, offset)
+            if slot_pid == pid:
+                # left by an exited process that had the same pid
+                free = offset
+                break
+            if free is None and not slot_pid:
+                free = offset
+        if free is None:
+            free = next(
+                (
+                    offset
+                    for offset in self._offsets()
+                    if not pid_alive(_WORKER.unpack_from(data, offset)[0])
+                ),
+                None,
+            )
+        if free is None:
+            logger.warning(
+                'No free concurrency slot for %s, calls of worker %s are not limited.',
+                self.name,
+                pid,
+            )
+            return False
+        _, left = _WORKER.unpack_from(data, free)
+        _WORKER.pack_into(data, free, pid, 0)
+        limit, long_latency, total = _HEADER.unpack_from(data, 0)
+        _HEADER.pack_into(data, 0, limit, long_latency, max(total - left, 0))
+        return free
+
+    def _purge(self, data):
+        """Free the slots of exited workers, returning the calls in flight."""
+        limit, long_latency, total = _HEADER.unpack_from(data, 0)
+        for offset in self._offsets():
+            pid, calls = _WORKER.unpack_from(data, offset)
+            if pid and pid != os.getpid() and not pid_alive(pid):
+                _WORKER.pack_into(data, offset, 0, 0)
+                total -= calls
+        _HEADER.pack_into(data, 0, limit, long_latency, max(total, 0))
+        return total
+
+    def _add(self, data, amount):
+        if self._slot:
+            pid, calls = _WORKER.unpack_from(data, self._slot)
+            # never below zero, e.g. for a call cancelled twice
+            amount = max(amount, -calls)
+            _WORKER.pack_into(data, self._slot, pid, calls + amount)
+            limit, long_latency, total = _HEADER.unpack_from(data, 0)
+            _HEADER.pack_into(data, 0, limit, long_latency, max(total + amount, 0))
+
+    def _take(self):
+        """Take a slot if one is free, returning whether it was taken."""
+        with self._locked() as data:
+            limit, _, in_flight = _HEADER.unpack_from(data, 0)
+            # looking for exited workers only when the limit seems to be hit
+            if in_flight >= int(limit) and self._purge(data) >= int(limit):
+                return False
+            self._add(data, 1)
+        return True
+
+    def _admit(self, waited):
+        metrics.observe('gateway_upstream_queue_wait_seconds', self.labels, waited)
+
+    def _reject(self, waited):
+        self.rejected += 1
+        metrics.inc('gateway_upstream_concurrency_rejections_total', self.labels)
+        metrics.observe('gateway_upstream_queue_wait_seconds', self.labels, waited)
+        return ConcurrencyLimitError(self.name)
+
+    def acquire(self):
+        """Take a slot, raising ConcurrencyLimitError if none frees in time."""
+        if not self.enabled:
+            return
+        started = self.clock()
+        while not self._take():
+            waited = self.clock() - started
+            if waited >= self.max_wait:
+                raise self._reject(waited)
+            time.sleep(min(self.interval, self.max_wait - waited))
+        self._admit(self.clock() - started)
+
+    async def acquire_async(self):
+        """`acquire` for the event loop, polling for a slot without blocking."""
+        if not self.enabled:
+            return
+        started = self.clock()
+        while not self._take():
+            waited = self.clock() - started
+            if waited >= self.max_wait:
+                raise self._reject(waited)
+            await asyncio.sleep(min(self.interval, self.max_wait - waited))
+        self._admit(self.clock() - started)
+
+    def cancel(self):
+        """Give back the slot of a call that was not made."""
+        if not self.enabled:
+            return
+        with self._locked() as data:
+            self._add(data, -1)
+
+    def release(self, latency, failed=False):
+        """Give the slot back, feeding the latency of the call to the limit."""
+        if not self.enabled:
+            return
+        with self._locked() as data:
+            self._add(data, -1)
+            limit, long_latency, in_flight = _HEADER.unpack_from(data, 0)
+            if failed:
+                limit = max(limit * self.backoff, self.min_limit)
+            else:
+                limit, long_latency = self._update(
+                    limit, long_latency, latency, in_flight
+                )
+            _HEADER.pack_into(data, 0, limit, long_latency, in_flight)
+
+    def _update(self, limit, long_latency, latency, in_flight):
+        """The next `(limit, long term latency)` after a call."""
+        if not long_latency:
+            return limit, max(latency, 1e-6)
+        long_latency += (latency - long_latency) / self.long_window
+        if long_latency > 2 * latency:
+            # back from an overload the average is still high, pull it down
+            # faster than the window would
+            long_latency *= 0.95
+        gradient = min(
+            max(self.tolerance * long_latency / max(latency, 1e-6), 0.5), 1.0
+        )
+        target = limit * gradient + math.sqrt(limit)
+        updated = limit * (1 - self.smoothing) + target * self.smoothing
+        if in_flight + 1 < limit / 2:
+            # too few calls to tell whether more would be fine
+            updated = min(updated, limit)
+        return min(max(updated, self.min_limit), self.max_limit), long_latency
+
+    @property
+    def limit(self):
+        with self._locked() as data:
+            return _HEADER.unpack_from(data, 0)[0]
+
+    def collect(self):
+        """Series of the shared state, for `/metrics`."""
+        if not self.enabled or not os.path.exists(self.path):
+            return []
+        return [('gateway_upstream_concurrency_limit', self.labels, int(self.limit))]
+
+    def stats(self):
+        with self._locked() as data:
+            limit, long_latency, in_flight = _HEADER.unpack_from(data, 0)
+        return {
+            'upstream': self.name,
+            'enabled': self.enabled,
+            'limit': int(limit),
+            'inFlight': in_flight,
+            'rejected': self.rejected,
+            'longLatency': long_latency or None,
+        }
@@ -1,46 +1,36 @@
-import json
 import os
 
-import requests
+from api_gateway.clients.base_client import BaseClient
 
-from api_gateway.helpers.logger import logger
 
+class CourseClient(BaseClient):
+    name = 'Courses'
+    section = 'courses'
 
-class CourseClient:
     def __init__(self):
-        self.url = os.environ.get(
-            'FRUX_SC_URL', 'https://ubademy-g2-courses.herokuapp.com'
-        )
-
-    def _request(self, method, path, body, token, user_id):
-        if not body:
-            body = {}
-        func = getattr(requests, method)
-        headers = {'x-auth-token': token, 'x-user-id': user_id}
-        try:
-            r = func(f'{self.url}{path}', json=body, headers=headers)
-        except Exception as e:
-            logger.error(
-                'Error when making request path: "%s", token: "%s" to Courses. Error: %s',
-                path,
-                token,
-                e,
+        super().__init__(
+            os.environ.get(
+                'COURSES_URL',
+                os.environ.get(
+                    'FRUX_SC_URL', 'https://ubademy-g2-courses.herokuapp.com'
+                ),
             )
-            raise e
-
-        res_body = json.loads(r.content.decode())
-        logger.info(
-            'CourseClient method: %s, path: %s, status_code: %s, body: %s',
-            method,
-            path,
-            r.status_code,
-            res_body,
         )
 
-        return res_body, r.status_code
+    @staticmethod
+    def _headers(token, user_id):
+        return {'x-auth-token': token, 'x-user-id': user_id}
+
+    def _request(self, method, path, body, token, user_id, timeout=None):
+        return self._send(method, path, body, self._headers(token, user_id), timeout)
 
-    def call(self, method, path, body, token, user_id):
-        return self._request(method, path, body, token, user_id)
+    def call(self, method, path, body, token, user_id, timeout=None):
+        return self._request(method, path, body, token, user_id, timeout)
+
+    def forward(self, method, path, body, token, user_id, headers=None):
+        return self._forward(
+            method, path, body, {**self._headers(token, user_id), **(headers or {})}
+        )
 
 
 course_client = CourseClient()
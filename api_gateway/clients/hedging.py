@@ -0,0 +1,157 @@
+"""Hedged requests: race a second identical call when the first is slow."""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import metrics
+
+
+class Hedger:
+    """Sends a backup copy of an idempotent call that is taking too long.
+
+    The call runs on a worker thread. If it has not finished after the
+    `percentile` latency of the recent calls (bounded by `min_delay` and
+    `max_delay`), an identical hedge is sent and whichever succeeds first
+    wins; the loser is cancelled, or closed as soon as it completes so its
+    connection goes back to the pool.
+
+    Hedges are paid from a budget that earns `budget` tokens per call (up to
+    `burst`), so they never add more than that share of extra load and
+    cannot amplify an outage.
+    """
+
+    def __init__(
+        self,
+        name,
+        percentile=0.95,
+        min_delay=0.05,
+        max_delay=2.0,
+        budget=0.05,
+        burst=10.0,
+        workers=16,
+        samples=200,
+        enabled=False,
+        section=None,
+    ):
+        self.name = name
+        self.labels = (('upstream', section or name.lower()),)
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.burst = burst
+        self.workers = workers
+        self.enabled = enabled
+        self._latencies = deque(maxlen=samples)
+        self._delay = max_delay
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self._executor = None
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+        metrics.add_collector(self.collect, per_process=True)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers,
+                        thread_name_prefix=f'hedge-{self.name.lower()}',
+                    )
+        return self._executor
+
+    def delay(self):
+        """Seconds to wait for a call before hedging it."""
+        return self._delay
+
+    def observe(self, latency):
+        """Feed the latency of a call to the hedge delay estimate."""
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) % 20 == 0:
+                ordered = sorted(self._latencies)
+                index = min(int(len(ordered) * self.percentile), len(ordered) - 1)
+                self._delay = min(max(ordered[index], self.min_delay), self.max_delay)
+
+    def _earn(self):
+        with self._lock:
+            self.calls += 1
+            self._tokens = min(self._tokens + self.budget, self.burst)
+
+    def _spend(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                return False
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def call(self, func):
+        """Run `func`, hedging it if it is slow, and return the first success."""
+        self._earn()
+        started = time.monotonic()
+        primary = self.executor.submit(func)
+        done, _ = wait([primary], timeout=self.delay())
+        if done or not self._spend():
+            result = primary.result()
+            self.observe(time.monotonic() - started)
+            return result
+
+        logger.info('Hedging slow %s call after %.3fs', self.name, self.delay())
+        hedge = self.executor.submit(func)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        _discard(loser)
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    self.observe(time.monotonic() - started)
+                    return future.result()
+        return primary.result()
+
+    def collect(self):
+        """Series of the hedges of this worker, for `/metrics`."""
+        if not self.enabled:
+            return []
+        return [
+            ('gateway_upstream_hedges_total', self.labels, self.hedges),
+            ('gateway_upstream_hedge_wins_total', self.labels, self.hedge_wins),
+            (
+                'gateway_upstream_hedges_over_budget_total',
+                self.labels,
+                self.budget_exhausted,
+            ),
+        ]
+
+    def stats(self):
+        return {
+            'upstream': self.name,
+            'enabled': self.enabled,
+            'delay': self._delay,
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'hedgeWins': self.hedge_wins,
+            'budgetExhausted': self.budget_exhausted,
+        }
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def _discard(future):
+    """Cancel a losing call, or release its response once it arrives."""
+    if not future.cancel():
+        future.add_done_callback(_close_response)
@@ -1,47 +1,33 @@
-import json
 import os
 
-import requests
+from api_gateway.clients.base_client import BaseClient
 
-from api_gateway.helpers.logger import logger
 
+class PaymentClient(BaseClient):
+    name = 'Payments'
+    section = 'payments'
 
-class PaymentClient:
     def __init__(self):
-        self.url = os.environ.get(
-            'FRUX_SC_URL', 'https://ubademy-g2-payments.herokuapp.com'
+        super().__init__(
+            os.environ.get(
+                'PAYMENTS_URL',
+                os.environ.get(
+                    'FRUX_SC_URL', 'https://ubademy-g2-payments.herokuapp.com'
+                ),
+            )
         )
 
-    def _request(self, method, path, body, token):
-        if not body:
-            body = {}
-        func = getattr(requests, method)
+    def _request(self, method, path, body, token, timeout=None):
         headers = {'x-auth-token': token}
-        try:
-            r = func(f'{self.url}{path}', json=body, headers=headers)
-        except Exception as e:
-            logger.error(
-                'Error when making request path: "%s", token: "%s" to Courses. Error: %s',
-                path,
-                token,
-                e,
-            )
-            raise e
+        return self._send(method, path, body, headers, timeout)
 
-        res_body = json.loads(r.content.decode())
+    def call(self, method, path, body, token, timeout=None):
+        return self._request(method, path, body, token, timeout)
 
-        logger.info(
-            'PaymentClient method: %s, path: %s, status_code: %s, body: %s',
-            method,
-            path,
-            r.status_code,
-            res_body,
+    def forward(self, method, path, body, token, headers=None):
+        return self._forward(
+            method, path, body, {'x-auth-token': token, **(headers or {})}
         )
 
-        return res_body, r.status_code
-
-    def call(self, method, path, body, token):
-        return self._request(method, path, body, token)
-
 
 payment_client = PaymentClient()
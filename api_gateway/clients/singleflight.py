@@ -0,0 +1,84 @@
+"""Coalescing of identical concurrent upstream calls."""
+import threading
+
+from api_gateway.helpers.metrics import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Lets identical concurrent calls share a single execution.
+
+    The first caller of a key runs the call; callers arriving while it is in
+    flight wait for it and get its outcome, passed through `share` (which
+    returns None when the result cannot be shared, in which case the caller
+    runs the call on its own).
+
+    The calls sent upstream and the callers that waited on an identical call
+    in flight are counted in `gateway_upstream_calls_executed_total` and
+    `gateway_upstream_calls_coalesced_total`, labelled by `section`.
+    """
+
+    def __init__(self, name, section=None, enabled=True):
+        self.name = name
+        self.labels = (('upstream', section or name.lower()),)
+        self.enabled = enabled
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, func, share=lambda result: result):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        metrics.inc(
+            'gateway_upstream_calls_executed_total'
+            if leader
+            else 'gateway_upstream_calls_coalesced_total',
+            self.labels,
+        )
+
+        if leader:
+            try:
+                call.result = func()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        shared = share(call.result)
+        if shared is None:
+            with self._lock:
+                self.executed += 1
+            metrics.inc('gateway_upstream_calls_executed_total', self.labels)
+            return func()
+        return shared
+
+    def stats(self):
+        calls = self.executed + self.coalesced
+        return {
+            'upstream': self.name,
+            'enabled': self.enabled,
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'inFlight': len(self._calls),
+            'coalescingRatio': self.coalesced / calls if calls else 0.0,
+        }
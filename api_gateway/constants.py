@@ -1 +1,122 @@
 """Constant values and defaults used in multiple modules."""
+
+# Upstream connection pools
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_POOL_BLOCK = False
+DEFAULT_POOL_MAX_RETRIES = 0
+DEFAULT_KEEP_ALIVE = True
+
+# Token -> identity cache
+DEFAULT_IDENTITY_CACHE_ENABLED = True
+DEFAULT_IDENTITY_CACHE_TTL = 60.0
+DEFAULT_IDENTITY_CACHE_MAXSIZE = 10000
+
+# Local token verification
+DEFAULT_REVOKED_TOKENS_MAXSIZE = 10000
+
+# Asyncio serving mode
+DEFAULT_ASYNC_MAX_CONNECTIONS = 1000
+DEFAULT_ASYNC_MAX_KEEPALIVE = 100
+DEFAULT_ASYNC_KEEPALIVE_EXPIRY = 30.0
+
+# Upstream response passthrough
+DEFAULT_PASSTHROUGH_ENABLED = True
+DEFAULT_PASSTHROUGH_CHUNK_SIZE = 64 * 1024
+DEFAULT_PASSTHROUGH_STREAM_THRESHOLD = 256 * 1024
+
+# Status endpoint probes
+DEFAULT_STATUS_PROBE_WORKERS = 6
+DEFAULT_STATUS_PROBE_TIMEOUT = 3.0
+DEFAULT_STATUS_POLLER_ENABLED = True
+DEFAULT_STATUS_POLLER_INTERVAL = 30.0
+DEFAULT_STATUS_POLLER_JITTER = 5.0
+
+# Upstream timeouts and circuit breakers
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 25.0
+DEFAULT_BREAKER_ENABLED = True
+DEFAULT_BREAKER_FAILURE_RATE = 0.5
+DEFAULT_BREAKER_SLOW_CALL_RATE = 1.0
+DEFAULT_BREAKER_SLOW_CALL_DURATION = 10.0
+DEFAULT_BREAKER_WINDOW_SIZE = 20
+DEFAULT_BREAKER_MINIMUM_CALLS = 10
+DEFAULT_BREAKER_OPEN_DURATION = 30.0
+DEFAULT_BREAKER_HALF_OPEN_CALLS = 3
+
+# Adaptive upstream concurrency limits
+DEFAULT_CONCURRENCY_ENABLED = True
+DEFAULT_CONCURRENCY_INITIAL_LIMIT = 20
+DEFAULT_CONCURRENCY_MIN_LIMIT = 1
+DEFAULT_CONCURRENCY_MAX_LIMIT = 400
+DEFAULT_CONCURRENCY_MAX_WAIT = 0.05
+DEFAULT_CONCURRENCY_TOLERANCE = 2.0
+DEFAULT_CONCURRENCY_WORKER_SLOTS = 64
+
+# Hedged GETs
+DEFAULT_HEDGE_ENABLED = False
+DEFAULT_HEDGE_PERCENTILE = 0.95
+DEFAULT_HEDGE_MIN_DELAY = 0.05
+DEFAULT_HEDGE_MAX_DELAY = 2.0
+DEFAULT_HEDGE_BUDGET = 0.05
+DEFAULT_HEDGE_WORKERS = 16
+
+# Upstream GET response cache
+DEFAULT_RESPONSE_CACHE_ENABLED = True
+DEFAULT_RESPONSE_CACHE_TTL = 0.0
+DEFAULT_RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_RESPONSE_CACHE_MAX_ENTRY_BYTES = 1024 * 1024
+DEFAULT_RESPONSE_CACHE_INVALIDATION_DEPTH = 3
+DEFAULT_RESPONSE_CACHE_BETA = 1.0
+
+# Response compression
+DEFAULT_COMPRESSION_ENABLED = True
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+DEFAULT_COMPRESSION_GZIP_LEVEL = 6
+DEFAULT_COMPRESSION_BROTLI_QUALITY = 4
+
+# Proxy routes fast path
+DEFAULT_PROXY_FAST_PATH_ENABLED = True
+
+# Coalescing of identical concurrent GETs
+DEFAULT_COALESCE_ENABLED = True
+DEFAULT_COALESCE_MAX_BYTES = 256 * 1024
+
+# Logging
+DEFAULT_LOG_QUEUE_ENABLED = True
+DEFAULT_LOG_QUEUE_SIZE = 10000
+DEFAULT_LOG_DEBUG_SAMPLE_RATE = 1.0
+DEFAULT_LOG_INFO_SAMPLE_RATE = 1.0
+DEFAULT_LOG_SUCCESS_SAMPLE_RATE = 0.01
+DEFAULT_LOG_ARG_MAX_CHARS = 2000
+DEFAULT_LOG_MESSAGE_MAX_CHARS = 10000
+
+# JSON codec
+DEFAULT_JSON_BACKEND = 'auto'
+
+# Metrics
+DEFAULT_METRICS_ENABLED = True
+DEFAULT_METRICS_STATSD_ENABLED = False
+DEFAULT_METRICS_STATSD_HOST = 'localhost'
+DEFAULT_METRICS_STATSD_PORT = 8125
+DEFAULT_METRICS_STATSD_INTERVAL = 10.0
+
+# Server-Timing header
+DEFAULT_SERVER_TIMING_ENABLED = False
+
+# On-demand profiling
+DEFAULT_PROFILING_MAX_FILES = 20
+DEFAULT_PROFILING_MAX_PER_MINUTE = 6
+DEFAULT_PROFILING_TOKEN_MAX_TTL = 3600
+
+# Inbound rate limiting
+DEFAULT_RATE_LIMIT_ENABLED = True
+DEFAULT_RATE_LIMIT_BACKEND = 'shared'
+DEFAULT_RATE_LIMIT_RATE = 20.0
+DEFAULT_RATE_LIMIT_BURST = 100
+DEFAULT_RATE_LIMIT_SLOTS = 8192
+
+# Batch endpoint
+DEFAULT_BATCH_MAX_REQUESTS = 20
+DEFAULT_BATCH_MAX_CONCURRENCY = 5
+DEFAULT_BATCH_WORKERS = 16
@@ -0,0 +1,117 @@
+"""Sub-requests of `/api/batch`, shared by the Flask app and the asyncio mode.
+
+A batch is a JSON object with a `requests` list of `{method, path, body}`
+items, where `path` is a gateway path such as `/api/courses/v1/courses`.
+Each item is mapped to the upstream serving it, or straight to the result
+of a sub-request that cannot be made (unknown path or method).
+"""
+import math
+
+from api_gateway.cfg import config
+from api_gateway.constants import (
+    DEFAULT_BATCH_MAX_CONCURRENCY,
+    DEFAULT_BATCH_MAX_REQUESTS,
+)
+from api_gateway.helpers.metrics import route_group
+from api_gateway.helpers.rate_limit import RateLimited, rate_limiter
+from api_gateway.helpers.router import proxy_router
+
+max_requests = config.batch.max_requests(default=DEFAULT_BATCH_MAX_REQUESTS, cast=int)
+max_concurrency = config.batch.max_concurrency(
+    default=DEFAULT_BATCH_MAX_CONCURRENCY, cast=int
+)
+
+# the gateway prefix of every route, upstreams serve the rest of the path
+API_PREFIX = '/api'
+
+# the proxied routes, by upstream name; the query string is only kept for
+# courses, like the Flask and asyncio handlers of each route do
+router = proxy_router({})
+
+
+class InvalidBatch(Exception):
+    """The body of a batch request is not a valid list of sub-requests."""
+
+    code = 400
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+
+def parse(payload):
+    """Validate a batch body, returning its `(method, path, query, body)` items."""
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise InvalidBatch('A list of requests is required.')
+    if len(items) > max_requests:
+        raise InvalidBatch(f'At most {max_requests} requests can be batched.')
+    parsed = []
+    for item in items:
+        if (
+            not isinstance(item, dict)
+            or not isinstance(item.get('method'), str)
+            or not isinstance(item.get('path'), str)
+        ):
+            raise InvalidBatch('Every request needs a method and a path.')
+        path, _, query = item['path'].partition('?')
+        if '..' in path.split('/'):
+            raise InvalidBatch(f'Invalid path {path}')
+        parsed.append((item['method'].upper(), path, query, item.get('body')))
+    return parsed
+
+
+def plan(items):
+    """Map every parsed item to `(upstream, method, upstream path, body)`.
+
+    Items that cannot be sent are mapped to their result instead.
+    """
+    calls = []
+    for method, path, query, body in items:
+        if not path.startswith(f'{API_PREFIX}/'):
+            calls.append(result(400, {'message': f'Invalid path {path}'}))
+            continue
+        route = router.match(path)
+        if route is None:
+            calls.append(result(404, {'message': f'No route for {path}'}))
+            continue
+        if method not in route.methods:
+            calls.append(result(405, {'message': f'{method} not allowed on {path}'}))
+            continue
+        upstream_path = path[len(API_PREFIX) :]
+        if query and route.name == 'courses':
+            upstream_path = f'{upstream_path}?{query}'
+        calls.append((route.name, method.lower(), upstream_path, body))
+    return calls
+
+
+def rate_limit(items, calls, token):
+    """Count every planned call against the rate limit of its route group.
+
+    The calls over the limit are replaced by their 429 result.
+    """
+    for index, ((_, path, _, _), call) in enumerate(zip(items, calls)):
+        if isinstance(call, dict):
+            continue
+        try:
+            rate_limiter.check(route_group(path), token)
+        except RateLimited as e:
+            calls[index] = error_result(e)
+    return calls
+
+
+def result(status, body, headers=None):
+    """The entry of one sub-request in the batch response."""
+    entry = {'status': status, 'body': body}
+    if headers:
+        entry['headers'] = headers
+    return entry
+
+
+def error_result(error):
+    """Mirror of the `handle_exception` error handler, for one sub-request."""
+    headers = None
+    if getattr(error, 'retry_after', None) is not None:
+        headers = {'Retry-After': str(max(int(math.ceil(error.retry_after)), 1))}
+    message = 'Error: ' + getattr(error, 'message', str(error))
+    return result(getattr(error, 'code', 500), {'message': message}, headers)
@@ -0,0 +1,85 @@
+"""JSON codec shared by the app, the API representation and the clients.
+
+orjson is used when it is installed (the `json` extras) unless
+`JSON_BACKEND=json`; the stdlib encoder is configured to produce the same
+output: compact separators, non-ASCII characters written as UTF-8 and
+datetimes, dates and times as ISO 8601 strings.
+"""
+import datetime
+import json
+
+try:
+    import orjson
+except ModuleNotFoundError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+from api_gateway.cfg import config
+from api_gateway.constants import DEFAULT_JSON_BACKEND
+
+BACKENDS = ('auto', 'orjson', 'json')
+
+
+def _iso_default(obj):
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _chain_default(default):
+    if default is None:
+        return _iso_default
+
+    def chained(obj):
+        try:
+            return _iso_default(obj)
+        except TypeError:
+            return default(obj)
+
+    return chained
+
+
+def _json_dumps(obj, default=None):
+    """Encode an object as a JSON string."""
+    return json.dumps(
+        obj, separators=(',', ':'), ensure_ascii=False, default=_chain_default(default)
+    )
+
+
+def _orjson_dumps(obj, default=None):
+    """Encode an object as a JSON string."""
+    try:
+        return orjson.dumps(obj, default=default).decode('utf-8')
+    except TypeError:
+        # e.g. integers over 64 bits or non str keys, which orjson refuses
+        return _json_dumps(obj, default)
+
+
+def select_backend(name):
+    """Return the name of the backend to use for a `JSON_BACKEND` setting."""
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown JSON backend {name!r}, use one of {BACKENDS}')
+    if name == 'orjson' and orjson is None:
+        raise ValueError('JSON_BACKEND=orjson requires orjson to be installed')
+    if name == 'auto':
+        return 'orjson' if orjson is not None else 'json'
+    return name
+
+
+backend = select_backend(config.json.backend(default=DEFAULT_JSON_BACKEND))
+
+if backend == 'orjson':
+    dumps = _orjson_dumps
+    loads = orjson.loads
+else:
+    dumps = _json_dumps
+    loads = json.loads
+
+
+def dumps_bytes(obj, default=None):
+    """Encode an object as UTF-8 JSON bytes."""
+    if backend == 'orjson':
+        try:
+            return orjson.dumps(obj, default=default)
+        except TypeError:
+            pass
+    return _json_dumps(obj, default).encode('utf-8')
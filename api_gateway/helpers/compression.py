@@ -0,0 +1,143 @@
+"""Response compression negotiated from the client `Accept-Encoding`."""
+import zlib
+
+try:
+    import brotli
+except ModuleNotFoundError:  # pragma: no cover
+    brotli = None  # type: ignore
+
+from flask import request
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_COMPRESSION_BROTLI_QUALITY,
+    DEFAULT_COMPRESSION_ENABLED,
+    DEFAULT_COMPRESSION_GZIP_LEVEL,
+    DEFAULT_COMPRESSION_MIN_SIZE,
+)
+
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'text/',
+)
+SKIPPED_STATUS_CODES = (204, 206, 304)
+
+
+class GzipCompressor:
+    """Streaming gzip encoder."""
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    """Streaming brotli encoder."""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class Compression:
+    """Compresses responses with the best encoding the client accepts.
+
+    Bodies under `min_size` bytes, already encoded bodies and content types
+    that do not compress well are sent as they are. Streamed bodies are
+    compressed chunk by chunk as they are relayed, so they are never fully
+    buffered. Brotli is only offered when the `brotli` package is installed.
+    """
+
+    def __init__(self, min_size, gzip_level, brotli_quality, enabled=True):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.enabled = enabled
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+    def init_app(self, app):
+        if self.enabled:
+            app.after_request(self.compress)
+
+    def compressor(self, encoding):
+        if encoding == 'br':
+            return BrotliCompressor(self.brotli_quality)
+        return GzipCompressor(self.gzip_level)
+
+    def _should_compress(self, response):
+        if (
+            request.method == 'HEAD'
+            or response.status_code in SKIPPED_STATUS_CODES
+            or 'Content-Encoding' in response.headers
+        ):
+            return False
+        content_type = response.mimetype or ''
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        if response.is_streamed:
+            length = response.headers.get('Content-Length')
+            return length is None or int(length) >= self.min_size
+        return len(response.get_data()) >= self.min_size
+
+    def compress(self, response):
+        """`after_request` hook compressing the response body."""
+        response.vary.add('Accept-Encoding')
+        if not self._should_compress(response):
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        compressor = self.compressor(encoding)
+        if response.is_streamed:
+            response.response = _compress_stream(compressor, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            body = compressor.compress(response.get_data()) + compressor.flush()
+            response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        # the encoded bytes differ, so a strong validator must not be reused
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def _compress_stream(compressor, chunks):
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+compression = Compression(
+    min_size=config.compression.min_size(
+        default=DEFAULT_COMPRESSION_MIN_SIZE, cast=int
+    ),
+    gzip_level=config.compression.gzip_level(
+        default=DEFAULT_COMPRESSION_GZIP_LEVEL, cast=int
+    ),
+    brotli_quality=config.compression.brotli_quality(
+        default=DEFAULT_COMPRESSION_BROTLI_QUALITY, cast=int
+    ),
+    enabled=config.compression.enabled(
+        default=DEFAULT_COMPRESSION_ENABLED, cast=to_bool
+    ),
+)
@@ -0,0 +1,47 @@
+"""Validators and conditional GETs for proxied responses."""
+import hashlib
+
+from flask import Response, request
+from werkzeug.http import is_resource_modified
+
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+
+def weak_etag(body):
+    """Cheap weak ETag of a response body."""
+    return f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def validators(headers, body=None):
+    """Return the upstream validators, computing a weak ETag from `body` if missing."""
+    found = {name: headers[name] for name in VALIDATOR_HEADERS if headers.get(name)}
+    if body is not None and 'ETag' not in found:
+        found['ETag'] = weak_etag(body)
+    return found
+
+
+def conditional_headers():
+    """Conditional headers of the current GET, to be forwarded upstream."""
+    if request.method != 'GET':
+        return {}
+    return {
+        name.lower(): request.headers[name]
+        for name in CONDITIONAL_HEADERS
+        if name in request.headers
+    }
+
+
+def is_not_modified(response_validators):
+    """Whether the client copy of a resource with these validators is current."""
+    if request.method != 'GET' or not response_validators:
+        return False
+    return not is_resource_modified(
+        request.environ,
+        etag=response_validators.get('ETag'),
+        last_modified=response_validators.get('Last-Modified'),
+    )
+
+
+def not_modified_response(response_validators):
+    return Response(status=304, headers=response_validators)
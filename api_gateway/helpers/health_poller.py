@@ -0,0 +1,89 @@
+"""Background refresh of the upstream status snapshot."""
+import os
+import random
+import threading
+import time
+
+from api_gateway.helpers.logger import logger
+
+
+class HealthPoller:
+    """Keeps the latest upstream status snapshot fresh from a daemon thread.
+
+    The thread is started lazily on first use and again after a fork, since
+    threads do not survive into gunicorn workers. Each worker polls on its
+    own every `interval` seconds, +/- a random `jitter` so workers (and
+    dynos) do not probe the upstreams in lockstep.
+
+    If there is no snapshot yet, or it is older than `max_age` (the poller
+    died or is stuck), the snapshot is refreshed synchronously instead.
+    """
+
+    def __init__(self, refresh, interval, jitter, max_age=None):
+        self._refresh = refresh
+        self.interval = interval
+        self.jitter = min(jitter, interval)
+        self.max_age = max_age if max_age is not None else 3 * interval
+        self._snapshot = None
+        self._taken_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def snapshot(self):
+        """Return the latest status snapshot."""
+        self.ensure_started()
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - self._taken_at > self.max_age:
+            return self.refresh()
+        return snapshot
+
+    def refresh(self, stop=None):
+        """Probe the upstreams now and store the result."""
+        snapshot = self._refresh()
+        with self._lock:
+            if stop is None or not stop.is_set():
+                self._snapshot = snapshot
+                self._taken_at = time.monotonic()
+        return snapshot
+
+    def ensure_started(self):
+        """Start the polling thread if this process is not running one."""
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='health-poller', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop polling and forget the snapshot."""
+        self._stop.set()
+        with self._lock:
+            self._thread = None
+            self._snapshot = None
+            self._taken_at = 0.0
+
+    def _running(self):
+        return (
+            self._thread is not None
+            and self._pid == os.getpid()
+            and self._thread.is_alive()
+        )
+
+    def _next_delay(self):
+        return self.interval + random.uniform(-self.jitter, self.jitter)  # nosec
+
+    def _run(self):
+        stop = self._stop
+        while not stop.wait(self._next_delay()):
+            try:
+                self.refresh(stop)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.error('Health poller refresh failed: %s', e)
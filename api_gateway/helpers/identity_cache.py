@@ -0,0 +1,158 @@
+"""Bounded TTL/LRU cache of auth token -> identity."""
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+import time
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_IDENTITY_CACHE_ENABLED,
+    DEFAULT_IDENTITY_CACHE_MAXSIZE,
+    DEFAULT_IDENTITY_CACHE_TTL,
+)
+from api_gateway.helpers.metrics import metrics
+from api_gateway.helpers.tokens import (
+    decode_claims,
+    expiration_timestamp,
+    token_verifier,
+)
+
+SIGN_IN_ACTIONS = ('signin', 'signup')
+SIGN_OUT_ACTIONS = ('signout',)
+
+Identity = namedtuple('Identity', ['user_id', 'status', 'expires_at'])
+
+
+def token_key(token):
+    """Hash a token so raw credentials are never kept in memory."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class IdentityCache:
+    """Remembers which user a token belongs to.
+
+    Entries expire after `ttl` seconds or when the token itself expires,
+    whichever comes first, and the least recently used entry is evicted once
+    `maxsize` is reached. Only the user `_id` and the auth status are stored.
+    Lookups and evictions are also counted in `metrics`.
+    """
+
+    def __init__(self, ttl, maxsize, enabled=True, clock=time.time):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.enabled = enabled
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        """Return the cached identity of a token, or None."""
+        if not self.enabled or not token:
+            return None
+        key = token_key(token)
+        now = self.clock()
+        with self._lock:
+            identity = self._entries.get(key)
+            if identity is not None and identity.expires_at <= now:
+                del self._entries[key]
+                identity = None
+            if identity is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        metrics.inc(
+            'gateway_identity_cache_lookups_total',
+            (('result', 'miss' if identity is None else 'hit'),),
+        )
+        return identity
+
+    def put(self, token, user_id, status=200):
+        """Cache the identity of a token, honouring its own expiration."""
+        if not self.enabled or not token or not user_id:
+            return
+        now = self.clock()
+        expires_at = now + self.ttl
+        token_expiration = expiration_timestamp(decode_claims(token))
+        if token_expiration is not None:
+            expires_at = min(expires_at, token_expiration)
+        if expires_at <= now:
+            return
+        key = token_key(token)
+        evicted = 0
+        with self._lock:
+            self._entries[key] = Identity(user_id, status, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.inc('gateway_identity_cache_evictions_total', (), evicted)
+
+    def invalidate(self, token):
+        """Forget a token, e.g. after it was signed out."""
+        if not token:
+            return
+        with self._lock:
+            self._entries.pop(token_key(token), None)
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRatio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+identity_cache = IdentityCache(
+    ttl=config.identity_cache.ttl(default=DEFAULT_IDENTITY_CACHE_TTL, cast=float),
+    maxsize=config.identity_cache.maxsize(
+        default=DEFAULT_IDENTITY_CACHE_MAXSIZE, cast=int
+    ),
+    enabled=config.identity_cache.enabled(
+        default=DEFAULT_IDENTITY_CACHE_ENABLED, cast=to_bool
+    ),
+)
+
+
+def session_action(path):
+    """Return the user sign in/up/out action a path performs, if any."""
+    segments = path.rstrip('/').split('/')
+    if len(segments) < 2 or segments[-2] != 'users':
+        return None
+    action = segments[-1].replace('-', '').lower()
+    if action in SIGN_IN_ACTIONS or action in SIGN_OUT_ACTIONS:
+        return action
+    return None
+
+
+def update_identity_cache(path, token, res_body, res_status_code):
+    """Prime the identity cache on user sign in/up and revoke tokens on sign out."""
+    action = session_action(path)
+    if action in SIGN_OUT_ACTIONS:
+        identity_cache.invalidate(token)
+        token_verifier.revoke(token)
+    elif (
+        action in SIGN_IN_ACTIONS
+        and res_status_code in (200, 201)
+        and isinstance(res_body, dict)
+    ):
+        identity_cache.put(res_body.get('accessToken'), res_body.get('_id'))
@@ -1,32 +1,223 @@
-import datetime
+import atexit
+import copy
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import random
+import reprlib
+import threading
+import time
 
-from pythonjsonlogger import jsonlogger
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_LOG_ARG_MAX_CHARS,
+    DEFAULT_LOG_DEBUG_SAMPLE_RATE,
+    DEFAULT_LOG_INFO_SAMPLE_RATE,
+    DEFAULT_LOG_MESSAGE_MAX_CHARS,
+    DEFAULT_LOG_QUEUE_ENABLED,
+    DEFAULT_LOG_QUEUE_SIZE,
+    DEFAULT_LOG_SUCCESS_SAMPLE_RATE,
+)
+from api_gateway.helpers import codec
 
 logger = logging.getLogger()
 
 
-class CustomJsonFormatter(jsonlogger.JsonFormatter):
-    def add_fields(self, log_record, record, message_dict):
-        super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
-        if not log_record.get('timestamp'):
-            # this doesn't use record.created, so it is slightly off
-            now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
-            log_record['timestamp'] = now
-        if log_record.get('level'):
-            log_record['level'] = log_record['level'].upper()
-        else:
-            log_record['level'] = record.levelname
+# attributes every LogRecord has, anything else on a record came from `extra`
+RECORD_ATTRIBUTES = frozenset(
+    vars(logging.LogRecord('', 0, '', 0, '', (), None)).keys()
+) | {'message', 'asctime'}
 
 
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line.
+
+    The layout is fixed: `message`, then any `extra` fields, `exc_info`,
+    `timestamp` (UTC, from `record.created`) and `level`. The date part of
+    the timestamp is only formatted once per second, and objects are
+    encoded with the gateway JSON codec (values it cannot encode are
+    written with `str`).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._second_text = ''
+
+    def timestamp(self, created):
+        second = int(created)
+        if second != self._second:
+            self._second_text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+            self._second = second
+        return f'{self._second_text}.{int((created - second) * 1e6):06d}Z'
+
+    def format(self, record):
+        log_record = {'message': record.getMessage()}
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRIBUTES:
+                log_record[key] = value
+        if record.exc_info:
+            log_record['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            log_record['exc_info'] = record.exc_text
+        log_record['timestamp'] = self.timestamp(record.created)
+        log_record['level'] = record.levelname
+        return codec.dumps(log_record, default=str)
+
+
+def _truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return f'{text[:max_chars]}... ({len(text) - max_chars} more chars)'
+
+
+class LogPolicy(logging.Filter):
+    """Samples and trims records before they are formatted.
+
+    Warnings and errors are always kept. Other records are kept with the
+    rate of their level, or with `success_rate` when they carry the
+    `status_code` (passed in `extra`) of a successful upstream response.
+
+    Arguments are rendered with a size bounded `reprlib` representation, so
+    a huge response body is never fully formatted, and the message is cut
+    at `message_max_chars`.
+    """
+
+    def __init__(
+        self,
+        level_rates,
+        success_rate,
+        arg_max_chars,
+        message_max_chars,
+        rand=random.random,
+    ):
+        super().__init__()
+        self.level_rates = level_rates
+        self.success_rate = success_rate
+        self.message_max_chars = message_max_chars
+        self.rand = rand
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = arg_max_chars
+        self._repr.maxother = arg_max_chars
+        self._repr.maxlist = self._repr.maxdict = self._repr.maxtuple = 20
+        self.arg_max_chars = arg_max_chars
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+
+    def _rate(self, record):
+        if record.levelno >= logging.WARNING:
+            return 1.0
+        status_code = getattr(record, 'status_code', None)
+        if isinstance(status_code, int) and status_code < 400:
+            return self.success_rate
+        return self.level_rates.get(record.levelno, 1.0)
+
+    def _trim(self, arg):
+        if isinstance(arg, str):
+            return _truncate(arg, self.arg_max_chars)
+        if isinstance(arg, (dict, list, tuple, set, bytes)):
+            return _truncate(self._repr.repr(arg), self.arg_max_chars)
+        return arg
+
+    def filter(self, record):
+        rate = self._rate(record)
+        if rate < 1.0 and self.rand() >= rate:
+            with self._lock:
+                self.sampled_out += 1
+            return False
+        if isinstance(record.args, tuple):
+            record.args = tuple(self._trim(arg) for arg in record.args)
+        if isinstance(record.msg, str):
+            record.msg = _truncate(record.msg, self.message_max_chars)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._lock_dropped = threading.Lock()
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock_dropped:
+                self.dropped += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+log_policy = LogPolicy(
+    level_rates={
+        logging.DEBUG: config.log.debug_sample_rate(
+            default=DEFAULT_LOG_DEBUG_SAMPLE_RATE, cast=float
+        ),
+        logging.INFO: config.log.info_sample_rate(
+            default=DEFAULT_LOG_INFO_SAMPLE_RATE, cast=float
+        ),
+    },
+    success_rate=config.log.success_sample_rate(
+        default=DEFAULT_LOG_SUCCESS_SAMPLE_RATE, cast=float
+    ),
+    arg_max_chars=config.log.arg_max_chars(default=DEFAULT_LOG_ARG_MAX_CHARS, cast=int),
+    message_max_chars=config.log.message_max_chars(
+        default=DEFAULT_LOG_MESSAGE_MAX_CHARS, cast=int
+    ),
+)
+
 log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter())
+
+queue_handler = None
+log_listener = None
+if config.log.queue_enabled(default=DEFAULT_LOG_QUEUE_ENABLED, cast=to_bool):
+    # records are formatted and written by a background thread, off the
+    # request path
+    queue_size = config.log.queue_size(default=DEFAULT_LOG_QUEUE_SIZE, cast=int)
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(log_policy)
+    log_listener = QueueListener(queue_handler.queue, log_handler)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logger.addHandler(queue_handler)
 
-formatter = jsonlogger.JsonFormatter()
-log_handler.setFormatter(CustomJsonFormatter())
-logger.addHandler(log_handler)
+    def _restart_listener():
+        """The listener thread does not survive a fork, start a new one."""
+        global log_listener  # pylint: disable=global-statement
+        queue_handler.queue = queue.Queue(queue_size)
+        log_listener = QueueListener(queue_handler.queue, log_handler)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_listener)
+else:
+    log_handler.addFilter(log_policy)
+    logger.addHandler(log_handler)
 logger.setLevel(logging.DEBUG)
 
 
+def log_stats():
+    """Return the counters of records that were not written."""
+    return {
+        'queued': queue_handler is not None,
+        'pending': queue_handler.queue.qsize() if queue_handler else 0,
+        'dropped': queue_handler.dropped if queue_handler else 0,
+        'sampledOut': log_policy.sampled_out,
+    }
+
+
 class LoggingMiddleware(object):
     def on_error(self, info):
         def f(error):
@@ -0,0 +1,657 @@
+"""Request and upstream metrics, aggregated across the gunicorn workers.
+
+Every process writes its own series to a memory mapped file in the metrics
+directory; `/metrics` sums the files of every worker and renders them in
+the Prometheus text format. Counters and histograms of workers that exited
+are kept, gauges only count live workers. Host wide values, such as the
+shared concurrency limits, are added by collectors when rendering.
+"""
+import bisect
+import functools
+import glob
+import hmac
+import mmap
+import os
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+import weakref
+
+from flask import Response, abort, g, request
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_METRICS_ENABLED,
+    DEFAULT_METRICS_STATSD_ENABLED,
+    DEFAULT_METRICS_STATSD_HOST,
+    DEFAULT_METRICS_STATSD_INTERVAL,
+    DEFAULT_METRICS_STATSD_PORT,
+)
+from api_gateway.helpers.logger import log_stats, logger
+
+# upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help)
+METRICS = {
+    'gateway_requests_total': (
+        'counter',
+        'Requests served, by route, method and status code.',
+    ),
+    'gateway_request_duration_seconds': (
+        'histogram',
+        'Time until the response (headers of streamed ones) was ready, by route.',
+    ),
+    'gateway_requests_in_flight': ('gauge', 'Requests being served, by route.'),
+    'gateway_identity_cache_lookups_total': (
+        'counter',
+        'Token lookups in the identity cache, by result (hit or miss).',
+    ),
+    'gateway_identity_cache_evictions_total': (
+        'counter',
+        'Identities evicted from the full identity cache.',
+    ),
+    'gateway_response_cache_lookups_total': (
+        'counter',
+        'GETs looked up in the response cache, by result (hit or miss).',
+    ),
+    'gateway_response_cache_early_expirations_total': (
+        'counter',
+        'Response cache entries refreshed early to avoid a stampede.',
+    ),
+    'gateway_response_cache_evictions_total': (
+        'counter',
+        'Response cache entries evicted to stay under the size limit.',
+    ),
+    'gateway_response_cache_invalidations_total': (
+        'counter',
+        'Response cache entries dropped by a write to their resource.',
+    ),
+    'gateway_response_cache_entries': ('gauge', 'Responses in the cache.'),
+    'gateway_response_cache_bytes': (
+        'gauge',
+        'Estimated size of the responses in the cache.',
+    ),
+    'gateway_log_records_dropped_total': (
+        'counter',
+        'Log records dropped because the log queue was full.',
+    ),
+    'gateway_log_records_sampled_out_total': (
+        'counter',
+        'Log records left out by the log sampling.',
+    ),
+    'gateway_upstream_requests_total': (
+        'counter',
+        'Upstream requests, by upstream and status code.',
+    ),
+    'gateway_upstream_request_duration_seconds': (
+        'histogram',
+        'Time until the upstream response headers arrived, by upstream.',
+    ),
+    'gateway_upstream_requests_in_flight': (
+        'gauge',
+        'Upstream requests waiting for a response, each holding a pooled '
+        'connection, by upstream.',
+    ),
+    'gateway_upstream_pool_maxsize': (
+        'gauge',
+        'Connections kept per upstream host, summed over the workers.',
+    ),
+    'gateway_upstream_connections_opened_total': (
+        'counter',
+        'Connections opened to the upstream by the pools, by upstream.',
+    ),
+    'gateway_upstream_connections_reused_total': (
+        'counter',
+        'Upstream requests sent on a kept alive connection, by upstream.',
+    ),
+    'gateway_upstream_idle_connections': (
+        'gauge',
+        'Kept alive connections waiting in the pools, by upstream.',
+    ),
+    'gateway_upstream_hedges_total': (
+        'counter',
+        'Backup copies sent of slow GETs, by upstream.',
+    ),
+    'gateway_upstream_hedge_wins_total': (
+        'counter',
+        'Hedged GETs answered by the backup copy first, by upstream.',
+    ),
+    'gateway_upstream_hedges_over_budget_total': (
+        'counter',
+        'Slow GETs not hedged because the hedge budget was spent, by upstream.',
+    ),
+    'gateway_upstream_calls_executed_total': (
+        'counter',
+        'GETs sent upstream by the coalescing layer, by upstream.',
+    ),
+    'gateway_upstream_calls_coalesced_total': (
+        'counter',
+        'GETs that waited on an identical call already in flight, by upstream.',
+    ),
+    'gateway_upstream_breaker_state': (
+        'gauge',
+        'Workers whose circuit breaker of the upstream is in each state, by '
+        'upstream and state.',
+    ),
+    'gateway_upstream_breaker_transitions_total': (
+        'counter',
+        'Circuit breaker state changes, by upstream and from and to state.',
+    ),
+    'gateway_upstream_concurrency_limit': (
+        'gauge',
+        'Adaptive limit of the concurrent upstream calls of every worker, by '
+        'upstream.',
+    ),
+    'gateway_upstream_concurrency_rejections_total': (
+        'counter',
+        'Upstream calls shed by the concurrency limit, by upstream.',
+    ),
+    'gateway_upstream_queue_wait_seconds': (
+        'histogram',
+        'Time upstream calls waited for a concurrency slot, by upstream.',
+    ),
+}
+
+ROUTE_GROUPS = frozenset(('courses', 'auth-server', 'payments', 'status', 'batch'))
+
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+_USED = struct.Struct('<Q')
+_ENTRY = struct.Struct('<II')
+_VALUE = struct.Struct('<d')
+
+
+def _padded(length):
+    return (length + 7) // 8 * 8
+
+
+def read_entries(data):
+    """Yield the (key, values) entries of the contents of a store file."""
+    if len(data) < _USED.size:
+        return
+    used = min(_USED.unpack_from(data, 0)[0], len(data))
+    position = _USED.size
+    while position + _ENTRY.size <= used:
+        key_length, width = _ENTRY.unpack_from(data, position)
+        key_start = position + _ENTRY.size
+        values_start = key_start + _padded(key_length)
+        key = bytes(data[key_start : key_start + key_length]).decode('utf-8')
+        values = struct.unpack_from(f'<{width}d', data, values_start)
+        yield key, values
+        position = values_start + width * _VALUE.size
+
+
+class MmapStore:
+    """Append only file of named arrays of doubles, memory mapped.
+
+    The first 8 bytes hold how many bytes are in use, followed by entries of
+    key length and value count (2 x uint32), the UTF-8 key padded to 8 bytes
+    and the values. An entry is written before the used size is bumped, so
+    readers in other processes never see a partial one. Not thread safe.
+    """
+
+    def __init__(self, path, initial_size=64 * 1024):
+        self.path = path
+        self._file = open(path, 'a+b')  # pylint: disable=consider-using-with
+        size = os.fstat(self._file.fileno()).st_size
+        if size < initial_size:
+            self._file.truncate(initial_size)
+            size = initial_size
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._used = max(_USED.unpack_from(self._map, 0)[0], _USED.size)
+        self._positions = {}
+        position = _USED.size
+        for key, values in read_entries(self._map):
+            key_length = len(key.encode('utf-8'))
+            self._positions[key] = position + _ENTRY.size + _padded(key_length)
+            position = self._positions[key] + len(values) * _VALUE.size
+
+    def _position(self, key, width):
+        position = self._positions.get(key)
+        if position is not None:
+            return position
+        encoded = key.encode('utf-8')
+        values_start = self._used + _ENTRY.size + _padded(len(encoded))
+        end = values_start + width * _VALUE.size
+        if end > len(self._map):
+            self._grow(end)
+        _ENTRY.pack_into(self._map, self._used, len(encoded), width)
+        self._map[
+            self._used + _ENTRY.size : self._used + _ENTRY.size + len(encoded)
+        ] = encoded
+        self._used = end
+        _USED.pack_into(self._map, 0, self._used)
+        self._positions[key] = values_start
+        return values_start
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+
+    def add(self, key, amount, index=0, width=1):
+        offset = self._position(key, width) + index * _VALUE.size
+        _VALUE.pack_into(
+            self._map, offset, _VALUE.unpack_from(self._map, offset)[0] + amount
+        )
+
+    def set(self, key, value, index=0, width=1):
+        _VALUE.pack_into(
+            self._map, self._position(key, width) + index * _VALUE.size, value
+        )
+
+    def entries(self):
+        return dict(read_entries(self._map))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+@functools.lru_cache(maxsize=1024)
+def series_key(name, labels):
+    """`name{label="value",...}` for a metric and a tuple of label pairs."""
+    if not labels:
+        return name
+    body = ','.join(
+        '{}="{}"'.format(label, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for label, value in labels
+    )
+    return f'{name}{{{body}}}'
+
+
+def _split_key(key):
+    name, _, body = key.partition('{')
+    return name, body[:-1]
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # pragma: no cover
+        return True
+    return True
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics:
+    """Counters, gauges and latency histograms shared by the workers."""
+
+    def __init__(
+        self, directory, enabled=True, token='', buckets=BUCKETS, refresh_interval=1.0
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self.token = token
+        self.buckets = buckets
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._store = None
+        self._pid = None
+        self._on_store = []
+        self._collectors = []
+        self._process_collectors = []
+        self._refreshed = None
+
+    def _current(self):
+        if self._pid != os.getpid():
+            # a new process (e.g. a forked worker) writes its own file
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._store = MmapStore(os.path.join(self.directory, f'{self._pid}.db'))
+            for callback in self._on_store:
+                callback()
+        return self._store
+
+    def on_new_process(self, callback):
+        """Call `callback` whenever a process starts writing its metrics."""
+        self._on_store.append(callback)
+
+    def add_collector(self, method, per_process=False):
+        """Add the `(name, labels, value)` series `method()` returns to `collect`.
+
+        For host wide values, which every worker would otherwise count once.
+        With `per_process`, the values are those of the calling worker
+        instead: each worker writes them to its own store every
+        `refresh_interval` seconds as its requests finish, and they are
+        summed like the other series. Only a weak reference to a bound
+        method is kept.
+        """
+        if hasattr(method, '__self__'):
+            ref = weakref.WeakMethod(method)
+        else:
+
+            def ref():
+                return method
+
+        if per_process:
+            self._process_collectors.append(ref)
+        else:
+            self._collectors.append(ref)
+
+    @staticmethod
+    def _collected(refs):
+        for ref in refs:
+            method = ref()
+            if method is not None:
+                yield from method()
+
+    def refresh(self, force=False):
+        """Write the values of the per process collectors to this worker store."""
+        if not self.enabled or not self._process_collectors:
+            return
+        now = time.monotonic()
+        if not force and self._refreshed is not None:
+            if now - self._refreshed < self.refresh_interval:
+                return
+        self._refreshed = now
+        self._process_collectors = [
+            ref for ref in self._process_collectors if ref() is not None
+        ]
+        for name, labels, value in self._collected(self._process_collectors):
+            self.set(name, labels, value)
+
+    def inc(self, name, labels=(), amount=1.0):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._current().add(series_key(name, labels), amount)
+
+    def set(self, name, labels, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._current().set(series_key(name, labels), value)
+
+    def observe(self, name, labels, seconds):
+        """Record a latency: bucket counts first, then the sum, in one entry."""
+        if not self.enabled:
+            return
+        width = len(self.buckets) + 2
+        key = series_key(name, labels)
+        with self._lock:
+            store = self._current()
+            store.add(key, 1, bisect.bisect_left(self.buckets, seconds), width)
+            store.add(key, seconds, width - 1, width)
+
+    def own(self):
+        """Series written by this process."""
+        with self._lock:
+            return self._current().entries()
+
+    def collect(self):
+        """Series of every worker, summed."""
+        self.refresh(force=True)
+        merged = {}
+        for path in glob.glob(os.path.join(self.directory, '*.db')):
+            try:
+                pid = int(os.path.basename(path)[: -len('.db')])
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except (ValueError, OSError):
+                continue
+            alive = pid == os.getpid() or pid_alive(pid)
+            for key, values in read_entries(data):
+                kind = METRICS.get(_split_key(key)[0], ('gauge',))[0]
+                if kind == 'gauge' and not alive:
+                    continue
+                total = merged.get(key)
+                merged[key] = (
+                    values if total is None else tuple(map(sum, zip(total, values)))
+                )
+        self._collectors = [ref for ref in self._collectors if ref() is not None]
+        for name, labels, value in self._collected(self._collectors):
+            merged[series_key(name, labels)] = (value,)
+        return merged
+
+    def render(self):
+        """The series of every worker in the Prometheus text format."""
+        by_name = {}
+        for key, values in sorted(self.collect().items()):
+            name, body = _split_key(key)
+            by_name.setdefault(name, []).append((body, values))
+        lines = []
+        for name, series in by_name.items():
+            kind, help_text = METRICS.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for body, values in series:
+                if kind != 'histogram':
+                    lines.append(f'{name}{_braces(body)} {_format_value(values[0])}')
+                    continue
+                count = 0
+                bounds = [_format_value(bound) for bound in self.buckets] + ['+Inf']
+                for bound, bucket in zip(bounds, values[:-1]):
+                    count += bucket
+                    labels = f'{body},le="{bound}"' if body else f'le="{bound}"'
+                    lines.append(f'{name}_bucket{{{labels}}} {_format_value(count)}')
+                lines.append(f'{name}_sum{_braces(body)} {_format_value(values[-1])}')
+                lines.append(f'{name}_count{_braces(body)} {_format_value(count)}')
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Forget the series of this process."""
+        with self._lock:
+            if self._store is not None and self._pid == os.getpid():
+                self._store.close()
+                os.remove(self._store.path)
+            self._store = None
+            self._pid = None
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def request_started(self, route):
+        """Count a request of a route group in flight, returning its start."""
+        self.inc('gateway_requests_in_flight', (('route', route),))
+        return time.perf_counter()
+
+    def request_finished(self, route, method, status, started):
+        labels = (('route', route),)
+        self.inc('gateway_requests_in_flight', labels, -1)
+        self.observe(
+            'gateway_request_duration_seconds', labels, time.perf_counter() - started
+        )
+        self.inc(
+            'gateway_requests_total',
+            (('route', route), ('method', method), ('status', status)),
+        )
+        self.refresh()
+
+    def _before_request(self):
+        route = route_group(request.path)
+        g.metrics_route = route
+        g.metrics_started = self.request_started(route)
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, error):  # pylint: disable=unused-argument
+        route = g.pop('metrics_route', None)
+        if route is None:
+            return
+        self.request_finished(
+            route,
+            request.method,
+            g.pop('metrics_status', 500),
+            g.pop('metrics_started'),
+        )
+
+    def authorized(self, authorization):
+        """Whether an `Authorization` header value may read the metrics."""
+        # compared as bytes, compare_digest refuses non-ASCII str
+        return hmac.compare_digest(
+            (authorization or '').encode('utf-8'),
+            f'Bearer {self.token}'.encode('utf-8'),
+        )
+
+    def view(self):
+        """`/metrics`, for callers sending `Authorization: Bearer <METRICS_TOKEN>`."""
+        if not self.token:
+            abort(404)
+        if not self.authorized(request.headers.get('Authorization')):
+            abort(401)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _braces(body):
+    return f'{{{body}}}' if body else ''
+
+
+def route_group(path):
+    """The proxied service of a path, `other` for anything else."""
+    if not path.startswith('/api/'):
+        return 'other'
+    group = path[len('/api/') :].split('/', 1)[0]
+    return group if group in ROUTE_GROUPS else 'other'
+
+
+class StatsdPusher:
+    """Pushes the metrics to a DogStatsD agent from a daemon thread.
+
+    Each worker sends the increase of its own counters and histograms since
+    the previous push, which the agent adds up, and the gauges summed over
+    every worker. Histograms are sent as `.count`, `.sum` and per bucket
+    `.bucket` counts tagged with `le`.
+    """
+
+    def __init__(self, metrics, host, port, interval, max_packet=1432):
+        self.metrics = metrics
+        self.address = (host, port)
+        self.interval = interval
+        self.max_packet = max_packet
+        self._previous = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the pushing thread if this process is not running one."""
+        with self._lock:
+            if (
+                self._thread is not None
+                and self._pid == os.getpid()
+                and self._thread.is_alive()
+            ):
+                return
+            self._pid = os.getpid()
+            self._previous = {}
+            self._thread = threading.Thread(
+                target=self._run, name='statsd-pusher', daemon=True
+            )
+            self._thread.start()
+
+    def lines(self):
+        """DogStatsD lines of the changes since the previous call."""
+        self.metrics.refresh(force=True)
+        own = self.metrics.own()
+        lines = []
+        for key, values in own.items():
+            name, body = _split_key(key)
+            kind = METRICS.get(name, ('gauge',))[0]
+            if kind == 'gauge':
+                continue
+            previous = self._previous.get(key, (0.0,) * len(values))
+            deltas = [value - before for value, before in zip(values, previous)]
+            tags = _tags(body)
+            if kind == 'counter':
+                if deltas[0]:
+                    lines.append(f'{name}:{_format_value(deltas[0])}|c{tags}')
+                continue
+            count = sum(deltas[:-1])
+            if not count:
+                continue
+            lines.append(f'{name}.count:{_format_value(count)}|c{tags}')
+            lines.append(f'{name}.sum:{_format_value(deltas[-1])}|c{tags}')
+            bounds = [_format_value(bound) for bound in self.metrics.buckets] + ['inf']
+            for bound, delta in zip(bounds, deltas[:-1]):
+                if delta:
+                    lines.append(
+                        f'{name}.bucket:{_format_value(delta)}|c'
+                        f'{_tags(body, ("le", bound))}'
+                    )
+        self._previous = own
+        for key, values in self.metrics.collect().items():
+            name, body = _split_key(key)
+            if METRICS.get(name, ('gauge',))[0] == 'gauge':
+                lines.append(f'{name}:{_format_value(values[0])}|g{_tags(body)}')
+        return lines
+
+    def push(self, sock):
+        packet = []
+        size = 0
+        for line in self.lines():
+            if packet and size + len(line) + 1 > self.max_packet:
+                sock.sendto('\n'.join(packet).encode(), self.address)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            sock.sendto('\n'.join(packet).encode(), self.address)
+
+    def _run(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.push(sock)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning('Pushing metrics to DogStatsD failed: %s', e)
+
+
+def _tags(body, extra=None):
+    tags = [f'{label}:{value}' for label, value in _LABEL.findall(body)]
+    if extra is not None:
+        tags.append(f'{extra[0]}:{extra[1]}')
+    return f'|#{",".join(tags)}' if tags else ''
+
+
+metrics = Metrics(
+    directory=config.metrics.dir(default='')
+    or os.path.join(tempfile.gettempdir(), f'api-gateway-metrics-{os.getppid()}'),
+    enabled=config.metrics.enabled(default=DEFAULT_METRICS_ENABLED, cast=to_bool),
+    token=config.metrics.token(default=''),
+)
+
+
+def log_series():
+    """The records of this worker the logger did not write."""
+    stats = log_stats()
+    return [
+        ('gateway_log_records_dropped_total', (), stats['dropped']),
+        ('gateway_log_records_sampled_out_total', (), stats['sampledOut']),
+    ]
+
+
+metrics.add_collector(log_series, per_process=True)
+
+statsd_pusher = None
+if config.metrics.statsd_enabled(default=DEFAULT_METRICS_STATSD_ENABLED, cast=to_bool):
+    statsd_pusher = StatsdPusher(
+        metrics,
+        host=config.metrics.statsd_host(default=DEFAULT_METRICS_STATSD_HOST),
+        port=config.metrics.statsd_port(default=DEFAULT_METRICS_STATSD_PORT, cast=int),
+        interval=config.metrics.statsd_interval(
+            default=DEFAULT_METRICS_STATSD_INTERVAL, cast=float
+        ),
+    )
+    metrics.on_new_process(statsd_pusher.ensure_started)
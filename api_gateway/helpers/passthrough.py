@@ -0,0 +1,73 @@
+"""Relay upstream responses to the client without decoding them."""
+from flask import Response
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_PASSTHROUGH_CHUNK_SIZE,
+    DEFAULT_PASSTHROUGH_ENABLED,
+    DEFAULT_PASSTHROUGH_STREAM_THRESHOLD,
+)
+from api_gateway.helpers.conditional import (
+    is_not_modified,
+    not_modified_response,
+    validators,
+)
+
+passthrough_enabled = config.passthrough.enabled(
+    default=DEFAULT_PASSTHROUGH_ENABLED, cast=to_bool
+)
+chunk_size = config.passthrough.chunk_size(
+    default=DEFAULT_PASSTHROUGH_CHUNK_SIZE, cast=int
+)
+stream_threshold = config.passthrough.stream_threshold(
+    default=DEFAULT_PASSTHROUGH_STREAM_THRESHOLD, cast=int
+)
+
+
+def _stream(upstream_response):
+    try:
+        for chunk in upstream_response.iter_content(chunk_size):
+            yield chunk
+    finally:
+        upstream_response.close()
+
+
+def passthrough_response(upstream_response):
+    """Build a Flask response with the upstream status, content type and body.
+
+    Bodies whose declared length is under the stream threshold are relayed in
+    one piece; bigger (or unknown length) bodies are streamed in chunks while
+    they are read from the upstream, releasing the connection at the end.
+
+    Upstream `ETag`/`Last-Modified` validators are relayed, a weak ETag is
+    computed for in-memory bodies that have none, and conditional GETs that
+    match them are answered with a 304.
+    """
+    content_type = upstream_response.headers.get('Content-Type', 'application/json')
+    length = upstream_response.headers.get('Content-Length')
+    ok = upstream_response.status_code == 200
+    if length is not None and length.isdigit() and int(length) <= stream_threshold:
+        body = upstream_response.content
+        response_validators = validators(
+            upstream_response.headers, body if ok else None
+        )
+        if ok and is_not_modified(response_validators):
+            return not_modified_response(response_validators)
+        return Response(
+            body,
+            status=upstream_response.status_code,
+            content_type=content_type,
+            headers=response_validators,
+        )
+
+    response_validators = validators(upstream_response.headers)
+    if ok and is_not_modified(response_validators):
+        upstream_response.close()
+        return not_modified_response(response_validators)
+    return Response(
+        _stream(upstream_response),
+        status=upstream_response.status_code,
+        content_type=content_type,
+        headers=response_validators,
+        direct_passthrough=True,
+    )
@@ -0,0 +1,197 @@
+"""On-demand profiling of single requests, for admins.
+
+A request carrying a valid signed `X-Profile` header runs under cProfile
+and its stats are written to a spool directory shared by the workers,
+which keeps the newest `max_files` of them. They can be listed at
+`/profiles` and downloaded (pstats format, for `pstats`, snakeviz or
+flameprof) or read as a text report at `/profiles/<id>`, with the same
+header. Nothing is registered unless `PROFILING_SECRET` is set, and other
+requests only pay for a header lookup.
+"""
+import collections
+import cProfile
+import hashlib
+import hmac
+import io
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import Response, abort, g, jsonify, request, send_file
+
+from api_gateway.cfg import config
+from api_gateway.constants import (
+    DEFAULT_PROFILING_MAX_FILES,
+    DEFAULT_PROFILING_MAX_PER_MINUTE,
+    DEFAULT_PROFILING_TOKEN_MAX_TTL,
+)
+from api_gateway.helpers.logger import logger
+
+HEADER = 'X-Profile'
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+PROFILE_ID = re.compile(r'^[0-9]{10}-[0-9a-f]{12}$')
+
+
+class Profiler:
+    """Profiles the requests signed with `secret`.
+
+    The `X-Profile` header is `<expiry>.<signature>`: a unix timestamp at
+    most `max_ttl` seconds ahead and its HMAC-SHA256 with the secret (see
+    `sign`). Each process profiles one request at a time and at most
+    `max_per_minute` of them a minute; over that, requests run normally.
+    """
+
+    def __init__(
+        self, secret, directory, max_files, max_per_minute, max_ttl, clock=time.time
+    ):
+        self.secret = secret
+        self.directory = directory
+        self.max_files = max_files
+        self.max_per_minute = max_per_minute
+        self.max_ttl = max_ttl
+        self.clock = clock
+        self._running = threading.Lock()
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+
+    def sign(self, ttl=300):
+        """Return an `X-Profile` header value valid for `ttl` seconds."""
+        expiry = str(int(self.clock() + ttl))
+        return f'{expiry}.{self._signature(expiry)}'
+
+    def _signature(self, expiry):
+        return hmac.new(
+            self.secret.encode(), expiry.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def authorized(self, value):
+        expiry, _, signature = (value or '').partition('.')
+        if not self.secret or not (expiry.isascii() and expiry.isdigit()):
+            return False
+        if not 0 < int(expiry) - self.clock() <= self.max_ttl:
+            return False
+        # compared as bytes, compare_digest refuses non-ASCII str
+        return hmac.compare_digest(
+            signature.encode('utf-8'), self._signature(expiry).encode('utf-8')
+        )
+
+    def _allow(self):
+        now = self.clock()
+        with self._lock:
+            while self._recent and now - self._recent[0] >= 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.max_per_minute:
+                return False
+            self._recent.append(now)
+            return True
+
+    def init_app(self, app):
+        if not self.secret:
+            return
+        app.before_request(self._start)
+        app.after_request(self._tag)
+        app.teardown_request(self._stop)
+        app.add_url_rule('/profiles', 'profiles', self.list_view)
+        app.add_url_rule('/profiles/<profile_id>', 'profile', self.profile_view)
+
+    def _start(self):
+        value = request.headers.get(HEADER)
+        if value is None or not self.authorized(value):
+            return
+        if not self._running.acquire(blocking=False):
+            logger.warning('Not profiling %s, another request is', request.path)
+            return
+        if not self._allow():
+            self._running.release()
+            logger.warning('Not profiling %s, over the rate cap', request.path)
+            return
+        profile = cProfile.Profile()
+        g.profile = (profile, f'{int(self.clock())}-{uuid.uuid4().hex[:12]}')
+        profile.enable()
+
+    def _stop(self, error):  # pylint: disable=unused-argument
+        profile, profile_id = g.pop('profile', (None, None))
+        if profile is None:
+            return
+        profile.disable()
+        self._running.release()
+        try:
+            self._save(profile, profile_id)
+        except OSError as e:
+            logger.error('Could not save profile %s: %s', profile_id, e)
+            return
+        logger.warning('Profiled %s %s as %s', request.method, request.path, profile_id)
+
+    @staticmethod
+    def _tag(response):
+        """Tell the client the id of the profile of its request."""
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile[1]
+        return response
+
+    def _save(self, profile, profile_id):
+        os.makedirs(self.directory, exist_ok=True)
+        profile.dump_stats(os.path.join(self.directory, f'{profile_id}.pstats'))
+        for stale in self.profiles()[self.max_files :]:
+            try:
+                os.remove(os.path.join(self.directory, f'{stale}.pstats'))
+            except OSError:
+                pass
+
+    def profiles(self):
+        """Ids of the spooled profiles, newest first."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        ids = [name[: -len('.pstats')] for name in names if name.endswith('.pstats')]
+        return sorted((i for i in ids if PROFILE_ID.match(i)), reverse=True)
+
+    def _check(self):
+        if not self.authorized(request.headers.get(HEADER)):
+            abort(401)
+
+    def list_view(self):
+        """`/profiles`, the spooled profile ids."""
+        self._check()
+        return jsonify(self.profiles())
+
+    def profile_view(self, profile_id):
+        """`/profiles/<id>`, as pstats or, with `?format=text`, as a report."""
+        self._check()
+        if not PROFILE_ID.match(profile_id) or profile_id not in self.profiles():
+            abort(404)
+        path = os.path.join(self.directory, f'{profile_id}.pstats')
+        if request.args.get('format') != 'text':
+            return send_file(
+                path,
+                mimetype='application/octet-stream',
+                as_attachment=True,
+                download_name=f'{profile_id}.pstats',
+            )
+        sort = request.args.get('sort', 'cumulative')
+        limit = request.args.get('limit', '50')
+        if sort not in SORT_KEYS or not limit.isdigit():
+            abort(400)
+        report = io.StringIO()
+        pstats.Stats(path, stream=report).sort_stats(sort).print_stats(int(limit))
+        return Response(report.getvalue(), mimetype='text/plain')
+
+
+profiler = Profiler(
+    secret=config.profiling.secret(default=''),
+    directory=config.profiling.dir(default='')
+    or os.path.join(tempfile.gettempdir(), 'api-gateway-profiles'),
+    max_files=config.profiling.max_files(default=DEFAULT_PROFILING_MAX_FILES, cast=int),
+    max_per_minute=config.profiling.max_per_minute(
+        default=DEFAULT_PROFILING_MAX_PER_MINUTE, cast=int
+    ),
+    max_ttl=config.profiling.token_max_ttl(
+        default=DEFAULT_PROFILING_TOKEN_MAX_TTL, cast=int
+    ),
+)
@@ -0,0 +1,233 @@
+"""Per token rate limiting of the proxied routes.
+
+Every token gets a token bucket per route group (courses, auth-server,
+payments and status), refilled at `rate` tokens per second up to `burst`.
+The check runs from a `before_request` hook, so an over-limit request is
+answered with a 429 and `Retry-After` before any upstream call, the
+`/users/me` token check included.
+
+The buckets live in a backend with a `take(key, rate, burst, now)` method
+returning `(allowed, retry_after)`:
+
+- `shared` (default): a memory mapped file every gunicorn worker of the
+  host maps, guarded by a file lock.
+- `memory`: a dict of the process, each worker limiting on its own.
+- `package.module:Class`: any other class, e.g. one keeping the buckets in
+  Redis for several hosts, built without arguments.
+"""
+import hashlib
+import importlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from flask import Response, request
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_RATE_LIMIT_BACKEND,
+    DEFAULT_RATE_LIMIT_BURST,
+    DEFAULT_RATE_LIMIT_ENABLED,
+    DEFAULT_RATE_LIMIT_RATE,
+    DEFAULT_RATE_LIMIT_SLOTS,
+)
+from api_gateway.helpers import codec
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.metrics import ROUTE_GROUPS, route_group
+
+try:
+    import fcntl
+except ModuleNotFoundError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+# key hash (0 for a free slot), tokens left and time of the last update
+_SLOT = struct.Struct('<Qdd')
+# slots looked at for a key before evicting the least recently updated one
+_PROBES = 8
+
+
+class RateLimited(Exception):
+    """The token went over the limit of a route group."""
+
+    def __init__(self, retry_after):
+        super().__init__()
+        self.code = 429
+        self.message = 'Too many requests'
+        self.retry_after = retry_after
+
+
+def refill(tokens, updated, rate, burst, now):
+    """Take a token from a bucket: `(allowed, tokens left, retry_after)`."""
+    tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / rate
+
+
+class MemoryBuckets:
+    """Buckets of this process only."""
+
+    def __init__(self, max_keys=DEFAULT_RATE_LIMIT_SLOTS):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(burst), now))
+            allowed, tokens, retry_after = refill(tokens, updated, rate, burst, now)
+            if len(self._buckets) >= self.max_keys:
+                # dicts keep insertion order and used keys are reinserted,
+                # so the first one is the least recently used
+                del self._buckets[next(iter(self._buckets))]
+            self._buckets[key] = (tokens, now)
+        return allowed, retry_after
+
+
+class SharedBuckets:
+    """Buckets in a memory mapped file shared by the processes of a host.
+
+    The file is a hash table of fixed size slots. A key is looked up in the
+    few slots after its hash; when all of them hold other keys, the least
+    recently updated one is reused, which hands its key a full bucket
+    again. Each process maps the file on first use; updates hold a thread
+    lock and a `lockf` lock on the file.
+    """
+
+    def __init__(self, path, slots=DEFAULT_RATE_LIMIT_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._pid = None
+
+    def _current(self):
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # pylint: disable=consider-using-with
+            self._file = open(self.path, 'a+b')
+            size = self.slots * _SLOT.size
+            if os.fstat(self._file.fileno()).st_size < size:
+                self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+            self._pid = os.getpid()
+        return self._map
+
+    def _slot(self, data, key_hash):
+        """Offset of the slot of a key, claiming one if it has none."""
+        start = key_hash % self.slots
+        oldest, oldest_updated = None, None
+        for probe in range(_PROBES):
+            offset = (start + probe) % self.slots * _SLOT.size
+            slot_hash, _, updated = _SLOT.unpack_from(data, offset)
+            if slot_hash in (key_hash, 0):
+                return offset, slot_hash == key_hash
+            if oldest is None or updated < oldest_updated:
+                oldest, oldest_updated = offset, updated
+        return oldest, False
+
+    def take(self, key, rate, burst, now):
+        key_hash = int(key[:16], 16) or 1
+        with self._lock:
+            data = self._current()
+            fcntl.lockf(self._file, fcntl.LOCK_EX)
+            try:
+                offset, found = self._slot(data, key_hash)
+                tokens, updated = float(burst), now
+                if found:
+                    _, tokens, updated = _SLOT.unpack_from(data, offset)
+                allowed, tokens, retry_after = refill(tokens, updated, rate, burst, now)
+                _SLOT.pack_into(data, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._file, fcntl.LOCK_UN)
+        return allowed, retry_after
+
+
+def load_backend(name, path, slots):
+    """The backend named by `RATE_LIMIT_BACKEND`."""
+    if name == 'shared':
+        if fcntl is not None:
+            return SharedBuckets(path, slots)
+        logger.warning('No fcntl to share rate limits, limiting per process.')
+        return MemoryBuckets(slots)
+    if name == 'memory':
+        return MemoryBuckets(slots)
+    module, _, attribute = name.partition(':')
+    return getattr(importlib.import_module(module), attribute)()
+
+
+class RateLimiter:
+    """Token buckets per token and route group, checked before dispatch."""
+
+    def __init__(self, backend, limits, enabled=True, clock=time.time):
+        self.backend = backend
+        # route group -> (rate per second, burst), a rate of 0 not limiting
+        self.limits = limits
+        self.enabled = enabled
+        self.clock = clock
+
+    def key(self, group, token):
+        return hashlib.sha256(f'{group}\0{token}'.encode('utf-8')).hexdigest()
+
+    def check(self, group, token):
+        """Take a token of the group bucket, raising `RateLimited` if empty."""
+        rate, burst = self.limits.get(group, (0, 0))
+        if not self.enabled or rate <= 0:
+            return
+        allowed, retry_after = self.backend.take(
+            self.key(group, token), rate, burst, self.clock()
+        )
+        if not allowed:
+            raise RateLimited(retry_after)
+
+    def init_app(self, app):
+        if self.enabled:
+            app.before_request(self._before_request)
+
+    def _before_request(self):
+        token = request.headers.get('Authorization')
+        if not token or request.method == 'OPTIONS':
+            return None
+        try:
+            self.check(route_group(request.path), token)
+        except RateLimited as e:
+            body = codec.dumps_bytes({'message': 'Error: ' + e.message}) + b'\n'
+            return Response(
+                body,
+                e.code,
+                {'Retry-After': str(max(int(math.ceil(e.retry_after)), 1))},
+                mimetype='application/json',
+            )
+        return None
+
+
+def _limits():
+    rate = config.rate_limit.rate(default=DEFAULT_RATE_LIMIT_RATE, cast=float)
+    burst = config.rate_limit.burst(default=DEFAULT_RATE_LIMIT_BURST, cast=int)
+    limits = {}
+    for group in ROUTE_GROUPS:
+        section = group.replace('-', '_')
+        limits[group] = (
+            getattr(config.rate_limit, f'{section}_rate')(default=rate, cast=float),
+            getattr(config.rate_limit, f'{section}_burst')(default=burst, cast=int),
+        )
+    return limits
+
+
+rate_limiter = RateLimiter(
+    backend=load_backend(
+        config.rate_limit.backend(default=DEFAULT_RATE_LIMIT_BACKEND),
+        config.rate_limit.path(default='')
+        or os.path.join(
+            tempfile.gettempdir(), f'api-gateway-rate-limit-{os.getppid()}.bin'
+        ),
+        config.rate_limit.slots(default=DEFAULT_RATE_LIMIT_SLOTS, cast=int),
+    ),
+    limits=_limits(),
+    enabled=config.rate_limit.enabled(default=DEFAULT_RATE_LIMIT_ENABLED, cast=to_bool),
+)
@@ -0,0 +1,336 @@
+"""Byte bounded LRU cache of upstream GET responses."""
+from collections import OrderedDict, namedtuple
+import math
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from flask import Response
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import (
+    DEFAULT_RESPONSE_CACHE_BETA,
+    DEFAULT_RESPONSE_CACHE_ENABLED,
+    DEFAULT_RESPONSE_CACHE_INVALIDATION_DEPTH,
+    DEFAULT_RESPONSE_CACHE_MAX_BYTES,
+    DEFAULT_RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    DEFAULT_RESPONSE_CACHE_TTL,
+)
+from api_gateway.helpers.conditional import (
+    is_not_modified,
+    not_modified_response,
+    validators,
+)
+from api_gateway.helpers.metrics import metrics
+from api_gateway.helpers.passthrough import passthrough_response
+
+# Rough per entry bookkeeping cost, so tiny bodies still count against the budget
+ENTRY_OVERHEAD = 256
+
+CachedResponse = namedtuple(
+    'CachedResponse',
+    [
+        'status',
+        'content_type',
+        'body',
+        'cache_control',
+        'validators',
+        'expires_at',
+        'delta',
+    ],
+)
+CachePolicy = namedtuple('CachePolicy', ['ttl', 'shared'])
+
+
+def cache_key(path, scope=None):
+    """Key a GET by path, normalized query string and user scope.
+
+    `scope` is the user id for private entries and None for shared ones.
+    """
+    path, _, query_string = path.partition('?')
+    query = urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+    return path.rstrip('/') or '/', query, scope
+
+
+def cache_policy(headers, default_ttl):
+    """Return how long and for whom a response may be cached, or None.
+
+    Responses without `Cache-Control` are cached privately for `default_ttl`
+    seconds, not at all when it is 0; `no-store`, `no-cache`, `max-age=0`
+    and cookies are never cached.
+    """
+    if headers.get('Set-Cookie'):
+        return None
+    header = headers.get('Cache-Control')
+    if header is None:
+        return CachePolicy(default_ttl, False) if default_ttl > 0 else None
+
+    directives = {}
+    for directive in header.lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return None
+    shared = 'public' in directives and 'private' not in directives
+    max_age = directives.get('s-maxage') if shared else None
+    if max_age is None:
+        max_age = directives.get('max-age')
+    if max_age is None:
+        ttl = default_ttl
+    else:
+        try:
+            ttl = float(max_age)
+        except ValueError:
+            return None
+    if ttl <= 0:
+        return None
+    return CachePolicy(ttl, shared)
+
+
+class ResponseCache:
+    """Keeps upstream GET responses as raw bytes plus a little metadata.
+
+    The least recently used entries are evicted once the bodies add up to
+    `max_bytes`. Entries are dropped when they expire or when a write goes
+    through the same resource (the first `invalidation_depth` segments of
+    its path, e.g. `/courses/v1/courses`).
+
+    To avoid stampedes on popular entries, a read may treat an entry as
+    expired a little early, with a probability that grows as its expiry
+    approaches and with the time the upstream took to produce it (`beta`
+    scales how eager this is, 0 disables it).
+    """
+
+    def __init__(
+        self,
+        max_bytes,
+        default_ttl,
+        max_entry_bytes,
+        invalidation_depth=3,
+        beta=1.0,
+        enabled=True,
+        clock=time.monotonic,
+        rand=random.random,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_entry_bytes = max_entry_bytes
+        self.invalidation_depth = invalidation_depth
+        self.beta = beta
+        self.enabled = enabled
+        self.clock = clock
+        self.rand = rand
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.early_expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        metrics.add_collector(self.collect, per_process=True)
+
+    @staticmethod
+    def _entry_size(key, entry):
+        return len(entry.body) + len(key[0]) + len(key[1]) + ENTRY_OVERHEAD
+
+    def _pop(self, key):
+        entry = self._entries.pop(key)
+        self.size -= self._entry_size(key, entry)
+
+    def get(self, path, scope):
+        """Return the shared or `scope` private entry cached for a path."""
+        if not self.enabled:
+            return None
+        keys = [cache_key(path)]
+        if scope is not None:
+            keys.append(cache_key(path, scope))
+        now = self.clock()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry.expires_at <= now:
+                    self._pop(key)
+                    continue
+                if self.beta and (
+                    now - entry.delta * self.beta * math.log(1.0 - self.rand())
+                    >= entry.expires_at
+                ):
+                    self.early_expirations += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, path, scope, entry, ttl):
+        """Cache an entry for `ttl` seconds under the given scope."""
+        key = cache_key(path, scope)
+        entry = entry._replace(expires_at=self.clock() + ttl)
+        size = self._entry_size(key, entry)
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = entry
+            self.size += size
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, path):
+        """Drop every entry under the resource a write to `path` changes."""
+        if not self.enabled:
+            return
+        segments = cache_key(path)[0].split('/')[: self.invalidation_depth + 1]
+        prefix = '/'.join(segments)
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if key[0] == prefix or key[0].startswith(prefix + '/')
+            ]
+            for key in stale:
+                self._pop(key)
+            self.invalidations += len(stale)
+
+    def fetch(self, path, scope, forward):
+        """Serve a GET from the cache, or `forward` it and cache the response.
+
+        `forward` sends the request upstream and returns the raw response.
+        Bodies of unknown length or bigger than `max_entry_bytes` are
+        streamed through without being cached.
+        """
+        entry = self.get(path, scope)
+        if entry is not None:
+            return cached_response(entry, 'HIT')
+
+        started = self.clock()
+        upstream_response = forward()
+        entry = self.store(path, scope, upstream_response, started)
+        if entry is None:
+            return passthrough_response(upstream_response)
+        return cached_response(entry, 'MISS')
+
+    def store(self, path, scope, upstream_response, started):
+        """Cache a GET response forwarded at `started`, if its policy allows.
+
+        Return the entry, or None when the response is not cached, in which
+        case its body was not read.
+        """
+        policy = cache_policy(upstream_response.headers, self.default_ttl)
+        length = upstream_response.headers.get('Content-Length')
+        if (
+            upstream_response.status_code != 200
+            or policy is None
+            or length is None
+            or not length.isdigit()
+            or int(length) > self.max_entry_bytes
+        ):
+            return None
+
+        body = upstream_response.content
+        entry = CachedResponse(
+            status=upstream_response.status_code,
+            content_type=upstream_response.headers.get(
+                'Content-Type', 'application/json'
+            ),
+            body=body,
+            cache_control=upstream_response.headers.get('Cache-Control'),
+            validators=validators(upstream_response.headers, body),
+            expires_at=0.0,
+            delta=self.clock() - started,
+        )
+        self.put(path, None if policy.shared else scope, entry, policy.ttl)
+        return entry
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+            self.early_expirations = 0
+            self.evictions = 0
+            self.invalidations = 0
+
+    def collect(self):
+        """Series of the cache of this worker, for `/metrics`."""
+        if not self.enabled:
+            return []
+        return [
+            ('gateway_response_cache_lookups_total', (('result', 'hit'),), self.hits),
+            (
+                'gateway_response_cache_lookups_total',
+                (('result', 'miss'),),
+                self.misses,
+            ),
+            (
+                'gateway_response_cache_early_expirations_total',
+                (),
+                self.early_expirations,
+            ),
+            ('gateway_response_cache_evictions_total', (), self.evictions),
+            ('gateway_response_cache_invalidations_total', (), self.invalidations),
+            ('gateway_response_cache_entries', (), len(self._entries)),
+            ('gateway_response_cache_bytes', (), self.size),
+        ]
+
+    def stats(self):
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'maxBytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'earlyExpirations': self.early_expirations,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hitRatio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+def cached_response(entry, outcome):
+    """Build a Flask response out of a cache entry, or a 304 if it is current."""
+    if is_not_modified(entry.validators):
+        response = not_modified_response(entry.validators)
+        response.headers['X-Cache'] = outcome
+        return response
+    headers = dict(entry.validators, **{'X-Cache': outcome})
+    if entry.cache_control:
+        headers['Cache-Control'] = entry.cache_control
+    return Response(
+        entry.body,
+        status=entry.status,
+        content_type=entry.content_type,
+        headers=headers,
+    )
+
+
+response_cache = ResponseCache(
+    max_bytes=config.response_cache.max_bytes(
+        default=DEFAULT_RESPONSE_CACHE_MAX_BYTES, cast=int
+    ),
+    default_ttl=config.response_cache.ttl(
+        default=DEFAULT_RESPONSE_CACHE_TTL, cast=float
+    ),
+    max_entry_bytes=config.response_cache.max_entry_bytes(
+        default=DEFAULT_RESPONSE_CACHE_MAX_ENTRY_BYTES, cast=int
+    ),
+    invalidation_depth=config.response_cache.invalidation_depth(
+        default=DEFAULT_RESPONSE_CACHE_INVALIDATION_DEPTH, cast=int
+    ),
+    beta=config.response_cache.beta(default=DEFAULT_RESPONSE_CACHE_BETA, cast=float),
+    enabled=config.response_cache.enabled(
+        default=DEFAULT_RESPONSE_CACHE_ENABLED, cast=to_bool
+    ),
+)
@@ -0,0 +1,64 @@
+"""Path prefix router compiled into a segment trie."""
+from collections import namedtuple
+
+Route = namedtuple('Route', ['name', 'handler', 'methods', 'min_depth'])
+
+# key holding the routes of a trie node, can never clash with a path segment
+_ROUTE = None
+
+PROXY_METHODS = ('GET', 'POST', 'PATCH', 'DELETE')
+# the proxied routes as `(prefix, upstream name, methods, min_depth)`, the
+# same paths and methods as the flask_restx Resources of the namespaces
+PROXY_ROUTES = (
+    ('/api/courses', 'courses', PROXY_METHODS, 2),
+    ('/api/courses', 'courses', PROXY_METHODS + ('PUT',), 3),
+    ('/api/auth-server', 'users', PROXY_METHODS, 2),
+    ('/api/payments', 'payments', PROXY_METHODS, 2),
+    ('/api/payments/status', 'payments', PROXY_METHODS, 0),
+)
+
+
+class PrefixRouter:
+    """Maps path prefixes like `/api/courses` to a route.
+
+    Prefixes are split in segments and stored in a trie, so a match costs one
+    dict lookup per segment of the prefix whatever the number of routes, and
+    paths under a prefix may have any depth. The longest matching prefix
+    wins, as long as at least `min_depth` segments follow it. A prefix may
+    have several routes, e.g. allowing more methods on deeper paths; the one
+    with the largest `min_depth` the path has wins.
+    """
+
+    def __init__(self):
+        self._root = {}
+
+    def add(self, prefix, route):
+        node = self._root
+        for segment in prefix.strip('/').split('/'):
+            node = node.setdefault(segment, {})
+        routes = node.setdefault(_ROUTE, [])
+        routes.append(route)
+        routes.sort(key=lambda added: added.min_depth, reverse=True)
+
+    def match(self, path):
+        """Return the route serving a path, or None."""
+        segments = path.strip('/').split('/')
+        node = self._root
+        found = None
+        for depth, segment in enumerate(segments, 1):
+            node = node.get(segment)
+            if node is None:
+                break
+            for route in node.get(_ROUTE, ()):
+                if len(segments) - depth >= route.min_depth:
+                    found = route
+                    break
+        return found
+
+
+def proxy_router(handlers):
+    """Router of the proxied routes, with the handlers of each upstream name."""
+    router = PrefixRouter()
+    for prefix, name, methods, min_depth in PROXY_ROUTES:
+        router.add(prefix, Route(name, handlers.get(name), methods, min_depth))
+    return router
@@ -0,0 +1,97 @@
+"""`Server-Timing` breakdown of where the time of a request went."""
+import contextlib
+import hmac
+import time
+
+from flask import g, has_app_context, request
+
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import DEFAULT_SERVER_TIMING_ENABLED
+
+TOKEN_HEADER = 'X-Server-Timing'
+
+
+class Timer:
+    """Exclusive time of nested phases: an inner phase is not counted twice."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self._stack = []
+
+    def begin(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def end(self):
+        name, started, inner = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.durations[name] = self.durations.get(name, 0.0) + elapsed - inner
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def header(self):
+        total = time.perf_counter() - self.started
+        metrics = [
+            f'{name};dur={seconds * 1000:.2f}'
+            for name, seconds in self.durations.items()
+        ]
+        gateway = total - sum(self.durations.values())
+        metrics.append(f'gateway;dur={gateway * 1000:.2f}')
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+class ServerTiming:
+    """Times the phases of a request and reports them in `Server-Timing`.
+
+    Reported for every request when `enabled`, otherwise only for requests
+    sending the configured `token` in the `X-Server-Timing` header. Phases
+    are `auth`, `upstream`, `decode` and `encode`; `gateway` is the rest of
+    the time and `total` the time until the response (the headers of
+    streamed ones) was ready.
+    """
+
+    def __init__(self, enabled, token=''):
+        self.enabled = enabled
+        self.token = token
+
+    def init_app(self, app):
+        if self.enabled or self.token:
+            app.before_request(self._start)
+            app.after_request(self._report)
+
+    def _start(self):
+        # compared as bytes, compare_digest refuses non-ASCII str
+        if self.enabled or hmac.compare_digest(
+            request.headers.get(TOKEN_HEADER, '').encode('utf-8'),
+            self.token.encode('utf-8'),
+        ):
+            g.server_timing = Timer()
+
+    @staticmethod
+    def _report(response):
+        timer = g.pop('server_timing', None)
+        if timer is not None:
+            response.headers['Server-Timing'] = timer.header()
+        return response
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Count the time spent in the block towards `name`."""
+        timer = g.get('server_timing') if has_app_context() else None
+        if timer is None:
+            yield
+            return
+        timer.begin(name)
+        try:
+            yield
+        finally:
+            timer.end()
+
+
+server_timing = ServerTiming(
+    enabled=config.server_timing.enabled(
+        default=DEFAULT_SERVER_TIMING_ENABLED, cast=to_bool
+    ),
+    token=config.server_timing.token(default=''),
+)
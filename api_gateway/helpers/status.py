@@ -0,0 +1,34 @@
+"""Status entries and probe deadlines shared by both serving modes."""
+from api_gateway.cfg import config
+from api_gateway.constants import DEFAULT_STATUS_PROBE_TIMEOUT
+
+# service name -> seconds to wait for its status probe
+PROBE_TIMEOUTS = {
+    'auth-server': config.status.auth_server_timeout(
+        default=DEFAULT_STATUS_PROBE_TIMEOUT, cast=float
+    ),
+    'courses': config.status.courses_timeout(
+        default=DEFAULT_STATUS_PROBE_TIMEOUT, cast=float
+    ),
+    'payments': config.status.payments_timeout(
+        default=DEFAULT_STATUS_PROBE_TIMEOUT, cast=float
+    ),
+}
+
+GATEWAY_STATUS = {
+    'status': 'Online',
+    'creationDate': '0',
+    'description': 'Microservicio de conexion con ' 'otros servidores.',
+}
+
+
+def service_status(status, description=''):
+    return {
+        'status': status,
+        'creationDate': '0',
+        'description': description,
+    }
+
+
+def timeout_status(timeout):
+    return service_status('Timeout', f'No answer within {timeout}s')
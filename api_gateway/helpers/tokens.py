@@ -0,0 +1,155 @@
+"""Helpers to read and verify the JWTs issued by the auth server."""
+import base64
+import binascii
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import threading
+import time
+
+from api_gateway.cfg import config
+from api_gateway.constants import DEFAULT_REVOKED_TOKENS_MAXSIZE
+from api_gateway.helpers import codec
+from api_gateway.helpers.logger import logger
+
+
+class InvalidToken(Exception):
+    """The token is malformed, badly signed, revoked or expired."""
+
+    code = 401
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _b64decode(segment):
+    padding = '=' * (-len(segment) % 4)
+    return base64.urlsafe_b64decode(segment + padding)
+
+
+def decode_claims(token):
+    """Return the claims of a token without verifying it, or None if malformed."""
+    try:
+        payload = token.split('.')[1]
+        claims = codec.loads(_b64decode(payload))
+    except (AttributeError, IndexError, ValueError, binascii.Error):
+        return None
+    return claims if isinstance(claims, dict) else None
+
+
+def expiration_timestamp(claims):
+    """Return the expiration of the claims as a unix timestamp, if present.
+
+    The auth server issues an ISO `expirationDate`; a standard `exp` claim is
+    honoured as well.
+    """
+    if not claims:
+        return None
+    if isinstance(claims.get('exp'), (int, float)):
+        return float(claims['exp'])
+    expiration = claims.get('expirationDate')
+    if not isinstance(expiration, str):
+        return None
+    try:
+        date = datetime.strptime(expiration, '%Y-%m-%dT%H:%M:%S.%fZ')
+    except ValueError:
+        try:
+            date = datetime.strptime(expiration, '%Y-%m-%dT%H:%M:%SZ')
+        except ValueError:
+            return None
+    return date.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TokenVerifier:
+    """Verifies HS256 tokens locally with the secret(s) shared with the auth server.
+
+    Several secrets can be configured at once (comma separated) so keys can
+    be rotated; a token is accepted if any of them produced its signature.
+    Without secrets the verifier is disabled and callers must ask the auth
+    server instead.
+
+    Tokens signed out through this worker are remembered until they expire,
+    since a valid signature alone cannot tell they were revoked.
+    """
+
+    algorithm = 'HS256'
+
+    def __init__(self, secrets, revoked_maxsize=DEFAULT_REVOKED_TOKENS_MAXSIZE):
+        self.secrets = [secret.encode() for secret in secrets if secret]
+        self.revoked_maxsize = revoked_maxsize
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.secrets)
+
+    def verify(self, token, now=None):
+        """Return the claims of a valid token, raising InvalidToken otherwise."""
+        now = time.time() if now is None else now
+        try:
+            header_segment, payload_segment, signature_segment = token.split('.')
+            header = codec.loads(_b64decode(header_segment))
+            signature = _b64decode(signature_segment)
+        except (AttributeError, ValueError, binascii.Error):
+            raise InvalidToken('Invalid token') from None
+        if not isinstance(header, dict) or header.get('alg') != self.algorithm:
+            raise InvalidToken('Invalid token')
+
+        signing_input = f'{header_segment}.{payload_segment}'.encode()
+        if not any(
+            hmac.compare_digest(
+                hmac.new(secret, signing_input, hashlib.sha256).digest(), signature
+            )
+            for secret in self.secrets
+        ):
+            raise InvalidToken('Invalid token')
+
+        claims = decode_claims(token)
+        if not claims or not claims.get('_id'):
+            raise InvalidToken('Invalid token')
+        expiration = expiration_timestamp(claims)
+        if expiration is not None and expiration <= now:
+            raise InvalidToken('Token expired')
+        if self._is_revoked(signature_segment, now):
+            raise InvalidToken('Token revoked')
+        return claims
+
+    def revoke(self, token):
+        """Reject a token from now on, e.g. because it was signed out."""
+        if not self.enabled or not token:
+            return
+        claims = decode_claims(token)
+        expiration = expiration_timestamp(claims)
+        if expiration is None:
+            expiration = float('inf')
+        with self._lock:
+            if len(self._revoked) >= self.revoked_maxsize:
+                self._purge(time.time())
+            if len(self._revoked) >= self.revoked_maxsize:
+                logger.warning('Revoked tokens list is full, dropping the oldest')
+                self._revoked.pop(next(iter(self._revoked)))
+            self._revoked[token.rsplit('.', 1)[-1]] = expiration
+
+    def _is_revoked(self, signature_segment, now):
+        with self._lock:
+            expiration = self._revoked.get(signature_segment)
+            if expiration is not None and expiration <= now:
+                del self._revoked[signature_segment]
+                return False
+            return expiration is not None
+
+    def _purge(self, now):
+        for key in [key for key, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[key]
+
+
+def _secrets_from_config():
+    secrets = config.auth.jwt_secrets(default='')
+    return [secret.strip() for secret in secrets.split(',')] + [
+        config.auth.jwt_secret(default='')
+    ]
+
+
+token_verifier = TokenVerifier(_secrets_from_config())
@@ -1,3 +1,4 @@
+from .batch import ns as batch_namespace
 from .course import ns as course_namespace
 from .payments import ns as payment_namespace
 from .status import ns as status_namespace
@@ -0,0 +1 @@
+from .namespace import ns
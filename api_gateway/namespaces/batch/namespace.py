@@ -0,0 +1,135 @@
+"""Batch namespace module."""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import request
+from flask_restx import Namespace, Resource, abort
+
+from api_gateway.cfg import config
+from api_gateway.clients.auth_server_client import auth_server_client
+from api_gateway.clients.course_client import course_client
+from api_gateway.clients.payment_client import payment_client
+from api_gateway.constants import DEFAULT_BATCH_WORKERS
+from api_gateway.helpers import batch, codec
+from api_gateway.helpers.identity_cache import update_identity_cache
+from api_gateway.helpers.logger import logger
+from api_gateway.helpers.response_cache import response_cache
+from api_gateway.helpers.server_timing import server_timing
+
+ns = Namespace("Batch", description="Several calls in one request")
+
+batch_executor = ThreadPoolExecutor(
+    max_workers=config.batch.workers(default=DEFAULT_BATCH_WORKERS, cast=int),
+    thread_name_prefix='batch',
+)
+
+
+def batch_courses(method, path, body, token, user_id):
+    if method == 'get' and response_cache.enabled:
+        entry = response_cache.get(path, user_id)
+        if entry is None:
+            started = response_cache.clock()
+            upstream_response = course_client.forward(
+                method, path, body, token, user_id
+            )
+            entry = response_cache.store(path, user_id, upstream_response, started)
+            if entry is None:
+                return (
+                    codec.loads(upstream_response.content),
+                    upstream_response.status_code,
+                )
+        return codec.loads(entry.body), entry.status
+    if method != 'get':
+        response_cache.invalidate(path)
+    return course_client.call(method, path, body, token, user_id)
+
+
+def batch_payments(method, path, body, token, user_id):
+    return payment_client.call(method, path, body, token)
+
+
+def batch_users(method, path, body, token, user_id):
+    res_body, res_status_code = auth_server_client.call(method, path, body, token)
+    update_identity_cache(path, token, res_body, res_status_code)
+    return res_body, res_status_code
+
+
+HANDLERS = {
+    'courses': batch_courses,
+    'payments': batch_payments,
+    'users': batch_users,
+}
+
+
+def run(call, token, user_id):
+    upstream, method, path, body = call
+    try:
+        res_body, res_status_code = HANDLERS[upstream](
+            method, path, body, token, user_id
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        logger.error('Unhandled Exception: %s - %s', str(type(e)), str(e))
+        return batch.error_result(e)
+    return batch.result(res_status_code, res_body)
+
+
+def run_all(calls, token, user_id):
+    """Run the calls, `max_concurrency` at a time, returning results in order."""
+    results = [None] * len(calls)
+    pending = {}
+    queued = iter(enumerate(calls))
+
+    def submit_next():
+        for index, call in queued:
+            if isinstance(call, dict):
+                results[index] = call
+                continue
+            pending[batch_executor.submit(run, call, token, user_id)] = index
+            return
+
+    for _ in range(batch.max_concurrency):
+        submit_next()
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            results[pending.pop(future)] = future.result()
+            submit_next()
+    return results
+
+
+def call_batch(payload):
+    logger.info('Batch Call')
+
+    if 'Authorization' not in request.headers:
+        logger.error('Authorization token is required.')
+        abort(401, 'Authorization token is required.')
+    token = request.headers['Authorization']
+
+    try:
+        items = batch.parse(payload)
+    except batch.InvalidBatch as e:
+        logger.error(e.message)
+        abort(400, e.message)
+
+    with server_timing.phase('auth'):
+        (
+            authentication_res_body,
+            authentication_status_code,
+        ) = auth_server_client.authenticate(token)
+    if authentication_status_code != 200:
+        return authentication_res_body, authentication_status_code
+    user_id = authentication_res_body['_id']
+
+    calls = batch.rate_limit(items, batch.plan(items), token)
+
+    with server_timing.phase('upstream'):
+        responses = run_all(calls, token, user_id)
+    return {'responses': responses}, 200
+
+
+@ns.route('')
+@ns.header('Authorization', 'Authorization Token')
+class BatchResource(Resource):
+    @ns.doc('post_call_batch')
+    def post(self):
+        """Run a list of `{method, path, body}` requests with one auth check"""
+        return call_batch(ns.payload)
@@ -6,7 +6,11 @@ from flask_restx import Namespace, Resource, abort
 
 from api_gateway.clients.auth_server_client import auth_server_client
 from api_gateway.clients.course_client import course_client
+from api_gateway.helpers.conditional import conditional_headers
 from api_gateway.helpers.logger import logger
+from api_gateway.helpers.passthrough import passthrough_enabled, passthrough_response
+from api_gateway.helpers.response_cache import response_cache
+from api_gateway.helpers.server_timing import server_timing
 
 ns = Namespace("Course", description="Courses operations")
 
@@ -19,9 +23,11 @@ def call_courses(payload):
         abort(401, 'Authorization token is required.')
     token = request.headers['Authorization']
 
-    authentication_res_body, authentication_status_code = auth_server_client.call(
-        'get', '/auth-server/v1/users/me', None, token
-    )
+    with server_timing.phase('auth'):
+        (
+            authentication_res_body,
+            authentication_status_code,
+        ) = auth_server_client.authenticate(token)
     if authentication_status_code != 200:
         return authentication_res_body, authentication_status_code
 
@@ -31,9 +37,27 @@ def call_courses(payload):
 
     path = request.path.split('/api')[1] + query_string
     method = request.method.lower()
-    res_body, res_status_code = course_client.call(
-        method, path, payload, token, authentication_res_body['_id']
-    )
+    user_id = authentication_res_body['_id']
+    with server_timing.phase('upstream'):
+        if method == 'get' and response_cache.enabled:
+            return response_cache.fetch(
+                path,
+                user_id,
+                lambda: course_client.forward(
+                    method, path, payload, token, user_id, conditional_headers()
+                ),
+            )
+        if method != 'get':
+            response_cache.invalidate(path)
+        if passthrough_enabled:
+            return passthrough_response(
+                course_client.forward(
+                    method, path, payload, token, user_id, conditional_headers()
+                )
+            )
+        res_body, res_status_code = course_client.call(
+            method, path, payload, token, user_id
+        )
     return res_body, res_status_code
 
 
@@ -6,7 +6,10 @@ from flask_restx import Namespace, Resource, abort
 
 from api_gateway.clients.auth_server_client import auth_server_client
 from api_gateway.clients.payment_client import payment_client
+from api_gateway.helpers.conditional import conditional_headers
 from api_gateway.helpers.logger import logger
+from api_gateway.helpers.passthrough import passthrough_enabled, passthrough_response
+from api_gateway.helpers.server_timing import server_timing
 
 ns = Namespace("Payment", description="Payments operations")
 
@@ -19,15 +22,24 @@ def call_payments(payload):
         abort(401, 'Authorization token is required.')
     token = request.headers['Authorization']
 
-    authentication_res_body, authentication_status_code = auth_server_client.call(
-        'get', '/auth-server/v1/users/me', None, token
-    )
+    with server_timing.phase('auth'):
+        (
+            authentication_res_body,
+            authentication_status_code,
+        ) = auth_server_client.authenticate(token)
     if authentication_status_code != 200:
         return authentication_res_body, authentication_status_code
 
     path = request.path.split('/api')[1]
     method = request.method.lower()
-    res_body, res_status_code = payment_client.call(method, path, payload, token)
+    with server_timing.phase('upstream'):
+        if passthrough_enabled:
+            return passthrough_response(
+                payment_client.forward(
+                    method, path, payload, token, conditional_headers()
+                )
+            )
+        res_body, res_status_code = payment_client.call(method, path, payload, token)
     return res_body, res_status_code
 
 
@@ -1,19 +1,139 @@
 # pylint: disable=unused-argument
 """Course namespace module."""
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+import time
 
 from flask import request
 from flask_restx import Namespace, Resource, abort
 from requests.exceptions import ConnectionError as NewConnectionError
 
+from api_gateway.cfg import config, to_bool
 from api_gateway.clients.auth_server_client import auth_server_client
 from api_gateway.clients.course_client import course_client
 from api_gateway.clients.payment_client import payment_client
+from api_gateway.constants import (
+    DEFAULT_STATUS_POLLER_ENABLED,
+    DEFAULT_STATUS_POLLER_INTERVAL,
+    DEFAULT_STATUS_POLLER_JITTER,
+    DEFAULT_STATUS_PROBE_WORKERS,
+)
+from api_gateway.helpers.health_poller import HealthPoller
 from api_gateway.helpers.logger import logger
+from api_gateway.helpers.server_timing import server_timing
+from api_gateway.helpers.status import (
+    GATEWAY_STATUS,
+    PROBE_TIMEOUTS,
+    service_status,
+    timeout_status,
+)
 
 ns = Namespace("Status", description="Status operation")
 starting_date = datetime.now()
 
+probe_executor = ThreadPoolExecutor(
+    max_workers=config.status.probe_workers(
+        default=DEFAULT_STATUS_PROBE_WORKERS, cast=int
+    ),
+    thread_name_prefix='status-probe',
+)
+
+# service name -> (probe of a token and a timeout, seconds to wait for it)
+PROBES = {
+    'auth-server': (
+        lambda token, timeout: auth_server_client.call(
+            'get', '/auth-server/v1/status', None, token, timeout
+        ),
+        PROBE_TIMEOUTS['auth-server'],
+    ),
+    'courses': (
+        lambda token, timeout: course_client.call(
+            'get', '/courses/v1/status', None, token, None, timeout
+        ),
+        PROBE_TIMEOUTS['courses'],
+    ),
+    'payments': (
+        lambda token, timeout: payment_client.call(
+            'get', '/payments/status', None, token, timeout
+        ),
+        PROBE_TIMEOUTS['payments'],
+    ),
+}
+
+
+def probe(name, func, token, timeout, submitted):
+    """Ask one upstream for its status, mapping failures to a status entry.
+
+    The upstream call gets what is left of `timeout` since the probe was
+    submitted, so a hung upstream never holds a probe worker longer than
+    the caller waits for it.
+    """
+    started = time.monotonic()
+    remaining = submitted + timeout - started
+    if remaining <= 0:
+        # waited for a free probe worker until the caller gave up
+        return checked(timeout_status(timeout), None)
+    try:
+        status = func(token, remaining)[0]
+    except NewConnectionError:
+        status = service_status('Offline')
+    except Exception as e:  # pylint: disable=broad-except
+        logger.warning('Status probe of %s failed: %s', name, e)
+        status = service_status('Degraded', str(e))
+    return checked(status, (time.monotonic() - started) * 1000)
+
+
+def checked(status, latency_ms):
+    """Stamp a status entry with when it was checked and how long it took."""
+    if not isinstance(status, dict):
+        return status
+    last_checked = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    latency = round(latency_ms, 1) if latency_ms is not None else None
+    return dict(status, lastChecked=last_checked, latencyMs=latency)
+
+
+def probe_servers(token):
+    """Probe every upstream concurrently, each within its own deadline.
+
+    The whole call takes about as long as the slowest upstream, and never
+    more than the biggest deadline.
+    """
+    started = time.monotonic()
+    futures = {
+        name: (
+            probe_executor.submit(probe, name, func, token, timeout, started),
+            timeout,
+        )
+        for name, (func, timeout) in PROBES.items()
+    }
+    status = {}
+    for name, (future, timeout) in futures.items():
+        remaining = max(timeout - (time.monotonic() - started), 0)
+        try:
+            status[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning('Status probe of %s timed out after %ss', name, timeout)
+            status[name] = checked(timeout_status(timeout), None)
+    return status
+
+
+# the poller probes with a token of its own, without one every request
+# probes the upstreams with its own token instead
+poller_token = config.status.poller_token(default='')
+health_poller = HealthPoller(
+    lambda: probe_servers(poller_token),
+    interval=config.status.poller_interval(
+        default=DEFAULT_STATUS_POLLER_INTERVAL, cast=float
+    ),
+    jitter=config.status.poller_jitter(
+        default=DEFAULT_STATUS_POLLER_JITTER, cast=float
+    ),
+)
+poller_enabled = bool(poller_token) and config.status.poller_enabled(
+    default=DEFAULT_STATUS_POLLER_ENABLED, cast=to_bool
+)
+
 
 def call_servers():
     logger.info('Status Call')
@@ -23,50 +143,20 @@ def call_servers():
         abort(401, 'Authorization token is required.')
     token = request.headers['Authorization']
 
-    authentication_res_body, authentication_status_code = auth_server_client.call(
-        'get', '/auth-server/v1/admin/users', None, token
-    )
+    with server_timing.phase('auth'):
+        (
+            authentication_res_body,
+            authentication_status_code,
+        ) = auth_server_client.call('get', '/auth-server/v1/admin/users', None, token)
     if authentication_status_code != 200:
         return authentication_res_body, authentication_status_code
 
-    status = {
-        'api-gateway': {
-            'status': 'Online',
-            'creationDate': '0',
-            'description': 'Microservicio de conexion con ' 'otros servidores.',
-        }
-    }
-
-    try:
-        status['auth-server'] = auth_server_client.call(
-            'get', '/auth-server/v1/status', None, token
-        )[0]
-    except NewConnectionError:
-        status['auth-server'] = {
-            'status': 'Offline',
-            'creationDate': '0',
-            'description': '',
-        }
-    try:
-        status['courses'] = course_client.call(
-            'get', '/courses/v1/status', None, token, None
-        )[0]
-    except NewConnectionError:
-        status['courses'] = {
-            'status': 'Offline',
-            'creationDate': '0',
-            'description': '',
-        }
-    try:
-        status['payments'] = payment_client.call(
-            'get', '/payments/status', None, token
-        )[0]
-    except NewConnectionError:
-        status['payments'] = {
-            'status': 'Offline',
-            'creationDate': '0',
-            'description': '',
-        }
+    status = {'api-gateway': dict(GATEWAY_STATUS)}
+    with server_timing.phase('upstream'):
+        if poller_enabled:
+            status.update(health_poller.snapshot())
+        else:
+            status.update(probe_servers(token))
 
     return status, 200
 
@@ -5,7 +5,11 @@ from flask import request
 from flask_restx import Namespace, Resource, abort
 
 from api_gateway.clients.auth_server_client import auth_server_client
+from api_gateway.helpers.conditional import conditional_headers
+from api_gateway.helpers.identity_cache import session_action, update_identity_cache
 from api_gateway.helpers.logger import logger
+from api_gateway.helpers.passthrough import passthrough_enabled, passthrough_response
+from api_gateway.helpers.server_timing import server_timing
 
 ns = Namespace("User", description="Users operations")
 
@@ -19,7 +23,17 @@ def call_users(payload):
     token = request.headers['Authorization']
     path = request.path.split('/api')[1]
     method = request.method.lower()
-    res_body, res_status_code = auth_server_client.call(method, path, payload, token)
+    with server_timing.phase('upstream'):
+        if passthrough_enabled and session_action(path) is None:
+            return passthrough_response(
+                auth_server_client.forward(
+                    method, path, payload, token, conditional_headers()
+                )
+            )
+        res_body, res_status_code = auth_server_client.call(
+            method, path, payload, token
+        )
+    update_identity_cache(path, token, res_body, res_status_code)
     return res_body, res_status_code
 
 
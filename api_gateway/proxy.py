@@ -0,0 +1,48 @@
+"""Fast path for the pure proxy routes.
+
+The course, user and payment routes only forward the request upstream, so
+they are dispatched from a `before_request` hook straight to the namespace
+call functions, skipping werkzeug rule dispatch and the flask_restx
+`Resource` machinery. The namespaces still declare those routes, for the
+Swagger docs and for the requests the fast path leaves to them (preflights
+and methods a route does not allow).
+"""
+from flask import request
+
+from api_gateway.api import api
+from api_gateway.cfg import config, to_bool
+from api_gateway.constants import DEFAULT_PROXY_FAST_PATH_ENABLED
+from api_gateway.helpers.router import proxy_router
+from api_gateway.helpers.server_timing import server_timing
+from api_gateway.namespaces.course.namespace import call_courses
+from api_gateway.namespaces.payments.namespace import call_payments
+from api_gateway.namespaces.user.namespace import call_users
+
+fast_path_enabled = config.proxy.fast_path_enabled(
+    default=DEFAULT_PROXY_FAST_PATH_ENABLED, cast=to_bool
+)
+
+router = proxy_router(
+    {'courses': call_courses, 'users': call_users, 'payments': call_payments}
+)
+
+
+def dispatch():
+    """`before_request` hook answering the proxy routes directly."""
+    route = router.match(request.path)
+    if route is None or request.method not in route.methods:
+        return None
+    try:
+        with server_timing.phase('decode'):
+            payload = request.get_json()
+        rv = route.handler(payload)
+    except Exception as e:  # pylint: disable=broad-except
+        return api.handle_error(e)
+    if isinstance(rv, tuple):
+        return api.make_response(*rv)
+    return rv
+
+
+def init_app(app):
+    if fast_path_enabled:
+        app.before_request(dispatch)
@@ -0,0 +1,106 @@
+"""CPU cost against bytes saved of the response compression levels.
+
+Compresses course listings of several sizes, as relayed by the gateway,
+with every gzip level and brotli quality given, and reports the compression
+ratio, the time taken per body and the throughput. Brotli needs the
+`compression` extras:
+
+    poetry install -E compression
+    poetry run python benchmarks/compression.py --items 10 100 1000 10000
+"""
+import argparse
+import json
+from pathlib import Path
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from api_gateway.helpers.compression import (  # noqa: E402 pylint: disable=C0413
+    BrotliCompressor,
+    GzipCompressor,
+    brotli,
+)
+
+
+def course_listing(items):
+    return json.dumps(
+        [
+            {
+                '_id': f'61a6f1f7f7bc0200{i:08x}',
+                'name': f'Course {i}',
+                'description': f'Everything about topic number {i % 37}',
+                'category': ('Party', 'Music', 'Cooking', 'Programming')[i % 4],
+                'subscription': i % 3,
+                'professors': [f'61a6ef1051e72a0010{i % 97:06x}'],
+                'createdAt': '2021-12-01T03:42:08.675Z',
+            }
+            for i in range(items)
+        ]
+    ).encode()
+
+
+def measure(make_compressor, body, chunk_size, min_seconds):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        compressor = make_compressor()
+        size = 0
+        for start in range(0, len(body), chunk_size):
+            size += len(compressor.compress(body[start : start + chunk_size]))
+        size += len(compressor.flush())
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            break
+    per_body = elapsed / runs
+    return {
+        'bytes': len(body),
+        'compressed': size,
+        'saved_pct': round(100 * (1 - size / len(body)), 1),
+        'ms': round(per_body * 1000, 3),
+        'mb_per_s': round(len(body) / per_body / 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--gzip-levels', type=int, nargs='+', default=[1, 4, 6, 9])
+    parser.add_argument('--brotli-qualities', type=int, nargs='+', default=[1, 4, 6, 9])
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    parser.add_argument('--min-seconds', type=float, default=0.2)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    codecs = [
+        (f'gzip-{level}', lambda level=level: GzipCompressor(level))
+        for level in args.gzip_levels
+    ]
+    if brotli is not None:
+        codecs += [
+            (f'br-{quality}', lambda quality=quality: BrotliCompressor(quality))
+            for quality in args.brotli_qualities
+        ]
+    else:
+        print('brotli is not installed, skipping it', file=sys.stderr)
+
+    results = []
+    for items in args.items:
+        body = course_listing(items)
+        for name, make_compressor in codecs:
+            result = dict(
+                codec=name,
+                items=items,
+                **measure(make_compressor, body, args.chunk_size, args.min_seconds),
+            )
+            results.append(result)
+            print(json.dumps(result))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Per request overhead of the gateway for a proxied GET.
+
+Calls the WSGI app with `GET /api/courses/v1/courses`, the upstream
+replaced by an in-memory response, so only the gateway own work is
+measured: once through the flask_restx routes and once through the proxy
+fast path. The identity cache answers authentication and the response
+cache is disabled, so every request reaches the (fake) upstream.
+
+    poetry run python benchmarks/dispatch.py --requests 5000
+"""
+import argparse
+import base64
+import json
+import logging
+from pathlib import Path
+import statistics
+import sys
+import time
+from unittest import mock
+
+import requests
+from werkzeug.test import EnvironBuilder
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+from api_gateway import proxy  # noqa: E402
+from api_gateway.app import create_app  # noqa: E402
+from api_gateway.helpers.response_cache import response_cache  # noqa: E402
+
+
+def make_token():
+    def encode(segment):
+        return (
+            base64.urlsafe_b64encode(json.dumps(segment).encode()).decode().rstrip('=')
+        )
+
+    claims = {'_id': 'benchmark', 'expirationDate': '2099-12-21T23:21:01.773Z'}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(claims)}.signature"
+
+
+def upstream_response(url, **kwargs):  # pylint: disable=unused-argument
+    if '/auth-server/' in url:
+        body = {'_id': 'benchmark'}
+    else:
+        body = [{'_id': 'benchmark', 'name': f'course {i}'} for i in range(20)]
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode()  # pylint: disable=W0212
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Content-Length'] = str(len(response.content))
+    return response
+
+
+def measure(app, total, token):
+    environ = EnvironBuilder(
+        '/api/courses/v1/courses', headers={'Authorization': token}
+    ).get_environ()
+    statuses = []
+
+    def start_response(status, headers):  # pylint: disable=unused-argument
+        statuses.append(status)
+
+    latencies = []
+    for _ in range(total):
+        started = time.perf_counter()
+        body = app(dict(environ), start_response)
+        b''.join(body)
+        body.close()
+        latencies.append(time.perf_counter() - started)
+    assert set(statuses) == {'200 OK'}, statuses  # nosec
+    latencies.sort()
+    return {
+        'requests': total,
+        'mean_us': round(statistics.mean(latencies) * 1e6, 1),
+        'p50_us': round(statistics.median(latencies) * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    response_cache.enabled = False
+    token = make_token()
+    results = {}
+    with mock.patch('requests.Session.get', side_effect=upstream_response):
+        for name, fast_path in (('restx', False), ('fast_path', True)):
+            proxy.fast_path_enabled = fast_path
+            app = create_app()
+            measure(app, min(args.requests, 200), token)
+            results[name] = measure(app, args.requests, token)
+            print(name, json.dumps(results[name]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Compare the Flask/WSGI and asyncio/ASGI serving modes.
+
+Starts a stub upstream with a fixed latency, then serves the gateway with
+gunicorn sync workers and with uvicorn workers (same number of workers) and
+fires the same concurrent load of `GET /api/courses/v1/courses` at both.
+
+Requires gunicorn, uvicorn and httpx:
+
+    poetry run pip install gunicorn
+    poetry install -E asgi
+    poetry run python benchmarks/engines.py --requests 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import os
+from pathlib import Path
+import socket
+import statistics
+import subprocess  # nosec
+import sys
+import time
+
+import httpx
+
+ROOT = Path(__file__).resolve().parents[1]
+
+ENGINES = {
+    'wsgi': ('sync', 'api_gateway.app:create_app()'),
+    'asgi': ('uvicorn.workers.UvicornWorker', 'api_gateway.asgi:app'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def start(cmd, env):
+    return subprocess.Popen(  # nosec
+        cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def start_upstream(port, latency_ms):
+    env = dict(os.environ, STUB_LATENCY_MS=str(latency_ms))
+    cmd = [
+        sys.executable,
+        '-m',
+        'uvicorn',
+        '--app-dir',
+        'benchmarks',
+        '--port',
+        str(port),
+        '--log-level',
+        'warning',
+        'stub_upstream:app',
+    ]
+    return start(cmd, env)
+
+
+def start_gateway(engine, port, workers, upstream_url):
+    env = dict(os.environ, FRUX_SC_URL=upstream_url)
+    worker_class, application = ENGINES[engine]
+    cmd = [
+        sys.executable,
+        '-m',
+        'gunicorn',
+        '--workers',
+        str(workers),
+        '--bind',
+        f'127.0.0.1:{port}',
+        '--worker-class',
+        worker_class,
+        application,
+    ]
+    return start(cmd, env)
+
+
+async def load(url, total, concurrency):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                queue.get_nowait()
+                start_time = time.perf_counter()
+                try:
+                    response = await client.get(url, headers={'Authorization': 'x'})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start_time)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'concurrency': concurrency,
+        'errors': errors,
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--engines', nargs='+', default=['wsgi', 'asgi'])
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    upstream_port = free_port()
+    upstream = start_upstream(upstream_port, args.latency_ms)
+    results = {}
+    try:
+        wait_for(f'http://127.0.0.1:{upstream_port}/status')
+        for engine in args.engines:
+            port = free_port()
+            gateway = start_gateway(
+                engine, port, args.workers, f'http://127.0.0.1:{upstream_port}'
+            )
+            try:
+                wait_for(f'http://127.0.0.1:{port}/api/status')
+                results[engine] = asyncio.run(
+                    load(
+                        f'http://127.0.0.1:{port}/api/courses/v1/courses',
+                        args.requests,
+                        args.concurrency,
+                    )
+                )
+            finally:
+                gateway.terminate()
+                gateway.wait()
+            print(engine, json.dumps(results[engine]))
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
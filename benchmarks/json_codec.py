@@ -0,0 +1,141 @@
+"""Throughput of the JSON codec backends on the gateway payloads.
+
+Encodes and decodes the shapes the gateway relays most: a page of courses,
+an exam with its questions and a list of exam resolutions, with the stdlib
+backend and, when it is installed, orjson.
+
+    poetry run python benchmarks/json_codec.py --iterations 2000
+"""
+import argparse
+import datetime
+import json
+from pathlib import Path
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+from api_gateway.helpers import codec  # noqa: E402
+
+
+def object_id(i):
+    return f'{i:024x}'
+
+
+def courses(count=50):
+    created = datetime.datetime(2021, 11, 30, 18, 42, 8, 773000)
+    return [
+        {
+            '_id': object_id(i),
+            'name': f'Introducción a la programación {i}',
+            'description': 'Aprendé los fundamentos de la programación. ' * 5,
+            'category': 'Programación',
+            'subscription': 'Premium' if i % 3 else 'Free',
+            'location': {'lat': -34.6037, 'lon': -58.3816},
+            'hashtags': ['python', 'algoritmos', 'año2021'],
+            'creatorId': object_id(i + 1000),
+            'professors': [object_id(i + 2000 + j) for j in range(3)],
+            'students': [object_id(i + 3000 + j) for j in range(40)],
+            'multimedia': [
+                {'type': 'video', 'url': f'https://cdn.example.com/{i}/{j}.mp4'}
+                for j in range(4)
+            ],
+            'published': bool(i % 2),
+            'createdAt': created.isoformat(),
+            'updatedAt': created.isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+def exam(questions=30):
+    return {
+        '_id': object_id(1),
+        'courseId': object_id(2),
+        'name': 'Parcial de álgebra',
+        'state': 'published',
+        'questions': [
+            {
+                'number': i,
+                'type': 'multiple_choice' if i % 2 else 'development',
+                'text': f'¿Cuál es el resultado de la operación {i}?',
+                'choices': [f'Opción {j}' for j in range(4)] if i % 2 else None,
+                'score': 10,
+            }
+            for i in range(questions)
+        ],
+    }
+
+
+def resolutions(count=40):
+    return [
+        {
+            '_id': object_id(i),
+            'examId': object_id(1),
+            'studentId': object_id(i + 3000),
+            'answers': [
+                {'number': j, 'answer': 'La respuesta es 42, según el apunte.'}
+                for j in range(30)
+            ],
+            'score': 7.5,
+            'evaluated': True,
+            'comments': 'Muy bien, revisá el ejercicio 3.',
+        }
+        for i in range(count)
+    ]
+
+
+def rate(func, iterations, size):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - started
+    return {
+        'ops_per_s': round(iterations / elapsed),
+        'mb_per_s': round(iterations * size / elapsed / 1e6, 1),
+    }
+
+
+def measure(dumps, loads, payload, iterations):
+    encoded = dumps(payload).encode()
+    return {
+        'bytes': len(encoded),
+        'dumps': rate(lambda: dumps(payload), iterations, len(encoded)),
+        'loads': rate(lambda: loads(encoded), iterations, len(encoded)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    backends = [('json', codec._json_dumps, json.loads)]  # pylint: disable=W0212
+    if codec.orjson is not None:
+        backends.append(
+            ('orjson', codec._orjson_dumps, codec.orjson.loads)  # pylint: disable=W0212
+        )
+    else:
+        print('orjson is not installed, skipping it', file=sys.stderr)
+    payloads = [
+        ('courses', courses()),
+        ('exam', exam()),
+        ('resolutions', resolutions()),
+    ]
+
+    results = {}
+    for backend, dumps, loads in backends:
+        for shape, payload in payloads:
+            name = f'{backend}-{shape}'
+            results[name] = measure(dumps, loads, payload, args.iterations)
+            print(name, json.dumps(results[name]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+"""Load test of the gunicorn served gateway against local stand-in upstreams.
+
+Starts one stub server (`stub_upstream.py`) per upstream (auth-server,
+courses and payments), each with its own latency distribution, error rate
+and response size, points the gateway clients at them through
+`AUTH_SERVER_URL`, `COURSES_URL` and `PAYMENTS_URL` and serves the gateway
+with gunicorn. Virtual users then replay a mix of Ubademy sessions:
+
+- browse: list the courses of a category, open one and list its exams.
+- exam: open an exam and submit a resolution.
+- subscription: check the logged user and their subscription.
+
+RPS, p50/p95/p99 latencies and error rates are reported per route and in
+total, along with the mean of each `Server-Timing` phase the (WSGI) gateway
+reports. Requires gunicorn, uvicorn and httpx:
+
+    poetry run pip install gunicorn
+    poetry install -E asgi
+    poetry run python benchmarks/load.py --duration 30 --users 50 \\
+        --latency-ms auth-server=30 courses=80 payments=150 \\
+        --error-rate courses=0.01 --mix browse=70 exam=20 subscription=10
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+from pathlib import Path
+import random
+import statistics
+import sys
+import time
+
+import httpx
+
+from engines import ENGINES, free_port, start, wait_for
+
+# upstream -> environment variable of the gateway pointing at it
+UPSTREAMS = {
+    'auth-server': 'AUTH_SERVER_URL',
+    'courses': 'COURSES_URL',
+    'payments': 'PAYMENTS_URL',
+}
+COURSE_ID = '61a7ab6f1be24d0010b1e0c9'
+EXAM_ID = '61a7ab6f1be24d0010b1e0d1'
+
+# scenario -> steps of (route, method, path, JSON body)
+SCENARIOS = {
+    'browse': [
+        ('list courses', 'GET', '/api/courses/v1/courses?category=Party', None),
+        ('get course', 'GET', f'/api/courses/v1/courses/{COURSE_ID}', None),
+        ('list exams', 'GET', f'/api/courses/v1/courses/{COURSE_ID}/exams', None),
+    ],
+    'exam': [
+        (
+            'get exam',
+            'GET',
+            f'/api/courses/v1/courses/{COURSE_ID}/exams/{EXAM_ID}',
+            None,
+        ),
+        (
+            'submit resolution',
+            'POST',
+            f'/api/courses/v1/courses/{COURSE_ID}/exams/{EXAM_ID}/resolutions',
+            {'answers': [{'number': i, 'answer': 'La respuesta'} for i in range(10)]},
+        ),
+    ],
+    'subscription': [
+        ('get logged user', 'GET', '/api/auth-server/v1/users/me', None),
+        (
+            'get subscription',
+            'GET',
+            '/api/payments/v1/getSubscription/61a6ef1051e72a00102e5222',
+            None,
+        ),
+    ],
+}
+
+
+def pairs(values, cast, choices):
+    """Parse `name=value` arguments."""
+    parsed = {}
+    for value in values or ():
+        name, _, raw = value.partition('=')
+        if name not in choices:
+            raise SystemExit(f'{name} is not one of {sorted(choices)}')
+        parsed[name] = cast(raw)
+    return parsed
+
+
+def make_token(user):
+    def encode(segment):
+        return (
+            base64.urlsafe_b64encode(json.dumps(segment).encode()).decode().rstrip('=')
+        )
+
+    claims = {'_id': f'{user:024x}', 'expirationDate': '2099-12-21T23:21:01.773Z'}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(claims)}.signature"
+
+
+def start_stub(port, latency_ms, dist, error_rate, items):
+    env = dict(
+        os.environ,
+        STUB_LATENCY_MS=str(latency_ms),
+        STUB_LATENCY_DIST=dist,
+        STUB_ERROR_RATE=str(error_rate),
+        STUB_ITEMS=str(items),
+    )
+    cmd = [
+        sys.executable,
+        '-m',
+        'uvicorn',
+        '--app-dir',
+        'benchmarks',
+        '--port',
+        str(port),
+        '--log-level',
+        'warning',
+        'stub_upstream:app',
+    ]
+    return start(cmd, env)
+
+
+def start_gateway(engine, port, workers, urls):
+    # the virtual users measure throughput, not the per token limits
+    env = dict(
+        os.environ, SERVER_TIMING_TOKEN='load', RATE_LIMIT_ENABLED='false', **urls
+    )
+    worker_class, application = ENGINES[engine]
+    cmd = [
+        sys.executable,
+        '-m',
+        'gunicorn',
+        '--workers',
+        str(workers),
+        '--bind',
+        f'127.0.0.1:{port}',
+        '--worker-class',
+        worker_class,
+        application,
+    ]
+    return start(cmd, env)
+
+
+def server_timing(header):
+    """Durations, in milliseconds, of a `Server-Timing` header."""
+    timings = {}
+    for metric in header.split(','):
+        name, _, params = metric.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'dur':
+                timings[name] = float(value)
+    return timings
+
+
+def summary(samples, elapsed):
+    latencies = sorted(latency for latency, _, _ in samples)
+    errors = sum(1 for _, ok, _ in samples if not ok)
+    phases = {}
+    for _, _, timings in samples:
+        for name, duration in timings.items():
+            phases.setdefault(name, []).append(duration)
+
+    def percentile(p):
+        return round(latencies[max(int(len(latencies) * p) - 1, 0)] * 1000, 1)
+
+    return {
+        'requests': len(samples),
+        'rps': round(len(samples) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'error_rate': round(errors / len(samples), 4),
+        'server_timing_ms': {
+            name: round(statistics.mean(durations), 2)
+            for name, durations in phases.items()
+        },
+    }
+
+
+async def load(base_url, users, duration, mix):
+    samples = {}
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=users)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+
+        async def user(index):
+            headers = {'Authorization': make_token(index), 'X-Server-Timing': 'load'}
+            while time.monotonic() < deadline:
+                scenario = random.choices(names, weights)[0]  # nosec
+                for route, method, path, body in SCENARIOS[scenario]:
+                    started = time.perf_counter()
+                    timings = {}
+                    try:
+                        response = await client.request(
+                            method, path, json=body, headers=headers
+                        )
+                        ok = response.status_code < 500
+                        timings = server_timing(
+                            response.headers.get('Server-Timing', '')
+                        )
+                    except httpx.HTTPError:
+                        ok = False
+                    samples.setdefault(route, []).append(
+                        (time.perf_counter() - started, ok, timings)
+                    )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user(index) for index in range(users)))
+        elapsed = time.perf_counter() - started
+
+    results = {
+        route: summary(route_samples, elapsed)
+        for route, route_samples in samples.items()
+    }
+    results['total'] = summary(
+        [sample for route_samples in samples.values() for sample in route_samples],
+        elapsed,
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--users', type=int, default=50, help='virtual users')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='wsgi')
+    parser.add_argument(
+        '--mix', nargs='+', help='scenario=weight, browse=70 exam=20 subscription=10'
+    )
+    parser.add_argument('--latency-ms', nargs='+', help='upstream=mean latency')
+    parser.add_argument(
+        '--latency-dist',
+        choices=['fixed', 'exponential', 'lognormal'],
+        default='lognormal',
+    )
+    parser.add_argument('--error-rate', nargs='+', help='upstream=fraction of 503s')
+    parser.add_argument('--items', nargs='+', help='upstream=items per list')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    mix = {'browse': 70, 'exam': 20, 'subscription': 10}
+    mix.update(pairs(args.mix, float, SCENARIOS))
+    latencies = {'auth-server': 30, 'courses': 80, 'payments': 150}
+    latencies.update(pairs(args.latency_ms, float, UPSTREAMS))
+    error_rates = pairs(args.error_rate, float, UPSTREAMS)
+    items = pairs(args.items, int, UPSTREAMS)
+
+    processes = []
+    try:
+        urls = {}
+        for upstream, variable in UPSTREAMS.items():
+            port = free_port()
+            processes.append(
+                start_stub(
+                    port,
+                    latencies[upstream],
+                    args.latency_dist,
+                    error_rates.get(upstream, 0),
+                    items.get(upstream, 20),
+                )
+            )
+            urls[variable] = f'http://127.0.0.1:{port}'
+        for url in urls.values():
+            wait_for(f'{url}/status')
+
+        port = free_port()
+        processes.append(start_gateway(args.engine, port, args.workers, urls))
+        wait_for(f'http://127.0.0.1:{port}/api/status')
+        results = asyncio.run(
+            load(f'http://127.0.0.1:{port}', args.users, args.duration, mix)
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    for route, result in results.items():
+        print(route, json.dumps(result))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Records per second of the JSON log formatters.
+
+Compares the previous python-json-logger based formatter with
+`api_gateway.helpers.logger.JsonFormatter`, using orjson and the stdlib
+json backends of the codec, on the kind of records the gateway logs.
+
+    poetry run python benchmarks/log_formatter.py --records 100000
+"""
+import argparse
+import datetime
+import json
+import logging
+from pathlib import Path
+import sys
+import time
+from unittest import mock
+
+from pythonjsonlogger import jsonlogger
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+from api_gateway.helpers import codec  # noqa: E402
+from api_gateway.helpers import logger as gateway_logger  # noqa: E402
+
+
+class CustomJsonFormatter(jsonlogger.JsonFormatter):
+    """The formatter the gateway used before."""
+
+    def add_fields(self, log_record, record, message_dict):
+        super(CustomJsonFormatter, self).add_fields(log_record, record, message_dict)
+        if not log_record.get('timestamp'):
+            now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+            log_record['timestamp'] = now
+        if log_record.get('level'):
+            log_record['level'] = log_record['level'].upper()
+        else:
+            log_record['level'] = record.levelname
+
+
+def make_records(count):
+    records = []
+    for i in range(count):
+        if i % 2:
+            record = logging.LogRecord(
+                'root', logging.INFO, __file__, 1, 'Courses Call', (), None
+            )
+        else:
+            record = logging.LogRecord(
+                'root',
+                logging.INFO,
+                __file__,
+                1,
+                '%s method: %s, path: %s, status_code: %s, content_length: %s',
+                ('CourseClient', 'get', f'/courses/v1/courses/{i}', 200, '5120'),
+                None,
+            )
+            record.status_code = 200
+        records.append(record)
+    return records
+
+
+def measure(formatter, records):
+    started = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+    elapsed = time.perf_counter() - started
+    return {
+        'records': len(records),
+        'records_per_s': round(len(records) / elapsed),
+        'us_per_record': round(elapsed / len(records) * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    records = make_records(args.records)
+    results = {}
+    results['python-json-logger'] = measure(CustomJsonFormatter(), records)
+    print('python-json-logger', json.dumps(results['python-json-logger']))
+
+    # pylint: disable=protected-access
+    backends = [('gateway-json', codec._json_dumps)]
+    if codec.orjson is not None:
+        backends.append(('gateway-orjson', codec._orjson_dumps))
+    else:
+        print('orjson is not installed, skipping it', file=sys.stderr)
+    for name, dumps in backends:
+        with mock.patch.object(codec, 'dumps', dumps):
+            results[name] = measure(gateway_logger.JsonFormatter(), records)
+        print(name, json.dumps(results[name]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Per route overhead of the gateway, compared against a stored baseline.
+
+Every upstream call is answered in memory by a stub transport mounted on
+the clients, so what is measured is the gateway own work for each route:
+the auth check, path building, JSON handling, logging and serialization.
+For each route the time per request and the memory allocated while
+serving it (peak traced by `tracemalloc`) are recorded.
+
+With `--baseline`, the results are compared with a previous run and the
+script exits with status 1 when a route got slower or allocates more than
+`--tolerance` allows. `--save-baseline` stores the current results as the
+new baseline. Both runs also time a fixed reference workload, and the
+baseline timings are scaled by how much faster or slower it ran this time,
+so a baseline taken on another machine still gives a fair comparison.
+
+    poetry run python benchmarks/overhead.py --baseline benchmarks/baselines/overhead.json
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import statistics
+import sys
+import time
+import tracemalloc
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.response import HTTPResponse
+from werkzeug.test import EnvironBuilder
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# pylint: disable=wrong-import-position
+from api_gateway.app import create_app  # noqa: E402
+from api_gateway.clients.auth_server_client import auth_server_client  # noqa: E402
+from api_gateway.clients.course_client import course_client  # noqa: E402
+from api_gateway.clients.payment_client import payment_client  # noqa: E402
+from api_gateway.helpers.logger import log_handler  # noqa: E402
+from api_gateway.helpers.rate_limit import rate_limiter  # noqa: E402
+from api_gateway.helpers.response_cache import response_cache  # noqa: E402
+from api_gateway.namespaces.status import namespace as status_namespace  # noqa: E402
+from stub_upstream import body_for  # noqa: E402
+
+COURSE = {'name': 'Fiesta', 'description': 'Curso de organizacion de fiestas'}
+
+# name -> (method, path, JSON body)
+ROUTES = {
+    'courses-list': ('GET', '/api/courses/v1/courses', None),
+    'courses-get': ('GET', '/api/courses/v1/courses/61a7ab6f1be24d0010b1e0c9', None),
+    'courses-create': ('POST', '/api/courses/v1/courses', COURSE),
+    'users-me': ('GET', '/api/auth-server/v1/users/me', None),
+    'payments-subscription': (
+        'GET',
+        '/api/payments/v1/getSubscription/60456ebb0190bf001f6bbee2',
+        None,
+    ),
+    'status': ('GET', '/api/status/', None),
+}
+
+
+class StubAdapter(HTTPAdapter):
+    """Answers every request in memory, with the stub upstream bodies."""
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        path = request.path_url.split('?', 1)[0]
+        body = json.dumps(body_for(path)).encode()
+        raw = HTTPResponse(
+            body=io.BytesIO(body),
+            headers={
+                'Content-Type': 'application/json',
+                'Content-Length': str(len(body)),
+            },
+            status=201 if request.method == 'POST' else 200,
+            preload_content=False,
+        )
+        return self.build_response(request, raw)
+
+
+def make_token():
+    def encode(segment):
+        return (
+            base64.urlsafe_b64encode(json.dumps(segment).encode()).decode().rstrip('=')
+        )
+
+    claims = {'_id': 'benchmark', 'expirationDate': '2099-12-21T23:21:01.773Z'}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(claims)}.signature"
+
+
+def make_environ(method, path, body, token):
+    builder = EnvironBuilder(
+        path,
+        method=method,
+        headers={'Authorization': token},
+        json=body if body is not None else None,
+    )
+    try:
+        environ = builder.get_environ()
+        body_bytes = environ['wsgi.input'].read()
+    finally:
+        builder.close()
+    return environ, body_bytes
+
+
+def serve(app, environ, body_bytes):
+    environ = dict(environ, **{'wsgi.input': io.BytesIO(body_bytes)})
+    statuses = []
+
+    def start_response(status, headers):  # pylint: disable=unused-argument
+        statuses.append(status)
+
+    body = app(environ, start_response)
+    try:
+        b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return statuses[0]
+
+
+def measure(app, route, total, alloc_total, token):
+    environ, body_bytes = make_environ(*route, token)
+    for _ in range(min(total, 100)):
+        status = serve(app, environ, body_bytes)
+    assert status[0] == '2', status  # nosec
+
+    latencies = []
+    for _ in range(total):
+        started = time.perf_counter()
+        serve(app, environ, body_bytes)
+        latencies.append(time.perf_counter() - started)
+
+    allocations = []
+    for _ in range(alloc_total):
+        tracemalloc.start()
+        serve(app, environ, body_bytes)
+        allocations.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'mean_us': round(statistics.mean(latencies) * 1e6, 1),
+        'p50_us': round(statistics.median(latencies) * 1e6, 1),
+        'p99_us': round(latencies[int(len(latencies) * 0.99) - 1] * 1e6, 1),
+        'alloc_kib': round(statistics.median(allocations) / 1024, 1),
+    }
+
+
+def reference_us(total):
+    """Median time of a fixed workload, a yardstick of the machine speed."""
+    courses = [dict(COURSE, id=str(index)) for index in range(50)]
+    timings = []
+    for _ in range(total):
+        started = time.perf_counter()
+        for course in json.loads(json.dumps(courses)):
+            ' '.join(f'{key}={value}' for key, value in sorted(course.items()))
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1e6, 1)
+
+
+def regressions(results, baseline, tolerance):
+    """Return a line for every metric worse than the baseline allows.
+
+    Baseline timings are scaled by the reference workload of each run.
+    """
+    scale = results['reference_us'] / baseline['reference_us']
+    found = []
+    for name, result in results['routes'].items():
+        previous = baseline['routes'].get(name)
+        if previous is None:
+            continue
+        for metric, expected in (
+            ('p50_us', round(previous['p50_us'] * scale, 1)),
+            ('alloc_kib', previous['alloc_kib']),
+        ):
+            if result[metric] > expected * (1 + tolerance):
+                found.append(
+                    f'{name} {metric}: {result[metric]} > {expected} '
+                    f'(+{tolerance:.0%} allowed)'
+                )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--alloc-requests', type=int, default=100)
+    parser.add_argument('--routes', nargs='+', choices=sorted(ROUTES))
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against the results in this file')
+    parser.add_argument(
+        '--save-baseline', action='store_true', help='overwrite --baseline'
+    )
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+
+    log_handler.setStream(open(os.devnull, 'w'))  # pylint: disable=R1732
+    response_cache.enabled = False
+    rate_limiter.enabled = False
+    status_namespace.poller_enabled = False
+    for client in (auth_server_client, course_client, payment_client):
+        client.adapter = StubAdapter()
+    app = create_app()
+    token = make_token()
+
+    results = {'reference_us': reference_us(args.requests), 'routes': {}}
+    print('reference', results['reference_us'])
+    for name in args.routes or ROUTES:
+        results['routes'][name] = measure(
+            app, ROUTES[name], args.requests, args.alloc_requests, token
+        )
+        print(name, json.dumps(results['routes'][name]))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if not args.baseline:
+        return
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2) + '\n')
+        return
+    found = regressions(results, json.loads(baseline_path.read_text()), args.tolerance)
+    for line in found:
+        print('regression', line, file=sys.stderr)
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Stand-in for the auth server, courses and payments upstreams.
+
+A minimal ASGI app answering every path the gateway proxies to, after an
+artificial delay. Configured through environment variables:
+
+- STUB_LATENCY_MS: mean delay before answering (default 100).
+- STUB_LATENCY_DIST: `fixed` (default), `exponential` or `lognormal`.
+- STUB_LATENCY_SIGMA: shape of the lognormal distribution (default 0.5).
+- STUB_ERROR_RATE: fraction of requests answered with a 503 (default 0).
+- STUB_ITEMS: number of items in list responses (default 20).
+"""
+import asyncio
+import json
+import math
+import os
+import random
+
+LATENCY = float(os.environ.get('STUB_LATENCY_MS', '100')) / 1000
+LATENCY_DIST = os.environ.get('STUB_LATENCY_DIST', 'fixed')
+LATENCY_SIGMA = float(os.environ.get('STUB_LATENCY_SIGMA', '0.5'))
+ERROR_RATE = float(os.environ.get('STUB_ERROR_RATE', '0'))
+ITEMS = int(os.environ.get('STUB_ITEMS', '20'))
+
+USER = {'_id': '61a6ef1051e72a00102e5222', 'name': 'joe', 'surname': 'Doe'}
+COURSE = {
+    '_id': '61a7ab6f1be24d0010b1e0c9',
+    'name': 'Fiesta',
+    'description': 'Curso de organizacion de fiestas',
+    'category': 'Party',
+    'subscription': 2,
+    'creatorId': USER['_id'],
+}
+SUBSCRIPTION = {'userId': USER['_id'], 'subscription': 2, 'status': 'active'}
+
+
+def body_for(path):
+    if path.endswith('/users/me'):
+        return USER
+    if path.endswith('/admin/users'):
+        return [USER]
+    if path.endswith('/status'):
+        return {'status': 'Online', 'creationDate': '0', 'description': 'stub'}
+    if path.startswith('/payments/'):
+        return SUBSCRIPTION
+    return [dict(COURSE, _id=f'{index:024x}') for index in range(ITEMS)]
+
+
+def latency():
+    if not LATENCY or LATENCY_DIST == 'fixed':
+        return LATENCY
+    if LATENCY_DIST == 'exponential':
+        return random.expovariate(1 / LATENCY)  # nosec
+    # lognormal, with its mean kept at LATENCY
+    mu = math.log(LATENCY) - LATENCY_SIGMA ** 2 / 2
+    return random.lognormvariate(mu, LATENCY_SIGMA)  # nosec
+
+
+async def app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    more_body = True
+    while more_body:
+        more_body = (await receive()).get('more_body', False)
+    await asyncio.sleep(latency())
+    if ERROR_RATE and random.random() < ERROR_RATE:  # nosec
+        status, body = 503, {'message': 'stub failure'}
+    else:
+        status, body = 200, body_for(scope['path'])
+    body = json.dumps(body).encode()
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')],
+        }
+    )
+    await send({'type': 'http.response.body', 'body': body})
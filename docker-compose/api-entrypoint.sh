@@ -1,4 +1,8 @@
 #!/bin/bash
 
 echo 'starting server'
-poetry run gunicorn -w 2 --bind 0.0.0.0:5000 "api_gateway.app:create_app()"
+if [ "$GATEWAY_ENGINE" = "asgi" ]; then
+    poetry run gunicorn -w 2 -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:5000 "api_gateway.asgi:app"
+else
+    poetry run gunicorn -w 2 --bind 0.0.0.0:5000 "api_gateway.app:create_app()"
+fi
@@ -68,6 +68,30 @@ def bandit(session):
     )
 
 
+@nox.session(reuse_venv=True)
+def benchmarks(session):
+    """Measure the gateway overhead per route against the stored baseline."""
+    session.install("poetry")
+    # the extras the scripts in benchmarks/ compare against or run on
+    session.run("poetry", "install", "-E", "asgi", "-E", "compression", "-E", "json")
+
+    cmd = [
+        "poetry",
+        "run",
+        "python",
+        "benchmarks/overhead.py",
+        "--output",
+        "benchmark-results.json",
+        "--baseline",
+        "benchmarks/baselines/overhead.json",
+    ]
+
+    if session.posargs:
+        cmd.extend(session.posargs)
+
+    session.run(*cmd)
+
+
 @nox.session(reuse_venv=True)
 def pyreverse(session):
     """Create class diagrams."""
@@ -0,0 +1,233 @@
+"""Asyncio serving mode test suite."""
+
+import asyncio
+import json
+
+# pylint:disable=redefined-outer-name,protected-access
+import pytest
+
+from api_gateway.asgi import app
+from api_gateway.clients.async_client import (
+    async_auth_server_client,
+    async_course_client,
+    async_payment_client,
+)
+from api_gateway.helpers.identity_cache import identity_cache
+from api_gateway.helpers.metrics import metrics
+from api_gateway.helpers.rate_limit import MemoryBuckets, rate_limiter
+
+httpx = pytest.importorskip('httpx')
+
+user_response_dto = {"_id": "61a6ef1051e72a00102e5222", "name": "joe"}
+
+
+@pytest.fixture
+def upstream_calls():
+    """Route the async clients to in-memory upstreams and record their calls."""
+    calls = []
+    responses = {
+        '/auth-server/v1/users/me': (200, user_response_dto),
+        '/auth-server/v1/admin/users': (200, [user_response_dto]),
+        '/auth-server/v1/status': (200, {'status': 'Online'}),
+        '/courses/v1/status': (200, {'status': 'Online'}),
+        '/courses/v1/courses': (200, ['course1', 'course2']),
+    }
+
+    def handler(request):
+        calls.append(request)
+        if request.url.path == '/payments/status':
+            raise httpx.ConnectError('Connection refused', request=request)
+        status_code, body = responses.get(request.url.path, (404, {}))
+        return httpx.Response(status_code, json=body)
+
+    identity_cache.clear()
+    rate_limiter.backend = MemoryBuckets()
+    clients = (async_auth_server_client, async_course_client, async_payment_client)
+    for client in clients:
+        client.breaker.reset()
+        client._client = httpx.AsyncClient(
+            base_url=client.url, transport=httpx.MockTransport(handler)
+        )
+    yield calls
+    for client in clients:
+        client._client = None
+
+
+def request(method, path, headers=None, body=None):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url='http://gateway'
+        ) as client:
+            return await client.request(method, path, headers=headers, json=body)
+
+    return asyncio.run(run())
+
+
+def test_get_courses(upstream_calls):
+    response = request(
+        'GET', '/api/courses/v1/courses?category=Party', {'Authorization': 'token'}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == ['course1', 'course2']
+    assert [str(call.url) for call in upstream_calls] == [
+        'https://ubademy-g2-auth-server.herokuapp.com/auth-server/v1/users/me',
+        'https://ubademy-g2-courses.herokuapp.com/courses/v1/courses?category=Party',
+    ]
+    assert upstream_calls[1].headers['x-user-id'] == user_response_dto['_id']
+    assert response.headers['access-control-allow-origin'] == '*'
+
+
+def test_post_courses_forwards_body(upstream_calls):
+    request(
+        'POST', '/api/courses/v1/courses', {'Authorization': 'token'}, {'name': 'x'}
+    )
+
+    assert json.loads(upstream_calls[1].content) == {'name': 'x'}
+    assert upstream_calls[1].method == 'POST'
+
+
+def test_invalid_json_body_is_rejected(upstream_calls):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url='http://gateway'
+        ) as client:
+            return await client.post(
+                '/api/courses/v1/courses',
+                content=b'{"name": ',
+                headers={'Authorization': 'token', 'Content-Type': 'application/json'},
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 400
+    assert upstream_calls == []
+
+
+def test_missing_authorization(upstream_calls):
+    response = request('GET', '/api/payments/v1/getContract')
+
+    assert response.status_code == 401
+    assert response.json() == {'message': 'Authorization token is required.'}
+    assert upstream_calls == []
+
+
+def test_unknown_route(upstream_calls):
+    assert request('GET', '/api/unknown', {'Authorization': 'token'}).status_code == 404
+
+
+@pytest.mark.parametrize(
+    'method, path, status_code',
+    [
+        ('GET', '/api/payments/v1', 404),
+        ('PUT', '/api/courses/v1/courses', 405),
+        ('GET', '/api/courses/v1', 404),
+    ],
+)
+def test_only_the_routes_of_the_namespaces_are_proxied(
+    upstream_calls, method, path, status_code
+):
+    response = request(method, path, {'Authorization': 'token'}, {})
+
+    assert response.status_code == status_code
+    assert upstream_calls == []
+
+
+def test_batch_authenticates_once(upstream_calls):
+    response = request(
+        'POST',
+        '/api/batch',
+        {'Authorization': 'token'},
+        {
+            'requests': [
+                {'method': 'GET', 'path': '/api/courses/v1/courses?category=Party'},
+                {'method': 'GET', 'path': '/api/courses/v1/status'},
+                {'method': 'GET', 'path': '/api/unknown/v1/things'},
+            ]
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json()['responses'] == [
+        {'status': 200, 'body': ['course1', 'course2']},
+        {'status': 200, 'body': {'status': 'Online'}},
+        {'status': 404, 'body': {'message': 'No route for /api/unknown/v1/things'}},
+    ]
+    paths = [call.url.path for call in upstream_calls]
+    assert paths.count('/auth-server/v1/users/me') == 1
+    assert len(paths) == 3
+
+
+def test_tokens_over_the_limit_get_429_before_any_upstream_call(
+    upstream_calls, monkeypatch
+):
+    monkeypatch.setitem(rate_limiter.limits, 'courses', (1.0, 1))
+
+    allowed = request('GET', '/api/courses/v1/courses', {'Authorization': 'token'})
+    limited = request('GET', '/api/courses/v1/courses', {'Authorization': 'token'})
+
+    assert allowed.status_code == 200
+    assert limited.status_code == 429
+    assert limited.headers['retry-after'] == '1'
+    assert limited.json() == {'message': 'Error: Too many requests'}
+    assert len(upstream_calls) == 2
+
+
+def test_batch_counts_sub_requests_against_the_rate_limit(upstream_calls, monkeypatch):
+    monkeypatch.setitem(rate_limiter.limits, 'courses', (1.0, 1))
+    courses = {'method': 'GET', 'path': '/api/courses/v1/courses'}
+
+    response = request(
+        'POST', '/api/batch', {'Authorization': 'token'}, {'requests': [courses] * 2}
+    )
+
+    assert response.json()['responses'] == [
+        {'status': 200, 'body': ['course1', 'course2']},
+        {
+            'status': 429,
+            'headers': {'Retry-After': '1'},
+            'body': {'message': 'Error: Too many requests'},
+        },
+    ]
+
+
+def test_metrics_endpoint(upstream_calls, monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    monkeypatch.setattr(metrics, 'token', 'secret')
+
+    request('GET', '/api/courses/v1/courses', {'Authorization': 'token'})
+    request('PUT', '/api/courses/v1/courses', {'Authorization': 'token'})
+    unauthorized = request('GET', '/metrics', {'Authorization': 'Bearer wrong'})
+    response = request('GET', '/metrics', {'Authorization': 'Bearer secret'})
+    metrics.clear()
+
+    assert unauthorized.status_code == 401
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/plain; version=0.0.4'
+    lines = response.text.splitlines()
+    assert (
+        'gateway_requests_total{route="courses",method="GET",status="200"} 1' in lines
+    )
+    assert (
+        'gateway_requests_total{route="courses",method="PUT",status="405"} 1' in lines
+    )
+    assert 'gateway_requests_in_flight{route="courses"} 0' in lines
+    assert 'gateway_upstream_requests_total{upstream="courses",status="200"} 1' in lines
+
+
+def test_batch_rejects_invalid_bodies(upstream_calls):
+    response = request('POST', '/api/batch', {'Authorization': 'token'}, {})
+
+    assert response.status_code == 400
+    assert upstream_calls == []
+
+
+def test_status_reports_offline_services(upstream_calls):
+    response = request('GET', '/api/status/', {'Authorization': 'token'})
+
+    assert response.status_code == 200
+    assert response.json()['courses'] == {'status': 'Online'}
+    assert response.json()['payments']['status'] == 'Offline'
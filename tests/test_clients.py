@@ -0,0 +1,1055 @@
+"""Upstream client layer test suite."""
+
+import base64
+import datetime
+import hashlib
+import hmac
+import io
+from http.client import HTTPMessage
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+# pylint:disable=redefined-outer-name,protected-access
+import pytest
+import requests
+from requests.cookies import extract_cookies_to_jar
+
+from api_gateway.clients.base_client import BaseClient
+from api_gateway.clients.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from api_gateway.clients.concurrency_limit import (
+    ConcurrencyLimiter,
+    ConcurrencyLimitError,
+)
+from api_gateway.clients.course_client import CourseClient
+from api_gateway.clients.hedging import Hedger
+from api_gateway.clients.payment_client import PaymentClient
+from api_gateway.helpers import codec
+from api_gateway.helpers.identity_cache import IdentityCache
+from api_gateway.helpers.logger import DroppingQueueHandler, JsonFormatter, LogPolicy
+from api_gateway.helpers.metrics import Metrics, MmapStore, StatsdPusher, metrics
+from api_gateway.helpers.profiling import Profiler
+from api_gateway.helpers.rate_limit import (
+    MemoryBuckets,
+    RateLimited,
+    RateLimiter,
+    SharedBuckets,
+)
+from api_gateway.helpers.response_cache import (
+    ENTRY_OVERHEAD,
+    CachedResponse,
+    ResponseCache,
+    cache_policy,
+)
+from api_gateway.helpers.router import PrefixRouter, Route
+from api_gateway.helpers.server_timing import Timer
+from api_gateway.helpers.tokens import InvalidToken, TokenVerifier
+
+
+def encode_segment(segment):
+    return base64.urlsafe_b64encode(json.dumps(segment).encode()).decode().rstrip('=')
+
+
+def sign_token(claims, secret, alg='HS256'):
+    signing_input = (
+        f"{encode_segment({'alg': alg, 'typ': 'JWT'})}.{encode_segment(claims)}"
+    )
+    signature = hmac.new(secret, signing_input.encode(), hashlib.sha256).digest()
+    return f"{signing_input}.{base64.urlsafe_b64encode(signature).decode().rstrip('=')}"
+
+
+claims = {
+    "email": "joe_doeaasl@gmail.com",
+    "_id": "61a6f1f7f7bc020010bae2b3",
+    "expirationDate": "2099-12-21T23:21:01.773Z",
+}
+
+
+class ExampleClient(BaseClient):
+    name = 'Example'
+    section = 'example'
+
+
+@pytest.fixture
+def example_client():
+    return ExampleClient('http://upstream.local')
+
+
+def test_session_is_reused_within_a_thread(example_client):
+    assert example_client.session is example_client.session
+
+
+def test_sessions_share_the_connection_pool(example_client):
+    sessions = []
+
+    def grab_session():
+        sessions.append(example_client.session)
+
+    thread = threading.Thread(target=grab_session)
+    thread.start()
+    thread.join()
+    sessions.append(example_client.session)
+
+    assert sessions[0] is not sessions[1]
+    assert sessions[0].get_adapter('http://upstream.local') is example_client.adapter
+    assert sessions[1].get_adapter('http://upstream.local') is example_client.adapter
+    assert example_client.pool_stats()['sessions'] == 2
+
+
+def test_pool_stats_are_exported(example_client, mocker, monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    mocker.patch.object(
+        example_client,
+        'pool_stats',
+        return_value={
+            'connectionsOpened': 2,
+            'connectionsReused': 5,
+            'idleConnections': 1,
+        },
+    )
+
+    lines = metrics.render().splitlines()
+    metrics.clear()
+
+    assert 'gateway_upstream_connections_opened_total{upstream="example"} 2' in lines
+    assert 'gateway_upstream_connections_reused_total{upstream="example"} 5' in lines
+    assert 'gateway_upstream_idle_connections{upstream="example"} 1' in lines
+
+
+def test_session_does_not_keep_upstream_cookies(example_client, mocker):
+    headers = HTTPMessage()
+    headers['Set-Cookie'] = 'sid=someone-else; Path=/'
+    response = mocker.Mock(_original_response=mocker.Mock(msg=headers))
+    request = requests.Request('GET', 'http://upstream.local/').prepare()
+
+    extract_cookies_to_jar(example_client.session.cookies, request, response)
+
+    assert len(example_client.session.cookies) == 0
+
+
+def test_pool_settings_from_environment(monkeypatch):
+    monkeypatch.setenv('UPSTREAM_POOL_MAXSIZE', '3')
+    monkeypatch.setenv('EXAMPLE_POOL_MAXSIZE', '7')
+    monkeypatch.setenv('UPSTREAM_KEEP_ALIVE', 'false')
+
+    client = ExampleClient('http://upstream.local')
+
+    assert client.pool_maxsize == 7
+    assert client.keep_alive is False
+    assert client.session.headers['Connection'] == 'close'
+    assert client.pool_stats()['poolMaxsize'] == 7
+
+
+def test_upstream_urls_from_environment(monkeypatch):
+    monkeypatch.setenv('FRUX_SC_URL', 'http://upstream.local')
+    monkeypatch.setenv('COURSES_URL', 'http://courses.local')
+
+    assert CourseClient().url == 'http://courses.local'
+    assert PaymentClient().url == 'http://upstream.local'
+
+
+def test_identity_cache_expires_and_evicts(monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    now = [1000.0]
+    cache = IdentityCache(ttl=10, maxsize=2, clock=lambda: now[0])
+
+    cache.put('token-1', 'user-1')
+    cache.put('token-2', 'user-2')
+    assert cache.get('token-1').user_id == 'user-1'
+    cache.put('token-3', 'user-3')
+
+    assert cache.get('token-2') is None
+    assert cache.get('token-3').user_id == 'user-3'
+
+    now[0] += 11
+    assert cache.get('token-1') is None
+    series = metrics.own()
+    metrics.clear()
+
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['evictions'] == 1
+    lookups = 'gateway_identity_cache_lookups_total{result="%s"}'
+    assert series[lookups % 'hit'] == (2,)
+    assert series[lookups % 'miss'] == (2,)
+    assert series['gateway_identity_cache_evictions_total'] == (1,)
+
+
+def cached(body, delta=0.0):
+    return CachedResponse(200, 'application/json', body, None, {}, 0.0, delta)
+
+
+@pytest.fixture
+def response_cache():
+    now = [1000.0]
+    cache = ResponseCache(
+        max_bytes=2 * (100 + ENTRY_OVERHEAD + 20),
+        default_ttl=5,
+        max_entry_bytes=100,
+        beta=0,
+        clock=lambda: now[0],
+    )
+    cache.now = now
+    return cache
+
+
+def test_response_cache_is_keyed_by_normalized_query_and_scope(response_cache):
+    response_cache.put('/courses/v1/courses?b=2&a=1', 'user-1', cached(b'mine'), 5)
+    response_cache.put('/courses/v1/exams', None, cached(b'shared'), 5)
+
+    assert response_cache.get('/courses/v1/courses?a=1&b=2', 'user-1').body == b'mine'
+    assert response_cache.get('/courses/v1/courses?a=1&b=2', 'user-2') is None
+    assert response_cache.get('/courses/v1/exams/', 'user-2').body == b'shared'
+    response_cache.now[0] += 5
+    assert response_cache.get('/courses/v1/exams', 'user-2') is None
+
+
+def test_response_cache_evicts_least_recently_used_bytes(response_cache):
+    response_cache.put('/courses/v1/a', None, cached(b'a' * 100), 5)
+    response_cache.put('/courses/v1/b', None, cached(b'b' * 100), 5)
+    response_cache.get('/courses/v1/a', None)
+    response_cache.put('/courses/v1/c', None, cached(b'c' * 100), 5)
+
+    assert response_cache.get('/courses/v1/b', None) is None
+    assert response_cache.get('/courses/v1/a', None) is not None
+    assert response_cache.stats()['evictions'] == 1
+    assert response_cache.size <= response_cache.max_bytes
+
+
+def test_response_cache_invalidates_written_resource(response_cache):
+    response_cache.put('/courses/v1/courses', 'user-1', cached(b'list'), 5)
+    response_cache.put('/courses/v1/courses/1/exams', 'user-1', cached(b'exams'), 5)
+    response_cache.put('/courses/v1/coursesx', 'user-1', cached(b'other'), 5)
+
+    response_cache.invalidate('/courses/v1/courses/1?force=true')
+
+    assert response_cache.get('/courses/v1/courses', 'user-1') is None
+    assert response_cache.get('/courses/v1/courses/1/exams', 'user-1') is None
+    assert response_cache.get('/courses/v1/coursesx', 'user-1') is not None
+
+
+def test_response_cache_expires_early_near_expiry(response_cache):
+    response_cache.beta = 1.0
+    response_cache.rand = lambda: 0.9
+    response_cache.put('/courses/v1/courses', None, cached(b'list', delta=1.0), 5)
+
+    assert response_cache.get('/courses/v1/courses', None) is not None
+    response_cache.now[0] += 3
+    assert response_cache.get('/courses/v1/courses', None) is None
+    assert response_cache.stats()['earlyExpirations'] == 1
+
+
+@pytest.mark.parametrize(
+    'headers, policy',
+    [
+        ({}, (5, False)),
+        ({'Cache-Control': 'public, max-age=60, s-maxage=120'}, (120, True)),
+        ({'Cache-Control': 'private, max-age=30'}, (30, False)),
+        ({'Cache-Control': 'no-store'}, None),
+        ({'Cache-Control': 'no-cache'}, None),
+        ({'Cache-Control': 'max-age=0'}, None),
+        ({'Set-Cookie': 'session=1'}, None),
+    ],
+)
+def test_response_cache_honours_cache_control(headers, policy):
+    assert cache_policy(headers, 5) == policy
+
+
+def test_token_verifier_accepts_tokens_signed_with_any_key():
+    verifier = TokenVerifier(['old-secret', 'new-secret'])
+
+    assert verifier.verify(sign_token(claims, b'new-secret'))['_id'] == claims['_id']
+    assert verifier.verify(sign_token(claims, b'old-secret'))['_id'] == claims['_id']
+
+
+@pytest.mark.parametrize(
+    'token,message',
+    [
+        (sign_token(claims, b'other-secret'), 'Invalid token'),
+        (sign_token(claims, b'secret', alg='none'), 'Invalid token'),
+        ('not-a-token', 'Invalid token'),
+        (
+            sign_token(
+                dict(claims, expirationDate='2021-12-21T23:21:01.773Z'), b'secret'
+            ),
+            'Token expired',
+        ),
+    ],
+)
+def test_token_verifier_rejects_tokens(token, message):
+    verifier = TokenVerifier(['secret'])
+
+    with pytest.raises(InvalidToken) as error:
+        verifier.verify(token)
+
+    assert error.value.message == message
+
+
+def test_token_verifier_rejects_revoked_tokens():
+    verifier = TokenVerifier(['secret'])
+    token = sign_token(claims, b'secret')
+
+    verifier.revoke(token)
+
+    with pytest.raises(InvalidToken):
+        verifier.verify(token)
+
+
+def test_token_verifier_is_disabled_without_secrets():
+    assert not TokenVerifier(['', '']).enabled
+
+
+def test_requests_use_configured_timeouts(monkeypatch, mocker):
+    monkeypatch.setenv('EXAMPLE_CONNECT_TIMEOUT', '1.5')
+    monkeypatch.setenv('EXAMPLE_READ_TIMEOUT', '4')
+    response = requests.Response()
+    response.status_code = 200
+    send = mocker.patch('requests.adapters.HTTPAdapter.send', return_value=response)
+
+    ExampleClient('http://upstream.local')._exchange('get', '/', None, {})
+
+    assert send.call_args.kwargs['timeout'] == (1.5, 4.0)
+
+
+@pytest.fixture
+def breaker():
+    now = [0.0]
+    circuit_breaker = CircuitBreaker(
+        'Example',
+        window_size=4,
+        minimum_calls=4,
+        failure_rate=0.5,
+        slow_call_duration=1.0,
+        open_duration=10,
+        half_open_calls=2,
+        clock=lambda: now[0],
+    )
+    circuit_breaker.now = now
+    return circuit_breaker
+
+
+def test_circuit_breaker_opens_on_failure_rate(breaker):
+    for failed in (False, True, False, True):
+        breaker.before_call()
+        breaker.record(failed, 0.1)
+
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.code == 503
+    assert error.value.retry_after == 10
+    assert breaker.stats()['transitions'] == {'closed->open': 1}
+
+
+def test_circuit_breaker_opens_on_slow_calls(breaker):
+    for _ in range(4):
+        breaker.record(False, 2.0)
+
+    assert breaker.state == OPEN
+
+
+def test_circuit_breaker_half_open_closes_after_trial_calls(breaker):
+    for _ in range(4):
+        breaker.record(True, 0.1)
+    breaker.now[0] = 11
+
+    breaker.before_call()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+
+    assert breaker.state == CLOSED
+
+
+def test_circuit_breaker_half_open_reopens_on_failure(breaker):
+    for _ in range(4):
+        breaker.record(True, 0.1)
+    breaker.now[0] = 11
+
+    breaker.before_call()
+    breaker.record(True, 0.1)
+
+    assert breaker.state == OPEN
+    assert breaker.stats()['transitions']['half_open->open'] == 1
+
+
+def test_concurrency_limiter_sheds_calls_over_the_limit(tmp_path):
+    limiter = ConcurrencyLimiter(
+        'Example', 'example', str(tmp_path / 'example.bin'), initial_limit=2
+    )
+    limiter.max_wait = 0
+
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError) as error:
+        limiter.acquire()
+    limiter.cancel()
+    limiter.acquire()
+
+    assert error.value.code == 503
+    assert error.value.retry_after == 1.0
+    assert limiter.stats()['inFlight'] == 2
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_concurrency_limiter_follows_latency(tmp_path):
+    limiter = ConcurrencyLimiter(
+        'Example',
+        'example',
+        str(tmp_path / 'example.bin'),
+        initial_limit=10,
+        min_limit=2,
+        max_limit=20,
+    )
+
+    # steady latency with the limit in use grows it
+    for _ in range(20):
+        for _ in range(10):
+            limiter.acquire()
+        for _ in range(10):
+            limiter.release(0.1)
+    grown = limiter.limit
+    # a few calls in flight never grow it
+    limiter.acquire()
+    limiter.release(0.1)
+    # calls much slower than the average shrink it
+    for _ in range(20):
+        limiter.acquire()
+    for _ in range(20):
+        limiter.release(1.0)
+    shrunk = limiter.limit
+    limiter.acquire()
+    limiter.release(0, failed=True)
+
+    assert grown == 20
+    assert shrunk < 15
+    assert limiter.limit == pytest.approx(max(shrunk * 0.9, 2))
+
+
+def test_concurrency_limiter_waits_for_a_slot(tmp_path):
+    limiter = ConcurrencyLimiter(
+        'Example', 'example', str(tmp_path / 'example.bin'), initial_limit=1
+    )
+    limiter.max_wait = 1.0
+    limiter.acquire()
+    releaser = threading.Timer(0.05, limiter.release, (0.1,))
+    releaser.start()
+
+    started = time.monotonic()
+    limiter.acquire()
+
+    assert 0.04 < time.monotonic() - started < 1.0
+    assert limiter.stats()['inFlight'] == 1
+
+
+def hold_a_slot(limiter, taken, release):
+    try:
+        limiter.acquire()
+    except ConcurrencyLimitError:
+        taken.put(False)
+        return
+    taken.put(True)
+    release.wait(5)
+    limiter.release(0.1)
+
+
+def leave_a_slot(limiter):
+    limiter.acquire()
+    os._exit(0)
+
+
+def test_concurrency_limit_covers_every_worker(monkeypatch, tmp_path):
+    """Sync workers have one call in flight each, the limit counts them all."""
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path / 'metrics'))
+    context = multiprocessing.get_context('fork')
+    limiter = ConcurrencyLimiter(
+        'Example', 'example', str(tmp_path / 'example.bin'), initial_limit=2
+    )
+    limiter.max_wait = 0
+    taken, release = context.Queue(), context.Event()
+    workers = [
+        context.Process(target=hold_a_slot, args=(limiter, taken, release))
+        for _ in range(3)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = sorted(taken.get(timeout=5) for _ in workers)
+    release.set()
+    for worker in workers:
+        worker.join(5)
+
+    assert outcomes == [False, True, True]
+    assert limiter.stats()['inFlight'] == 0
+
+
+def test_concurrency_slots_of_exited_workers_are_freed(monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path / 'metrics'))
+    context = multiprocessing.get_context('fork')
+    limiter = ConcurrencyLimiter(
+        'Example', 'example', str(tmp_path / 'example.bin'), initial_limit=1
+    )
+    limiter.max_wait = 0
+    worker = context.Process(target=leave_a_slot, args=(limiter,))
+    worker.start()
+    worker.join(5)
+
+    limiter.acquire()
+    metrics.clear()
+
+    assert limiter.stats()['inFlight'] == 1
+
+
+def test_concurrency_limit_is_exported_once_per_host(monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path / 'metrics'))
+    limiter = ConcurrencyLimiter(
+        'Example', 'example', str(tmp_path / 'example.bin'), initial_limit=7
+    )
+    limiter.acquire()
+
+    series = metrics.collect()
+    metrics.clear()
+
+    assert series['gateway_upstream_concurrency_limit{upstream="example"}'] == (7,)
+
+
+def test_circuit_breaker_exports_state_and_transitions(breaker, monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    breaker.before_call()
+    for _ in range(4):
+        breaker.record(True, 0.1)
+
+    series = metrics.own()
+    metrics.clear()
+
+    state = 'gateway_upstream_breaker_state{upstream="example",state="%s"}'
+    assert series[state % 'open'] == (1,)
+    assert series[state % 'closed'] == (0,)
+    assert series[
+        'gateway_upstream_breaker_transitions_total'
+        '{upstream="example",from="closed",to="open"}'
+    ] == (1,)
+
+
+class SlowThenFast:
+    """Callable whose first call blocks until released, later calls return."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+        self.responses = []
+
+    def __call__(self):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.close = lambda: setattr(response, 'closed', True)
+        response.closed = False
+        self.responses.append(response)
+        if self.calls == 1:
+            self.release.wait(5)
+        return response
+
+
+def test_hedger_hedges_slow_calls():
+    hedger = Hedger('Example', min_delay=0.01, max_delay=0.01, enabled=True)
+    call = SlowThenFast()
+
+    started = time.monotonic()
+    response = hedger.call(call)
+
+    assert time.monotonic() - started < 1
+    assert response is call.responses[1]
+    assert hedger.stats()['hedgeWins'] == 1
+    call.release.set()
+    hedger.executor.shutdown(wait=True)
+    assert call.responses[0].closed
+
+
+def test_hedges_are_exported(monkeypatch, tmp_path):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    hedger = Hedger(
+        'Example', min_delay=0.01, max_delay=0.01, enabled=True, section='example'
+    )
+    call = SlowThenFast()
+
+    hedger.call(call)
+    call.release.set()
+    lines = metrics.render().splitlines()
+    metrics.clear()
+    hedger.executor.shutdown(wait=True)
+
+    assert 'gateway_upstream_hedges_total{upstream="example"} 1' in lines
+    assert 'gateway_upstream_hedge_wins_total{upstream="example"} 1' in lines
+    assert 'gateway_upstream_hedges_over_budget_total{upstream="example"} 0' in lines
+
+
+def test_hedger_does_not_hedge_without_budget():
+    hedger = Hedger('Example', min_delay=0.01, max_delay=0.01, burst=0, enabled=True)
+    call = SlowThenFast()
+    threading.Timer(0.05, call.release.set).start()
+
+    response = hedger.call(call)
+
+    assert response is call.responses[0]
+    assert call.calls == 1
+    assert hedger.stats()['budgetExhausted'] == 1
+
+
+def test_a_hedged_get_is_one_half_open_trial_call(breaker, monkeypatch, mocker):
+    monkeypatch.setenv('EXAMPLE_HEDGE_ENABLED', 'true')
+    monkeypatch.setenv('EXAMPLE_HEDGE_MIN_DELAY', '0.01')
+    monkeypatch.setenv('EXAMPLE_HEDGE_MAX_DELAY', '0.01')
+    client = ExampleClient('http://upstream.local')
+    client.breaker = breaker
+    for _ in range(4):
+        breaker.record(True, 0.1)
+    breaker.now[0] = 11
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            time.sleep(0.1)
+        response = requests.Response()
+        response.status_code = 200
+        return response
+
+    mocker.patch('requests.Session.get', side_effect=get)
+
+    client._exchange('get', '/', None, {})
+    client.hedger.executor.shutdown(wait=True)
+
+    assert len(calls) == 2
+    # the second trial call of the half-open breaker is still to come
+    assert breaker.state == HALF_OPEN
+    assert breaker.stats()['transitions'] == {
+        'closed->open': 1,
+        'open->half_open': 1,
+    }
+
+
+def test_only_gets_are_hedged(monkeypatch, mocker):
+    monkeypatch.setenv('EXAMPLE_HEDGE_ENABLED', 'true')
+    client = ExampleClient('http://upstream.local')
+    response = requests.Response()
+    response.status_code = 201
+    hedged = mocker.patch.object(client.hedger, 'call', return_value=response)
+    mocker.patch('requests.Session.post', return_value=response)
+
+    client._exchange('post', '/', None, {})
+    assert not hedged.called
+    client._exchange('get', '/', None, {})
+    assert hedged.called
+
+
+def test_prefix_router_matches_longest_prefix_at_any_depth():
+    router = PrefixRouter()
+    api = Route('api', None, ('GET',), 0)
+    courses = Route('courses', None, ('GET',), 2)
+    router.add('/api', api)
+    router.add('/api/courses', courses)
+
+    assert router.match('/api/courses/v1/courses') is courses
+    assert router.match('/api/courses/v1/a/b/c/d/e/f/g/h/i') is courses
+    assert router.match('/api/courses/v1') is api
+    assert router.match('/api/coursesx/v1/courses') is api
+    assert router.match('/other/courses/v1/courses') is None
+
+
+def test_prefix_router_picks_the_deepest_route_of_a_prefix():
+    router = PrefixRouter()
+    collections = Route('courses', None, ('GET',), 2)
+    items = Route('courses', None, ('GET', 'PUT'), 3)
+    router.add('/api/courses', collections)
+    router.add('/api/courses', items)
+
+    assert router.match('/api/courses/v1/courses') is collections
+    assert router.match('/api/courses/v1/courses/1') is items
+    assert router.match('/api/courses/v1/courses/1/lessons') is items
+    assert router.match('/api/courses/v1') is None
+
+
+def upstream_response(body, length=True):
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    if length:
+        response.headers['Content-Length'] = str(len(body))
+    return response
+
+
+def concurrent_gets(example_client, mocker, callers, make_response, tokens):
+    release = threading.Event()
+
+    def get(url, **kwargs):  # pylint: disable=unused-argument
+        release.wait(5)
+        return make_response()
+
+    get_mock_call = mocker.patch('requests.Session.get', side_effect=get)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda token=tokens[i % len(tokens)]: results.append(
+                example_client._send('get', '/courses', None, {'x-auth-token': token})
+            )
+        )
+        for i in range(callers)
+    ]
+    for thread in threads:
+        thread.start()
+    while example_client.singleflight.stats()['coalesced'] < callers - len(tokens):
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    return get_mock_call, results
+
+
+def test_identical_concurrent_gets_share_one_request(
+    example_client, mocker, monkeypatch, tmp_path
+):
+    metrics.clear()
+    monkeypatch.setattr(metrics, 'directory', str(tmp_path))
+    get_mock_call, results = concurrent_gets(
+        example_client, mocker, 5, lambda: upstream_response(b'["course"]'), ['t1']
+    )
+    series = metrics.own()
+    metrics.clear()
+
+    assert get_mock_call.call_count == 1
+    assert results == [(['course'], 200)] * 5
+    assert example_client.singleflight.stats()['coalescingRatio'] == 0.8
+    calls = 'gateway_upstream_calls_%s_total{upstream="example"}'
+    assert series[calls % 'executed'] == (1,)
+    assert series[calls % 'coalesced'] == (4,)
+
+
+def test_concurrent_gets_are_coalesced_per_auth_scope(example_client, mocker):
+    get_mock_call, results = concurrent_gets(
+        example_client,
+        mocker,
+        4,
+        lambda: upstream_response(b'["course"]'),
+        ['t1', 't2'],
+    )
+
+    assert get_mock_call.call_count == 2
+    assert len(results) == 4
+
+
+def test_unbounded_bodies_are_not_shared(example_client, mocker):
+    get_mock_call, results = concurrent_gets(
+        example_client,
+        mocker,
+        3,
+        lambda: upstream_response(b'["course"]', length=False),
+        ['t1'],
+    )
+
+    assert get_mock_call.call_count == 3
+    assert results == [(['course'], 200)] * 3
+
+
+def make_record(level, msg, args, status_code=None):
+    record = logging.LogRecord('test', level, __file__, 1, msg, args, None)
+    if status_code is not None:
+        record.status_code = status_code
+    return record
+
+
+def test_log_policy_samples_successes_and_keeps_errors():
+    policy = LogPolicy(
+        {logging.DEBUG: 0.0},
+        success_rate=0.01,
+        arg_max_chars=100,
+        message_max_chars=100,
+        rand=lambda: 0.5,
+    )
+
+    assert not policy.filter(make_record(logging.INFO, 'ok %s', (1,), 200))
+    assert not policy.filter(make_record(logging.DEBUG, 'debug', ()))
+    assert policy.filter(make_record(logging.INFO, 'not found %s', (1,), 404))
+    assert policy.filter(make_record(logging.INFO, 'Courses Call', ()))
+    assert policy.filter(make_record(logging.ERROR, 'failed %s', (1,), 200))
+    assert policy.sampled_out == 2
+
+
+def test_log_policy_truncates_big_arguments():
+    policy = LogPolicy({}, 1.0, arg_max_chars=50, message_max_chars=100)
+    record = make_record(
+        logging.INFO,
+        'body: %s, text: %s',
+        ([{'name': f'course {i}'} for i in range(10000)], 'x' * 1000),
+    )
+
+    assert policy.filter(record)
+    body, text = record.args
+    assert len(body) < 100
+    assert text.startswith('x' * 50) and text.endswith('(950 more chars)')
+
+
+def test_queue_handler_counts_dropped_records():
+    handler = DroppingQueueHandler(queue.Queue(1))
+
+    handler.handle(make_record(logging.INFO, 'first %s', ('a',)))
+    handler.handle(make_record(logging.INFO, 'second', ()))
+
+    assert handler.queue.get_nowait().getMessage() == 'first a'
+    assert handler.dropped == 1
+
+
+def test_json_formatter_layout():
+    record = make_record(logging.INFO, 'path: %s', ('/courses',), 200)
+    record.created = 1638330128.5
+
+    assert json.loads(JsonFormatter().format(record)) == {
+        'message': 'path: /courses',
+        'status_code': 200,
+        'timestamp': '2021-12-01T03:42:08.500000Z',
+        'level': 'INFO',
+    }
+
+
+CODEC_PAYLOAD = {
+    'name': 'Introducción a la programación',
+    'tags': ['año', '日本語'],
+    'createdAt': datetime.datetime(2021, 12, 1, 3, 42, 8, 500000),
+    'updatedAt': datetime.datetime(2021, 12, 1, 3, 42, 8, tzinfo=datetime.timezone.utc),
+    'startDate': datetime.date(2022, 3, 14),
+    'price': 10.5,
+    'published': True,
+    'teacher': None,
+}
+
+
+@pytest.mark.parametrize('backend', ['json', 'orjson'])
+def test_codec_backends_encode_identically(backend):
+    if backend == 'orjson':
+        pytest.importorskip('orjson')
+    dumps = codec._orjson_dumps if backend == 'orjson' else codec._json_dumps
+
+    assert dumps(CODEC_PAYLOAD) == (
+        '{"name":"Introducción a la programación","tags":["año","日本語"],'
+        '"createdAt":"2021-12-01T03:42:08.500000",'
+        '"updatedAt":"2021-12-01T03:42:08+00:00","startDate":"2022-03-14",'
+        '"price":10.5,"published":true,"teacher":null}'
+    )
+    assert dumps({'big': 2 ** 70}) == '{"big":1180591620717411303424}'
+    assert dumps({'value': object()}, default=lambda obj: 'object') == (
+        '{"value":"object"}'
+    )
+
+
+def test_codec_round_trip():
+    encoded = codec.dumps_bytes(CODEC_PAYLOAD)
+
+    assert isinstance(encoded, bytes)
+    assert (
+        codec.loads(encoded)
+        == codec.loads(encoded.decode())
+        == codec.loads(codec.dumps(CODEC_PAYLOAD))
+    )
+    with pytest.raises(ValueError):
+        codec.loads(b'{"truncated": ')
+
+
+def test_codec_backend_selection():
+    assert codec.select_backend('json') == 'json'
+    assert codec.select_backend('auto') == (
+        'json' if codec.orjson is None else 'orjson'
+    )
+    with pytest.raises(ValueError):
+        codec.select_backend('simplejson')
+
+
+def test_session_encodes_json_bodies_with_codec(example_client, mocker):
+    response = requests.Response()
+    response.status_code = 200
+    send = mocker.patch('requests.adapters.HTTPAdapter.send', return_value=response)
+
+    example_client.session.post(
+        'https://example.com/x', json={'name': 'año'}, headers={'x-user-id': '1'}
+    )
+
+    request = send.call_args[0][0]
+    assert request.body == '{"name":"año"}'.encode()
+    assert request.headers['Content-Type'] == 'application/json'
+    assert request.headers['x-user-id'] == '1'
+
+
+def test_metrics_are_summed_over_workers(tmp_path, monkeypatch):
+    worker = Metrics(str(tmp_path))
+    worker.inc('gateway_requests_total', (('route', 'courses'),), 2)
+    worker.inc('gateway_requests_in_flight', (('route', 'courses'),))
+    worker.observe('gateway_request_duration_seconds', (('route', 'courses'),), 0.2)
+    # another worker, which already exited
+    monkeypatch.setattr('os.getpid', lambda: 999999999)
+    exited = Metrics(str(tmp_path))
+    exited.inc('gateway_requests_total', (('route', 'courses'),), 3)
+    exited.inc('gateway_requests_in_flight', (('route', 'courses'),))
+    exited.observe('gateway_request_duration_seconds', (('route', 'courses'),), 20)
+    monkeypatch.undo()
+
+    lines = worker.render().splitlines()
+
+    assert 'gateway_requests_total{route="courses"} 5' in lines
+    assert 'gateway_requests_in_flight{route="courses"} 1' in lines
+    assert (
+        'gateway_request_duration_seconds_bucket{route="courses",le="0.25"} 1' in lines
+    )
+    assert (
+        'gateway_request_duration_seconds_bucket{route="courses",le="+Inf"} 2' in lines
+    )
+    assert 'gateway_request_duration_seconds_count{route="courses"} 2' in lines
+    assert '# TYPE gateway_request_duration_seconds histogram' in lines
+
+
+def test_per_process_collectors_are_summed_over_workers(tmp_path, monkeypatch):
+    dropped = {'count': 2}
+    worker = Metrics(str(tmp_path), refresh_interval=60)
+    worker.add_collector(
+        lambda: [('gateway_log_records_dropped_total', (), dropped['count'])],
+        per_process=True,
+    )
+    worker.request_finished('courses', 'GET', 200, 0)
+    # another worker, which already exited
+    monkeypatch.setattr('os.getpid', lambda: 999999999)
+    exited = Metrics(str(tmp_path))
+    exited.set('gateway_log_records_dropped_total', (), 3)
+    monkeypatch.undo()
+
+    dropped['count'] = 4
+    worker.request_finished('courses', 'GET', 200, 0)
+    refreshed_later = worker.own()['gateway_log_records_dropped_total']
+    lines = worker.render().splitlines()
+
+    assert refreshed_later == (2.0,)
+    assert 'gateway_log_records_dropped_total 7' in lines
+    assert '# TYPE gateway_log_records_dropped_total counter' in lines
+
+
+def test_metrics_store_grows_and_reopens(tmp_path):
+    path = str(tmp_path / 'store.db')
+    store = MmapStore(path, initial_size=64)
+    for index in range(20):
+        store.add(f'series_{index}', index)
+    store.add('series_3', 1)
+    store.close()
+
+    reopened = MmapStore(path)
+    reopened.add('series_4', 1)
+
+    entries = reopened.entries()
+    assert len(entries) == 20
+    assert entries['series_3'] == (4.0,) and entries['series_4'] == (5.0,)
+
+
+def test_statsd_pusher_sends_deltas(tmp_path):
+    metrics = Metrics(str(tmp_path), buckets=(0.1, 1.0))
+    pusher = StatsdPusher(metrics, 'localhost', 8125, interval=10)
+    labels = (('upstream', 'courses'),)
+    metrics.inc('gateway_upstream_requests_total', labels + (('status', 200),), 2)
+    metrics.observe('gateway_upstream_request_duration_seconds', labels, 0.5)
+    metrics.inc('gateway_upstream_requests_in_flight', labels)
+
+    assert pusher.lines() == [
+        'gateway_upstream_requests_total:2|c|#upstream:courses,status:200',
+        'gateway_upstream_request_duration_seconds.count:1|c|#upstream:courses',
+        'gateway_upstream_request_duration_seconds.sum:0.5|c|#upstream:courses',
+        'gateway_upstream_request_duration_seconds.bucket:1|c|#upstream:courses,le:1',
+        'gateway_upstream_requests_in_flight:1|g|#upstream:courses',
+    ]
+    metrics.inc('gateway_upstream_requests_total', labels + (('status', 200),))
+    assert pusher.lines() == [
+        'gateway_upstream_requests_total:1|c|#upstream:courses,status:200',
+        'gateway_upstream_requests_in_flight:1|g|#upstream:courses',
+    ]
+
+
+def test_server_timing_counts_nested_phases_once(monkeypatch):
+    clock = iter([0.0, 1.0, 3.0, 4.0, 10.0, 12.0])
+    monkeypatch.setattr('time.perf_counter', lambda: next(clock))
+    timer = Timer()
+
+    timer.begin('upstream')
+    timer.begin('decode')
+    timer.end()
+    timer.end()
+
+    assert timer.durations == {'decode': 1.0, 'upstream': 8.0}
+    assert timer.header() == (
+        'decode;dur=1000.00, upstream;dur=8000.00, gateway;dur=3000.00, '
+        'total;dur=12000.00'
+    )
+
+
+def test_profiler_accepts_only_fresh_signed_headers():
+    profiler = Profiler('secret', '/tmp', 1, 1, max_ttl=600, clock=lambda: 1000)
+    other = Profiler('other', '/tmp', 1, 1, max_ttl=600, clock=lambda: 1000)
+
+    assert profiler.authorized(profiler.sign(300))
+    assert not profiler.authorized(other.sign(300))
+    assert not profiler.authorized(profiler.sign(-1))
+    assert not profiler.authorized(profiler.sign(3600))
+    assert not profiler.authorized('garbage')
+    assert not profiler.authorized('1300.sígnature')
+    assert not profiler.authorized('1²00.signature')
+    assert not profiler.authorized(None)
+
+
+def test_token_buckets_refill_at_the_configured_rate():
+    buckets = MemoryBuckets()
+
+    assert buckets.take('key', 2.0, 2, 100.0) == (True, 0.0)
+    assert buckets.take('key', 2.0, 2, 100.0) == (True, 0.0)
+    assert buckets.take('key', 2.0, 2, 100.0) == (False, 0.5)
+    assert buckets.take('key', 2.0, 2, 100.25) == (False, 0.25)
+    assert buckets.take('key', 2.0, 2, 100.5)[0]
+    assert buckets.take('other', 2.0, 2, 100.5)[0]
+
+
+def test_shared_buckets_are_shared_by_every_mapping(tmp_path):
+    path = str(tmp_path / 'buckets.bin')
+    first, second = SharedBuckets(path, slots=16), SharedBuckets(path, slots=16)
+    key = 'ab' * 32
+
+    assert first.take(key, 1.0, 2, 100.0)[0]
+    assert second.take(key, 1.0, 2, 100.0)[0]
+    assert first.take(key, 1.0, 2, 100.0) == (False, 1.0)
+    # more keys than slots evict the least recently updated ones
+    for index in range(64):
+        assert second.take(f'{index + 1:064x}', 1.0, 2, 101.0 + index)[0]
+
+
+def test_rate_limiter_limits_per_route_group():
+    limiter = RateLimiter(
+        MemoryBuckets(), {'courses': (1.0, 1), 'status': (0, 0)}, clock=lambda: 10.0
+    )
+
+    limiter.check('courses', 'token')
+    limiter.check('payments', 'token')
+    for _ in range(3):
+        limiter.check('status', 'token')
+    with pytest.raises(RateLimited) as error:
+        limiter.check('courses', 'token')
+    assert error.value.code == 429
+    assert error.value.retry_after == 1.0